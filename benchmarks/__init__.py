@@ -0,0 +1,16 @@
+"""Performance benchmarks for the public transport API.
+
+Run a benchmark module from the repository root, e.g.::
+
+    python -m benchmarks.stop_index
+"""
+
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+GTFS_DIR = REPO_ROOT / "OtwartyWroclaw_rozklad_jazdy_GTFS"
+
+# The application modules live in src/ and import each other as top-level
+# modules, the same way ``python src/app.py`` sees them.
+sys.path.insert(0, str(REPO_ROOT / "src"))
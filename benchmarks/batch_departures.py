@@ -0,0 +1,92 @@
+"""Departures for many points: one request per point versus one batch.
+
+Imports a synthetic feed and answers the same set of origin/destination
+queries once as a loop of ``get_closest_departures`` calls and once with
+``get_closest_departures_batch``, on both timetable backends. The HTTP cost is
+measured the same way through the Flask test client: one GET per point versus
+one POST to ``closest_departures/batch``::
+
+    python -m benchmarks.batch_departures [--points 500] [--trips 39000]
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import database
+import models
+from app import app, departures_cache
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from gtfs_import import import_feed
+from utils import format_gtfs_time
+
+
+def make_requests(feed, count, seed):
+    """Points scattered around one start stop, the way a walking-radius search asks."""
+    rng = random.Random(seed)
+    stops = feed["stops.txt"]
+    center, end = rng.sample(stops, 2)
+    start_time = f"2025-04-02T{format_gtfs_time(rng.randint(6 * 3600, 20 * 3600))}Z"
+    return [
+        (center[3] + rng.uniform(-0.01, 0.01), center[4] + rng.uniform(-0.015, 0.015),
+         end[3], end[4], start_time, 5)
+        for _ in range(count)
+    ]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000
+
+
+def query_string(request):
+    start_lat, start_lon, end_lat, end_lon, start_time, limit = request
+    return {
+        "start_coordinates": f"{start_lat},{start_lon}",
+        "end_coordinates": f"{end_lat},{end_lon}",
+        "start_time": start_time,
+        "limit": limit,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=500)
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    requests = make_requests(feed, args.points, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        del feed
+        database.configure(db_path)
+        models.get_stop_index()
+        print(f"{args.points} points")
+
+        for backend in models.BACKENDS:
+            models.set_backend(backend)
+            models.get_backend()  # load the in-memory engine outside the timing
+            single = timed(lambda: [models.get_closest_departures(*r) for r in requests])
+            batch = timed(lambda: models.get_closest_departures_batch(requests))
+            print(f"{backend:<7} one call per point {single:8.1f} ms   batch {batch:8.1f} ms")
+        models.set_backend("sqlite")
+
+        client = app.test_client()
+        url = "/public_transport/city/wroclaw/closest_departures"
+        departures_cache.clear()
+        single = timed(lambda: [client.get(url, query_string=query_string(r)) for r in requests])
+        batch = timed(lambda: client.post(
+            f"{url}/batch", json={"queries": [query_string(r) for r in requests]}
+        ))
+        print(f"{'http':<7} one GET per point   {single:8.1f} ms   POST batch {batch:8.1f} ms")
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
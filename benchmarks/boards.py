@@ -0,0 +1,71 @@
+"""Departure boards versus looking up a stop's next departures per request.
+
+Imports a Wrocław-sized synthetic feed and simulates kiosks polling the next
+departures of a few hundred stops within one minute. Each poll is answered
+once from the precomputed boards (``boards.DepartureBoards``) and once with a
+backend lookup of the stop's next departures serialized per request, as the
+board endpoint would do without them. The first poll of each stop builds
+its board; the rest are served from the cursor::
+
+    python -m benchmarks.boards [--trips 39000] [--stops 300] [--polls 20000]
+"""
+
+import argparse
+import json
+import random
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import database
+import models
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from benchmarks.timetable_engine import latencies, summarize
+from boards import DepartureBoards
+from gtfs_import import import_feed
+
+NOW = datetime(2025, 4, 2, 8, 10)
+START_TIME = NOW.strftime("%Y-%m-%dT%H:%M:00Z")
+
+
+def per_request(stop_id, limit):
+    stop = models.get_stop_index().get(stop_id)
+    rows = models.get_backend().departures(
+        [stop_id], NOW.hour * 3600 + NOW.minute * 60, limit, service_date=20250402
+    )
+    return json.dumps([models._departure(row, stop, START_TIME) for row in rows], sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--stops", type=int, default=300)
+    parser.add_argument("--polls", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    rng = random.Random(args.seed)
+    stop_ids = rng.sample([int(stop[0]) for stop in feed["stops.txt"]], args.stops)
+    cases = [(rng.choice(stop_ids), args.limit) for _ in range(args.polls)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        del feed
+        database.configure(db_path)
+        for backend in models.BACKENDS:
+            models.set_backend(backend)
+            models.get_backend()
+            models.get_stop_index()
+            boards = DepartureBoards(clock=lambda: NOW)
+            summarize(f"{backend:<7} per request", latencies(per_request, cases))
+            summarize(f"{backend:<7} boards", latencies(boards.departures, cases))
+            stats = boards.stats()
+            print(f"{'':<8}{stats['builds']} boards built, {stats['hits']} hits")
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Lazily loaded cities: cold and warm requests, and RSS against a memory budget.
+
+Imports one synthetic feed per city, configures all of them in a
+``CityRegistry`` and sends closest-departures requests to one city after
+another through the Flask test client, with the in-memory timetable backend
+so that every city holds its own engine. Reports the registry setup time,
+the latency of each city's first (loading) and later requests, and the RSS
+as cities load, with and without ``--budget-mib``::
+
+    python -m benchmarks.cities [--cities 6] [--trips 8000] [--budget-mib 25]
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import models
+from app import app, drop_city_caches
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from benchmarks.timetable_engine import rss_mib
+from cities import CityRegistry
+from gtfs_import import import_feed
+from utils import format_gtfs_time
+
+
+def departure_paths(city, feed, count, rng):
+    stops = feed["stops.txt"]
+    paths = []
+    for _ in range(count):
+        stop, end = rng.sample(stops, 2)
+        start_time = f"2025-04-02T{format_gtfs_time(rng.randint(5 * 3600, 22 * 3600))}Z"
+        paths.append(
+            f"/public_transport/city/{city}/closest_departures"
+            f"?start_coordinates={stop[3]},{stop[4]}&end_coordinates={end[3]},{end[4]}"
+            f"&start_time={start_time}&limit=5"
+        )
+    return paths
+
+
+def timed_get(client, path):
+    start = time.perf_counter()
+    response = client.get(path)
+    response.get_data()
+    assert response.status_code == 200, response.status_code
+    return (time.perf_counter() - start) * 1000
+
+
+def run(label, paths, budget_mib, requests_per_city):
+    import app as app_module
+
+    started = time.perf_counter()
+    registry = CityRegistry(
+        paths, memory_budget_bytes=budget_mib * 2**20 if budget_mib else None,
+        on_evict=drop_city_caches,
+    )
+    setup_ms = (time.perf_counter() - started) * 1000
+    app_module.cities = registry
+    client = app.test_client()
+    rss_start = rss_mib()
+    print(f"{label}: registry of {len(paths)} cities set up in {setup_ms:.2f} ms, "
+          f"RSS {rss_start:.1f} MiB")
+
+    cold, warm = [], []
+    for city, city_paths in requests_per_city.items():
+        cold.append(timed_get(client, city_paths[0]))
+        warm += [timed_get(client, path) for path in city_paths[1:]]
+        stats = registry.stats()
+        held = sum(loaded["memory_mib"] for loaded in stats["loaded"].values())
+        print(f"  after {city:<8} loaded {len(stats['loaded'])} holding {held:5.1f} MiB, "
+              f"RSS {rss_mib():7.1f} MiB, evictions {stats['evictions']}")
+    print(f"  first request of a city p50 {statistics.median(cold):8.1f} ms, "
+          f"later requests p50 {statistics.median(warm):6.2f} ms")
+    registry.close_all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cities", type=int, default=6)
+    parser.add_argument("--stops", type=int, default=1200)
+    parser.add_argument("--trips", type=int, default=8000)
+    parser.add_argument("--requests", type=int, default=200, help="requests per city")
+    parser.add_argument("--budget-mib", type=float, default=25)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    models.set_backend("memory")
+    with tempfile.TemporaryDirectory() as tmp:
+        paths, requests_per_city = {}, {}
+        for number in range(args.cities):
+            city = f"city{number}"
+            feed = generate_feed(args.stops, 60, args.trips, 20, args.seed + number)
+            paths[city] = Path(tmp) / f"{city}.sqlite"
+            import_feed(write_feed(Path(tmp) / city, feed), paths[city], verbose=False)
+            requests_per_city[city] = departure_paths(city, feed, args.requests, rng)
+            del feed
+
+        run("no budget", paths, None, requests_per_city)
+        run(f"budget {args.budget_mib:g} MiB", paths, args.budget_mib, requests_per_city)
+
+
+if __name__ == "__main__":
+    main()
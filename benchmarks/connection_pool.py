@@ -0,0 +1,109 @@
+"""Request latency with a connection per request versus the pooled connections.
+
+Imports a synthetic feed, then replays a paced mix of trip-details and
+closest-departures lookups at a fixed arrival rate from a thread pool, the way
+a threaded server would run them::
+
+    python -m benchmarks.connection_pool [--rate 200] [--seconds 10]
+"""
+
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import database
+import models
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from gtfs_import import import_feed
+from utils import format_gtfs_time
+
+
+def connection_per_request(path):
+    """The original get_db_connection: a fresh connection for every call."""
+    def connect():
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        return conn
+    return connect
+
+
+def make_requests(feed, count, seed):
+    rng = random.Random(seed)
+    trip_ids = [trip[2] for trip in feed["trips.txt"]]
+    stops = feed["stops.txt"]
+    requests = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            requests.append((models.get_trip_details, (rng.choice(trip_ids),)))
+        else:
+            stop, end = rng.sample(stops, 2)
+            start_time = f"2025-04-02T{format_gtfs_time(rng.randint(5 * 3600, 22 * 3600))}Z"
+            requests.append((models.get_closest_departures,
+                             (stop[3], stop[4], end[3], end[4], start_time, 5)))
+    return requests
+
+
+def replay(requests, rate, workers):
+    """Issue requests at ``rate`` per second; return latencies in ms."""
+    latencies = []
+    lock = threading.Lock()
+
+    def run(scheduled, fn, args):
+        fn(*args)
+        with lock:
+            latencies.append((time.perf_counter() - scheduled) * 1000)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        for i, (fn, args) in enumerate(requests):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(run, scheduled, fn, args)
+    return latencies
+
+
+def summarize(label, latencies):
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{label:<24} p50 {q[49]:6.2f} ms  p95 {q[94]:6.2f} ms  "
+          f"p99 {q[98]:6.2f} ms  max {max(latencies):7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=200)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        database.configure(db_path)
+        models.get_stop_index()  # built once per process in both setups
+        requests = make_requests(feed, int(args.rate * args.seconds), args.seed)
+        print(f"{len(requests)} requests at {args.rate:.0f} req/s, {args.workers} worker threads")
+
+        pooled_connect = models.get_db_connection
+        models.get_db_connection = connection_per_request(db_path)
+        try:
+            summarize("connection per request", replay(requests, args.rate, args.workers))
+        finally:
+            models.get_db_connection = pooled_connect
+        summarize("pooled connections", replay(requests, args.rate, args.workers))
+        print(database.pool_stats())
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
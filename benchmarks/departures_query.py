@@ -0,0 +1,127 @@
+"""Departure lookup: one query per nearby stop versus the single set-based query.
+
+Builds a full-day synthetic ``stop_times`` table and times the SQL part of
+``get_closest_departures`` for random start points and times::
+
+    python -m benchmarks.departures_query [--trips 39000] [--queries 300]
+"""
+
+import argparse
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic_feed import generate_feed
+from models import NEARBY_STOPS_LIMIT, _departures_query
+from spatial import StopIndex
+from utils import format_gtfs_time, parse_gtfs_time
+
+# The table layout of the original populate scripts, which the per-stop
+# queries need; the set-based query only relies on departure_sec.
+SCHEMA = """
+CREATE TABLE stops (stop_id INTEGER, stop_code INTEGER, stop_name TEXT,
+                    stop_lat REAL, stop_lon REAL);
+CREATE TABLE trips (route_id TEXT, service_id INTEGER, trip_id TEXT,
+                    trip_headsign TEXT, direction_id INTEGER, shape_id INTEGER,
+                    brigade_id INTEGER, vehicle_id INTEGER, variant_id INTEGER);
+CREATE TABLE stop_times (trip_id TEXT, arrival_time TEXT, departure_time TEXT,
+                         arrival_sec INTEGER, departure_sec INTEGER,
+                         stop_id INTEGER, stop_sequence INTEGER,
+                         pickup_type INTEGER, drop_off_type INTEGER);
+CREATE INDEX idx_stop_times_stop_departure ON stop_times (stop_id, departure_sec);
+CREATE INDEX idx_trips_trip_id ON trips (trip_id);
+"""
+
+
+def build_database(path, feed):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.executemany("INSERT INTO stops VALUES (?, ?, ?, ?, ?)", feed["stops.txt"])
+    conn.executemany("INSERT INTO trips VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", feed["trips.txt"])
+    conn.executemany(
+        "INSERT INTO stop_times VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (trip_id, arr, dep, parse_gtfs_time(arr), parse_gtfs_time(dep), *rest)
+            for trip_id, arr, dep, *rest in feed["stop_times.txt"]
+        ),
+    )
+    conn.commit()
+    return conn
+
+
+def per_stop_queries(conn, stops, start_time, limit):
+    """The original N+1 loop: every later departure of each stop, then cut."""
+    found = []
+    for stop in stops:
+        rows = conn.execute(
+            """SELECT st.*, t.route_id, t.trip_headsign
+               FROM stop_times st
+               JOIN trips t ON st.trip_id = t.trip_id
+               WHERE st.stop_id = ?
+               AND time(st.departure_time) >= time(?)
+               ORDER BY st.departure_time ASC""",
+            (stop["stop_id"], start_time),
+        ).fetchall()
+        for row in rows:
+            found.append((row["trip_id"], row["departure_time"]))
+            if len(found) >= limit:
+                return found
+    return found
+
+
+def set_based_query(conn, stops, start_time, limit):
+    params = []
+    for rank, stop in enumerate(stops):
+        params += [stop["stop_id"], rank]
+    params += [parse_gtfs_time(start_time), limit, limit]
+    rows = conn.execute(_departures_query(len(stops)), params).fetchall()
+    return [(row["trip_id"], format_gtfs_time(row["departure_sec"])) for row in rows]
+
+
+def _time_per_call(fn, cases):
+    start = time.perf_counter()
+    for args in cases:
+        fn(*args)
+    return (time.perf_counter() - start) / len(cases)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build_database(Path(tmp) / "trips.sqlite", feed)
+        conn.row_factory = sqlite3.Row
+        index = StopIndex.from_connection(conn)
+
+        rng = random.Random(args.seed)
+        cases = []
+        for _ in range(args.queries):
+            stop = rng.choice(feed["stops.txt"])
+            nearby = [s for _, s in index.nearest(stop[3], stop[4], k=NEARBY_STOPS_LIMIT)]
+            start_time = format_gtfs_time(rng.randint(5 * 3600, 23 * 3600))
+            cases.append((conn, nearby, start_time, args.limit))
+
+        for case in cases[:50]:
+            # Times past 24:00 are dropped by time() in the old query.
+            expected = [r for r in per_stop_queries(*case) if r[1] < "24"]
+            assert set_based_query(*case)[:len(expected)] == expected
+
+        old = _time_per_call(per_stop_queries, cases)
+        new = _time_per_call(set_based_query, cases)
+        conn.close()
+
+    print(f"stop_times rows: {len(feed['stop_times.txt'])}, queries: {len(cases)}, limit: {args.limit}")
+    print(f"per-stop queries: {old * 1000:8.2f} ms/request")
+    print(f"set-based query:  {new * 1000:8.2f} ms/request ({old / new:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
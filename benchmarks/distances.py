@@ -0,0 +1,71 @@
+"""Distance functions: scalar haversine versus the batch functions in ``utils``.
+
+Times distances from random query points to all Wrocław stops with the
+scalar ``haversine`` in a loop, ``haversine_many`` and ``equirectangular_many``
+(pure Python and, when installed, NumPy), and reports each batch function's
+largest error against the scalar haversine::
+
+    python -m benchmarks.distances [--queries 500]
+"""
+
+import argparse
+import random
+import time
+
+import utils
+from benchmarks.stop_index import load_stops
+from utils import equirectangular_many, haversine, haversine_many
+
+
+def scalar(lat, lon, lats, lons, use_numpy=None):
+    return [haversine(lat, lon, a, b) for a, b in zip(lats, lons)]
+
+
+def max_error_m(fn, use_numpy, points, lats, lons, within_km=None):
+    worst = 0.0
+    for lat, lon in points:
+        exact = scalar(lat, lon, lats, lons)
+        for e, d in zip(exact, fn(lat, lon, lats, lons, use_numpy=use_numpy)):
+            if within_km is None or e <= within_km:
+                worst = max(worst, abs(e - float(d)))
+    return worst * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stops = load_stops()
+    lats = [s["stop_lat"] for s in stops]
+    lons = [s["stop_lon"] for s in stops]
+    rng = random.Random(args.seed)
+    points = [
+        (rng.uniform(min(lats), max(lats)), rng.uniform(min(lons), max(lons)))
+        for _ in range(args.queries)
+    ]
+
+    variants = [("scalar haversine loop", scalar, False),
+                ("haversine_many, Python", haversine_many, False),
+                ("equirectangular_many, Python", equirectangular_many, False)]
+    if utils.numpy_available():
+        variants += [("haversine_many, NumPy", haversine_many, True),
+                     ("equirectangular_many, NumPy", equirectangular_many, True)]
+    else:
+        print("NumPy is not installed; skipping the vectorized variants")
+
+    print(f"{len(stops)} stops, {len(points)} query points")
+    print(f"{'':<30} {'us/query':>9} {'max err':>10} {'max err <=2 km':>15}")
+    for label, fn, use_numpy in variants:
+        start = time.perf_counter()
+        for lat, lon in points:
+            fn(lat, lon, lats, lons, use_numpy=use_numpy)
+        per_query = (time.perf_counter() - start) / len(points) * 1e6
+        error = max_error_m(fn, use_numpy, points[:50], lats, lons)
+        near = max_error_m(fn, use_numpy, points[:50], lats, lons, within_km=utils.EQUIRECTANGULAR_MAX_KM)
+        print(f"{label:<30} {per_query:9.1f} {error:8.4f} m {near:13.6f} m")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Walking neighbours of a stop: StopIndex radius query versus stored footpaths.
+
+Builds the footpaths of the real Wrocław stops from the GTFS directory as the
+import does, then times the neighbours of every stop looked up both ways::
+
+    python -m benchmarks.footpaths [--radius-km 0.4] [--rounds 5]
+"""
+
+import argparse
+import time
+
+from benchmarks.stop_index import load_stops
+from footpaths import FOOTPATH_RADIUS_KM, Footpaths, footpath_rows
+from spatial import StopIndex
+
+
+def _time_per_call(fn, items, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for item in items:
+            fn(item)
+    return (time.perf_counter() - start) / (rounds * len(items))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--radius-km", type=float, default=FOOTPATH_RADIUS_KM)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    stops = load_stops()
+    started = time.perf_counter()
+    rows, stations = footpath_rows(stops, args.radius_km)
+    built = time.perf_counter() - started
+    footpaths = Footpaths(rows, stations)
+    print(f"{len(stops):,} stops: {len(rows):,} footpaths, "
+          f"{len({station for _, station in stations}):,} stations "
+          f"of {len(stations):,} stops, built in {built:.2f} s")
+
+    index = StopIndex(stops)
+    radius_km = args.radius_km
+    per_query = _time_per_call(
+        lambda stop: index.nearest(stop["stop_lat"], stop["stop_lon"],
+                                   k=len(index), radius_km=radius_km),
+        stops, args.rounds,
+    )
+    per_lookup = _time_per_call(
+        lambda stop: footpaths.neighbours(stop["stop_id"]), stops, args.rounds
+    )
+    print(f"StopIndex radius query  {per_query * 1e6:8.1f} µs/stop")
+    print(f"Footpaths.neighbours    {per_lookup * 1e6:8.1f} µs/stop "
+          f"({per_query / per_lookup:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
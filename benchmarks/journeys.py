@@ -0,0 +1,74 @@
+"""Journey planner latency on random origin/destination pairs.
+
+Imports a Wrocław-sized synthetic feed, builds the journey planner and reports
+its build time, then plans journeys between random pairs of stops at random
+times of the day. The latency distribution is reported for all queries and
+for the pairs of stops furthest apart::
+
+    python -m benchmarks.journeys [--trips 39000] [--queries 1000]
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import database
+import models
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from gtfs_import import import_feed
+from utils import format_gtfs_time, haversine
+
+
+def summarize(label, values):
+    q = statistics.quantiles(values, n=100)
+    print(f"{label:<24} p50 {q[49]:6.2f} ms  p95 {q[94]:6.2f} ms  "
+          f"p99 {q[98]:6.2f} ms  max {max(values):6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    rng = random.Random(args.seed)
+    cases = []
+    for _ in range(args.queries):
+        start, end = rng.sample(feed["stops.txt"], 2)
+        start_time = f"2025-04-02T{format_gtfs_time(rng.randint(5 * 3600, 23 * 3600))}Z"
+        cases.append((start[3], start[4], end[3], end[4], start_time))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        del feed
+        database.configure(db_path)
+        models.get_stop_index()
+        models.get_timetable()
+        started = time.perf_counter()
+        planner = models.get_journey_planner()
+        print(f"planner built in {time.perf_counter() - started:.2f} s, "
+              f"{len(planner.c_dep):,} connections")
+
+        results = []
+        for case in cases:
+            started = time.perf_counter()
+            journey = models.plan_journey(*case)
+            results.append(((time.perf_counter() - started) * 1000, journey, case))
+        database.get_pool().close_all()
+
+    found = [journey for _, journey, _ in results if journey]
+    print(f"{len(found)} of {len(results)} journeys found, "
+          f"{statistics.mean(j['transfers'] for j in found):.2f} transfers on average")
+    summarize("all pairs", [ms for ms, _, _ in results])
+    by_distance = sorted(results, key=lambda r: haversine(*r[2][:4]), reverse=True)
+    summarize("furthest 10% of pairs", [ms for ms, _, _ in by_distance[:len(results) // 10]])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Load test of the Werkzeug development server versus the ASGI serving mode.
+
+Imports a synthetic feed and serves the app on a local socket, first with the
+threaded Werkzeug server that ``python src/app.py`` runs, then with
+``server.AsyncApp`` under uvicorn. Concurrent keep-alive clients send a mix of
+trip-details and closest-departures requests for a fixed time; throughput and
+the latency distribution are reported for both::
+
+    python -m benchmarks.serving [--clients 32] [--seconds 10]
+"""
+
+import argparse
+import http.client
+import random
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import database
+import models
+from app import app, departures_cache, trip_details_cache
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from gtfs_import import import_feed
+from server import AsyncApp
+from utils import format_gtfs_time
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+try:
+    import uvicorn
+except ImportError:  # optional, see the 'asgi' extra
+    uvicorn = None
+
+
+def make_paths(feed, count, seed):
+    rng = random.Random(seed)
+    trip_ids = [trip[2] for trip in feed["trips.txt"]]
+    stops = feed["stops.txt"]
+    paths = []
+    for _ in range(count):
+        if rng.random() < 0.5:
+            paths.append(f"/public_transport/city/wroclaw/trip/{rng.choice(trip_ids)}")
+        else:
+            stop, end = rng.sample(stops, 2)
+            start_time = f"2025-04-02T{format_gtfs_time(rng.randint(5 * 3600, 22 * 3600))}Z"
+            paths.append(
+                "/public_transport/city/wroclaw/closest_departures"
+                f"?start_coordinates={stop[3]},{stop[4]}&end_coordinates={end[3]},{end[4]}"
+                f"&start_time={start_time}&limit=5"
+            )
+    return paths
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load(port, paths, clients, seconds):
+    """Closed-loop load from ``clients`` connections; return (latencies ms, statuses)."""
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(offset):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine, codes = [], Counter()
+        i = offset
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            conn.request("GET", paths[i % len(paths)])
+            response = conn.getresponse()
+            response.read()
+            mine.append((time.perf_counter() - start) * 1000)
+            codes[response.status] += 1
+            i += clients
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            statuses.update(codes)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+
+def summarize(label, latencies, statuses, seconds):
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{label:<18} {len(latencies) / seconds:7.0f} req/s  p50 {q[49]:6.2f} ms  "
+          f"p95 {q[94]:6.2f} ms  p99 {q[98]:7.2f} ms  {dict(statuses)}")
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # uvicorn runs with access logs off as well
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def run_werkzeug(paths, args):
+    port = free_port()
+    server = make_server("127.0.0.1", port, app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        return load(port, paths, args.clients, args.seconds)
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def run_asgi(paths, args):
+    port = free_port()
+    asgi_app = AsyncApp(app, max_threads=args.threads, max_queue=args.queue)
+    server = uvicorn.Server(uvicorn.Config(
+        asgi_app, host="127.0.0.1", port=port, log_level="warning", lifespan="on",
+        access_log=False,
+    ))
+    thread = threading.Thread(target=server.run)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        return load(port, paths, args.clients, args.seconds)
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--threads", type=int, default=8, help="AsyncApp request threads")
+    parser.add_argument("--queue", type=int, default=64, help="AsyncApp queue before 503s")
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    paths = make_paths(feed, 100000, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        del feed
+        database.configure(db_path)
+        models.get_stop_index()
+        print(f"{args.clients} clients for {args.seconds:.0f} s")
+
+        for label, run in (("werkzeug threaded", run_werkzeug), ("asgi (uvicorn)", run_asgi)):
+            if run is run_asgi and uvicorn is None:
+                print("uvicorn is not installed, skipping: pip install .[asgi]")
+                continue
+            # Both servers start cold, with the same request sequence
+            departures_cache.clear()
+            trip_details_cache.clear()
+            summarize(label, *run(paths, args), args.seconds)
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
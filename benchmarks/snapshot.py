@@ -0,0 +1,78 @@
+"""Memory-mapped timetable snapshot versus building the timetable from SQLite.
+
+Imports a Wrocław-sized synthetic feed (which writes the snapshot), then
+reports the size of the snapshot, the time to open it and to build
+``Timetable`` from the database, the RSS each adds, and the latency of
+departures and trip details on both::
+
+    python -m benchmarks.snapshot [--trips 39000] [--queries 2000]
+
+The snapshot's pages count towards RSS as they are touched, but they are
+shared by every worker mapping the file rather than copied per process.
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import database
+import models
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from benchmarks.timetable_engine import latencies, rss_mib, summarize
+from gtfs_import import import_feed
+from snapshot import MappedTimetable, snapshot_path
+from timetable import Timetable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    rng = random.Random(args.seed)
+    trip_ids = [trip[2] for trip in feed["trips.txt"]]
+    stop_ids = [int(stop[0]) for stop in feed["stops.txt"]]
+    trip_cases = [(rng.choice(trip_ids),) for _ in range(args.queries)]
+    departure_cases = [
+        (rng.sample(stop_ids, 4), rng.randint(5 * 3600, 22 * 3600), args.limit, None, 20250402)
+        for _ in range(args.queries)
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        del feed
+        database.configure(db_path)
+        feed_version = models.get_feed_version()
+        path = snapshot_path(db_path)
+        print(f"snapshot: {path.stat().st_size / 2**20:.1f} MiB")
+
+        rss_before = rss_mib()
+        started = time.perf_counter()
+        mapped = MappedTimetable.open(path, feed_version)
+        open_ms = (time.perf_counter() - started) * 1000
+        print(f"mapped open: {open_ms:8.2f} ms, RSS +{rss_mib() - rss_before:.1f} MiB")
+
+        rss_before = rss_mib()
+        started = time.perf_counter()
+        built = Timetable.from_connection(database.get_db_connection())
+        build_ms = (time.perf_counter() - started) * 1000
+        print(f"built from SQLite: {build_ms:8.2f} ms, RSS +{rss_mib() - rss_before:.1f} MiB")
+
+        for label, timetable in (("mapped", mapped), ("built", built)):
+            rss_before = rss_mib()
+            summarize(f"{label:<7} departures", latencies(timetable.departures, departure_cases))
+            summarize(f"{label:<7} get_trip_details",
+                      latencies(timetable.get_trip_details, trip_cases))
+            print(f"{'':<8}RSS +{rss_mib() - rss_before:.1f} MiB while querying")
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
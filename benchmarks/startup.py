@@ -0,0 +1,105 @@
+"""Time from launching the server to its first served request.
+
+Imports a synthetic feed, then launches ``python src/server.py`` (uvicorn,
+``pip install .[asgi]``) on it again and again and polls a closest-departures
+request until it is answered, and ``/readyz`` until it reports ready. Both
+times are measured from the launch, for each ``TIMETABLE_BACKEND`` (and the
+memory backend without its snapshot, ``TIMETABLE_SNAPSHOT=0``) with the
+shared objects built on first use (``WARMUP=lazy``) and in the background
+(``WARMUP=background``)::
+
+    python -m benchmarks.startup [--trips 39000] [--runs 3]
+"""
+
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks import REPO_ROOT
+from benchmarks.serving import free_port, make_paths
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from gtfs_import import import_feed
+
+try:
+    import uvicorn
+except ImportError:  # optional, see the 'asgi' extra
+    uvicorn = None
+
+
+def departures_path(feed, seed):
+    # make_paths alternates trip and departure requests at random
+    return next(path for path in make_paths(feed, 100, seed) if "closest_departures" in path)
+
+
+def wait_for(port, path, started, timeout):
+    """Poll ``path`` until it is answered with 200; return the ms since ``started``."""
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            if response.status == 200:
+                return (time.perf_counter() - started) * 1000
+        except OSError:
+            pass  # not listening yet
+        time.sleep(0.005)
+    raise TimeoutError(f"{path} was not answered within {timeout} s")
+
+
+def measure_startup(db_path, path, backend="sqlite", warmup="background", timeout=60, **env):
+    """Launch the server, with ``env`` added to its environment, and return
+    the ms until ``path`` and until ``/readyz`` are first answered."""
+    port = free_port()
+    env = {**os.environ, "TRIPS_DB_PATH": str(db_path), "TIMETABLE_BACKEND": backend,
+           "WARMUP": warmup, **env}
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, str(REPO_ROOT / "src" / "server.py"), "--port", str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        first_request_ms = wait_for(port, path, started, timeout)
+        ready_ms = wait_for(port, "/readyz", started, timeout)
+    finally:
+        process.terminate()
+        process.wait()
+    return first_request_ms, ready_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if uvicorn is None:
+        parser.error("the server launcher needs uvicorn: pip install .[asgi]")
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    path = departures_path(feed, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        del feed
+        for label, backend, env in (("sqlite", "sqlite", {}), ("memory", "memory", {}),
+                                    ("memory, no snapshot", "memory",
+                                     {"TIMETABLE_SNAPSHOT": "0"})):
+            for warmup in ("lazy", "background"):
+                runs = [measure_startup(db_path, path, backend, warmup, **env)
+                        for _ in range(args.runs)]
+                first, ready = (statistics.median(values) for values in zip(*runs))
+                print(f"{label:<20} WARMUP={warmup:<11} first request {first:7.0f} ms, "
+                      f"ready {ready:7.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Nearest-stop lookup: full scan + sort versus the grid StopIndex.
+
+Uses the real Wrocław stops from the GTFS directory and random query points
+inside the city's bounding box::
+
+    python -m benchmarks.stop_index [--queries 2000] [--k 20]
+"""
+
+import argparse
+import csv
+import random
+import time
+
+from benchmarks import GTFS_DIR
+from spatial import StopIndex
+from utils import haversine
+
+
+def load_stops(path=GTFS_DIR / "stops.txt"):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return [
+            {
+                "stop_id": int(row["stop_id"]),
+                "stop_code": row["stop_code"],
+                "stop_name": row["stop_name"],
+                "stop_lat": float(row["stop_lat"]),
+                "stop_lon": float(row["stop_lon"]),
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def scan_nearest(stops, lat, lon, k):
+    """The original lookup: distance to every stop, full sort, keep ``k``."""
+    return sorted(
+        (
+            (haversine(lat, lon, float(s["stop_lat"]), float(s["stop_lon"])), s)
+            for s in stops
+        ),
+        key=lambda item: item[0],
+    )[:k]
+
+
+def _time_per_call(fn, points):
+    start = time.perf_counter()
+    for lat, lon in points:
+        fn(lat, lon)
+    return (time.perf_counter() - start) / len(points)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--cell-size-km", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stops = load_stops()
+    rng = random.Random(args.seed)
+    lats = [s["stop_lat"] for s in stops]
+    lons = [s["stop_lon"] for s in stops]
+    points = [
+        (rng.uniform(min(lats), max(lats)), rng.uniform(min(lons), max(lons)))
+        for _ in range(args.queries)
+    ]
+
+    start = time.perf_counter()
+    index = StopIndex(stops, cell_size_km=args.cell_size_km)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    for lat, lon in points[:200]:
+        expected = [s["stop_id"] for _, s in scan_nearest(stops, lat, lon, args.k)]
+        actual = [s["stop_id"] for _, s in index.nearest(lat, lon, k=args.k)]
+        assert expected == actual, (lat, lon)
+
+    scan = _time_per_call(lambda lat, lon: scan_nearest(stops, lat, lon, args.k), points)
+    indexed = _time_per_call(lambda lat, lon: index.nearest(lat, lon, k=args.k), points)
+
+    print(f"stops: {len(stops)}, queries: {len(points)}, k: {args.k}")
+    print(f"index build:   {build_ms:8.2f} ms (once per process)")
+    print(f"scan + sort:   {scan * 1e6:8.1f} us/query")
+    print(f"StopIndex:     {indexed * 1e6:8.1f} us/query ({scan / indexed:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
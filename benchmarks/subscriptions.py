@@ -0,0 +1,89 @@
+"""Work per minute tick of departure subscriptions as the number of clients grows.
+
+Imports a Wrocław-sized synthetic feed and subscribes a growing number of
+clients to the departure boards of a fixed set of stops, then advances the
+clock minute by minute. For each tick it reports the time to evaluate and
+diff every topic, and the time for all clients to take their events; the
+former depends on the number of distinct stops only::
+
+    python -m benchmarks.subscriptions [--trips 39000] [--stops 100] [--minutes 30]
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import database
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from boards import DepartureBoards
+from gtfs_import import import_feed
+from subscriptions import Subscriptions
+
+
+class Clock:
+
+    def __init__(self):
+        self.moment = datetime(2025, 4, 2, 8, 0)
+
+    def __call__(self):
+        return self.moment
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--stops", type=int, default=100)
+    parser.add_argument("--minutes", type=int, default=30)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    rng = random.Random(args.seed)
+    stop_ids = rng.sample([int(stop[0]) for stop in feed["stops.txt"]], args.stops)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        del feed
+        database.configure(db_path)
+        for clients in (args.stops, 10 * args.stops, 100 * args.stops):
+            clock = Clock()
+            boards = DepartureBoards(clock=clock)
+            subscriptions = Subscriptions(pool=None, max_streams=clients, keepalive_seconds=0)
+            streams = []
+            for _ in range(clients):
+                stop_id = rng.choice(stop_ids)
+                topic = subscriptions.subscribe(
+                    ("stop", stop_id, args.limit),
+                    lambda stop_id=stop_id: boards.next_departures(stop_id, args.limit),
+                )
+                streams.append(subscriptions.stream(topic))
+            for stream in streams:
+                next(stream)  # the snapshot
+
+            tick_ms, drain_ms = [], []
+            for _ in range(args.minutes):
+                clock.moment += timedelta(minutes=1)
+                started = time.perf_counter()
+                subscriptions.tick()
+                tick_ms.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                sent = sum(len(next(stream)) for stream in streams)
+                drain_ms.append((time.perf_counter() - started) * 1000)
+            stats = subscriptions.stats()
+            print(f"{clients:>6} clients, {stats['topics']:>4} topics: "
+                  f"tick {statistics.median(tick_ms):6.2f} ms, "
+                  f"clients take their events {statistics.median(drain_ms):6.2f} ms "
+                  f"({sent / clients:.0f} bytes each), {stats['changes']} changes")
+            for stream in streams:
+                stream.close()
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
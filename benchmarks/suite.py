@@ -0,0 +1,258 @@
+"""Benchmark suite with JSON results, for comparing commits.
+
+Imports a synthetic feed of the given size and measures:
+
+* micro-benchmarks of ``haversine``, ``get_closest_departures`` and
+  ``get_trip_details``, called directly;
+* a closed-loop load of mixed trip-details and closest-departures requests
+  through the Flask test client, in process;
+* the same load over a real socket, served by the threaded Werkzeug server
+  to concurrent keep-alive clients;
+* the time from launching ``src/server.py`` with ``WARMUP=background`` to
+  its first served closest-departures request, and to ``/readyz`` reporting
+  ready (needs uvicorn). A first request slower than ``--startup-target-ms``
+  fails the run like a regression.
+
+Every result has its p50/p95/p99/max latency and throughput; the process RSS
+is recorded after each stage. Results are written to ``--output`` as JSON,
+and ``--compare`` checks them against an earlier run, exiting with status 1
+when a latency or throughput got worse by more than ``--tolerance``::
+
+    python -m benchmarks.suite [--stops 2400] [--trips 39000] [--stops-per-trip 20]
+                               [--output BENCH.json] [--compare BASELINE.json]
+"""
+
+import argparse
+import json
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import database
+import models
+from app import app, departures_cache, trip_details_cache
+from benchmarks import REPO_ROOT
+from benchmarks.serving import make_paths, run_werkzeug
+from benchmarks.startup import measure_startup, uvicorn
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from benchmarks.timetable_engine import latencies, rss_mib
+from gtfs_import import import_feed
+from utils import format_gtfs_time, haversine
+
+# Lower is better for these keys of a result, higher for throughput
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+# haversine is timed in batches; a single call is close to the timer's resolution
+HAVERSINE_BATCH = 1000
+# Launch to first served request, most of it spent importing Flask and uvicorn
+STARTUP_TARGET_MS = 1000
+
+
+def stats(values, seconds):
+    """Latency percentiles of ``values`` (ms) and the throughput over ``seconds``."""
+    q = statistics.quantiles(values, n=100)
+    return {
+        "count": len(values),
+        "p50_ms": round(q[49], 4),
+        "p95_ms": round(q[94], 4),
+        "p99_ms": round(q[98], 4),
+        "max_ms": round(max(values), 4),
+        "throughput_per_s": round(len(values) / seconds, 1),
+    }
+
+
+def timed(fn, cases):
+    started = time.perf_counter()
+    values = latencies(fn, cases)
+    return stats(values, time.perf_counter() - started)
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def haversine_batch(points):
+    for lat1, lon1, lat2, lon2 in points:
+        haversine(lat1, lon1, lat2, lon2)
+
+
+def micro_benchmarks(feed, args):
+    rng = random.Random(args.seed)
+    stops = feed["stops.txt"]
+    points = [(s[3], s[4], e[3], e[4]) for s, e in (rng.sample(stops, 2) for _ in range(20000))]
+    batches = [(points[i:i + HAVERSINE_BATCH],) for i in range(0, len(points), HAVERSINE_BATCH)]
+    trip_ids = [trip[2] for trip in feed["trips.txt"]]
+    departure_cases = []
+    for _ in range(args.queries):
+        stop, end = rng.sample(stops, 2)
+        start_time = f"2025-04-02T{format_gtfs_time(rng.randint(5 * 3600, 22 * 3600))}Z"
+        departure_cases.append((stop[3], stop[4], end[3], end[4], start_time, args.limit))
+    trip_cases = [(rng.choice(trip_ids),) for _ in range(args.queries)]
+
+    # Warm the stop index and the statement caches before timing
+    for case in departure_cases[:100]:
+        models.get_closest_departures(*case)
+    return {
+        f"haversine_x{HAVERSINE_BATCH}": timed(haversine_batch, batches * 10),
+        "get_closest_departures": timed(models.get_closest_departures, departure_cases),
+        "get_trip_details": timed(models.get_trip_details, trip_cases),
+    }
+
+
+def test_client_load(paths, seconds):
+    """Closed-loop requests through the Flask test client for ``seconds``."""
+    client = app.test_client()
+    values, statuses = [], {}
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = client.get(paths[i % len(paths)])
+        response.get_data()
+        values.append((time.perf_counter() - start) * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        i += 1
+    return values, statuses
+
+
+def run(args):
+    feed = generate_feed(args.stops, args.routes, args.trips, args.stops_per_trip, args.seed)
+    sizes = {name: len(rows) for name, rows in feed.items()}
+    paths = make_paths(feed, 100000, args.seed)
+    results = {
+        "metadata": {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "backend": args.backend,
+            "feed": sizes,
+        },
+        "benchmarks": {},
+        "rss_mib": {"start": round(rss_mib(), 1)},
+    }
+    benchmarks, rss = results["benchmarks"], results["rss_mib"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        started = time.perf_counter()
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        benchmarks["import_seconds"] = round(time.perf_counter() - started, 2)
+        micro_feed = {name: feed[name] for name in ("stops.txt", "trips.txt")}
+        del feed
+        if uvicorn is not None:
+            departures_path = next(path for path in paths if "closest_departures" in path)
+            first_request_ms, ready_ms = measure_startup(db_path, departures_path, args.backend)
+            benchmarks["startup_first_request_ms"] = round(first_request_ms)
+            benchmarks["startup_ready_ms"] = round(ready_ms)
+        database.configure(db_path)
+        models.set_backend(args.backend)
+        models.get_backend()
+        rss["loaded"] = round(rss_mib(), 1)
+
+        benchmarks.update(micro_benchmarks(micro_feed, args))
+        rss["micro"] = round(rss_mib(), 1)
+
+        for label, load_run in (("test_client", lambda: test_client_load(paths, args.seconds)),
+                                ("socket", lambda: run_werkzeug(paths, args))):
+            # Every load starts with cold response caches
+            departures_cache.clear()
+            trip_details_cache.clear()
+            values, statuses = load_run()
+            benchmarks[f"load_{label}"] = {**stats(values, args.seconds),
+                                           "statuses": {str(k): v for k, v in statuses.items()}}
+            rss[f"load_{label}"] = round(rss_mib(), 1)
+        database.get_pool().close_all()
+    rss["peak"] = round(peak_rss_mib(), 1)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change of every metric from ``baseline``; return the regressions."""
+    regressions = []
+    print(f"\ncompared with {baseline['metadata'].get('commit')} "
+          f"(tolerance {tolerance:.0%}):")
+    for name, result in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if not isinstance(result, dict) or not isinstance(before, dict):
+            continue
+        for key in (*LATENCY_KEYS, "throughput_per_s"):
+            if not before.get(key):
+                continue
+            change = result[key] / before[key] - 1
+            worse = change > tolerance if key in LATENCY_KEYS else change < -tolerance
+            if worse:
+                regressions.append((name, key))
+            print(f"  {name:<24} {key:<17} {before[key]:>10} -> {result[key]:>10} "
+                  f"{change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return regressions
+
+
+def print_results(results):
+    for name, result in results["benchmarks"].items():
+        if isinstance(result, dict):
+            print(f"{name:<24} p50 {result['p50_ms']:8.3f} ms  p95 {result['p95_ms']:8.3f} ms  "
+                  f"p99 {result['p99_ms']:8.3f} ms  {result['throughput_per_s']:>10,.0f}/s")
+        else:
+            print(f"{name:<24} {result}")
+    print("RSS MiB: " + ", ".join(f"{stage} {mib}" for stage, mib in results["rss_mib"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stops", type=int, default=2400)
+    parser.add_argument("--routes", type=int, default=120)
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--stops-per-trip", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--seconds", type=float, default=5, help="duration of each load run")
+    parser.add_argument("--clients", type=int, default=16, help="socket load connections")
+    parser.add_argument("--backend", choices=models.BACKENDS, default="sqlite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="results JSON of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="relative change counted as a regression")
+    parser.add_argument("--startup-target-ms", type=float, default=STARTUP_TARGET_MS,
+                        help="longest accepted time from launch to the first served request")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"results written to {args.output}")
+    failed = False
+    startup_ms = results["benchmarks"].get("startup_first_request_ms")
+    if startup_ms is not None and startup_ms > args.startup_target_ms:
+        print(f"first request {startup_ms} ms after launch, over the "
+              f"{args.startup_target_ms:g} ms target")
+        failed = True
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.tolerance)
+        failed = failed or bool(regressions)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Synthetic GTFS feed generator matching the Wrocław file layout.
+
+Stops are scattered over the Wrocław bounding box, every route runs two
+variants (one per direction) along stops lying close to a straight line, and
+trips run at a regular headway from early morning until after midnight, on
+weekday, Saturday or Sunday services::
+
+    python -m benchmarks.synthetic_feed OUTPUT_DIR [--stops 2400] [--trips 39000]
+"""
+
+import argparse
+import csv
+import random
+from math import cos, radians
+from pathlib import Path
+
+from utils import format_gtfs_time
+
+BBOX = (51.04, 51.18, 16.90, 17.15)  # min_lat, max_lat, min_lon, max_lon
+SERVICE_IDS = (3, 4, 6, 8)
+# Weekday flags (Monday first) of every service, like the published calendar.txt
+SERVICE_DAYS = {
+    3: (1, 1, 1, 1, 1, 0, 0),
+    4: (0, 0, 0, 0, 0, 1, 0),
+    6: (1, 1, 1, 1, 0, 0, 0),
+    8: (0, 0, 0, 0, 0, 0, 1),
+}
+CALENDAR_START, CALENDAR_END = 20250301, 20250630
+FIRST_DEPARTURE = 4 * 3600 + 30 * 60
+LAST_DEPARTURE = 25 * 3600 + 30 * 60
+
+HEADERS = {
+    "stops.txt": ["stop_id", "stop_code", "stop_name", "stop_lat", "stop_lon"],
+    "trips.txt": [
+        "route_id", "service_id", "trip_id", "trip_headsign", "direction_id",
+        "shape_id", "brigade_id", "vehicle_id", "variant_id",
+    ],
+    "stop_times.txt": [
+        "trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence",
+        "pickup_type", "drop_off_type",
+    ],
+    "calendar.txt": [
+        "service_id", "monday", "tuesday", "wednesday", "thursday", "friday",
+        "saturday", "sunday", "start_date", "end_date",
+    ],
+}
+
+
+def _pattern(rng, stops, length):
+    """Pick ``length`` stops lying near a random line, ordered along it."""
+    kx = cos(radians((BBOX[0] + BBOX[1]) / 2))
+    a, b = rng.sample(stops, 2)
+    ax, ay = a[4] * kx, a[3]
+    dx, dy = b[4] * kx - ax, b[3] - ay
+    norm = (dx * dx + dy * dy) ** 0.5 or 1.0
+
+    def offset(stop):
+        return abs((stop[4] * kx - ax) * dy - (stop[3] - ay) * dx) / norm
+
+    chosen = sorted(stops, key=offset)[:length]
+    return sorted(chosen, key=lambda s: (s[4] * kx - ax) * dx + (s[3] - ay) * dy)
+
+
+def generate_feed(stop_count=2400, route_count=120, trip_count=39000,
+                  stops_per_trip=20, seed=1):
+    """Return ``{file name: list of rows}`` for a synthetic feed."""
+    rng = random.Random(seed)
+    min_lat, max_lat, min_lon, max_lon = BBOX
+    stops = [
+        [stop_id, 10000 + stop_id, f"Stop {stop_id}",
+         round(rng.uniform(min_lat, max_lat), 7), round(rng.uniform(min_lon, max_lon), 7)]
+        for stop_id in range(1, stop_count + 1)
+    ]
+
+    trips, stop_times = [], []
+    variants = 2 * route_count
+    trips_per_variant = max(1, trip_count // variants)
+    headway = max(60, (LAST_DEPARTURE - FIRST_DEPARTURE) // trips_per_variant)
+    trip_no = 0
+    for route_no in range(route_count):
+        route_id = str(route_no + 1)
+        forward = _pattern(rng, stops, min(stops_per_trip, stop_count))
+        for direction_id, pattern in enumerate((forward, forward[::-1])):
+            variant_id = 800000 + 2 * route_no + direction_id
+            headsign = pattern[-1][2].upper()
+            hops = [rng.randint(60, 150) for _ in pattern]
+            for n in range(trips_per_variant):
+                trip_no += 1
+                trip_id = f"{SERVICE_IDS[n % len(SERVICE_IDS)]}_{14000000 + trip_no}"
+                trips.append([
+                    route_id, SERVICE_IDS[n % len(SERVICE_IDS)], trip_id, headsign,
+                    direction_id, variant_id, n % 40 + 1, 1, variant_id,
+                ])
+                clock = FIRST_DEPARTURE + n * headway + rng.randint(0, 59)
+                for sequence, (stop, hop) in enumerate(zip(pattern, hops)):
+                    time = format_gtfs_time(clock)
+                    stop_times.append([trip_id, time, time, stop[0], sequence, 0, 0])
+                    clock += hop
+
+    calendar = [[service_id, *SERVICE_DAYS[service_id], CALENDAR_START, CALENDAR_END]
+                for service_id in SERVICE_IDS]
+    return {"stops.txt": stops, "trips.txt": trips, "stop_times.txt": stop_times,
+            "calendar.txt": calendar}
+
+
+def write_feed(directory, feed):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, rows in feed.items():
+        # The published feed is UTF-8 with a byte order mark.
+        with open(directory / name, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADERS[name])
+            writer.writerows(rows)
+    return directory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output_dir")
+    parser.add_argument("--stops", type=int, default=2400)
+    parser.add_argument("--routes", type=int, default=120)
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--stops-per-trip", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(args.stops, args.routes, args.trips, args.stops_per_trip, args.seed)
+    write_feed(args.output_dir, feed)
+    print(", ".join(f"{name}: {len(rows)} rows" for name, rows in feed.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""SQLite backend versus the in-memory timetable engine.
+
+Imports a Wrocław-sized synthetic feed, loads the in-memory engine and reports
+its load time and memory footprint, then the latency distribution of
+``get_closest_departures`` and ``get_trip_details`` on both backends::
+
+    python -m benchmarks.timetable_engine [--trips 39000] [--queries 2000]
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import database
+import models
+from benchmarks.synthetic_feed import generate_feed, write_feed
+from gtfs_import import import_feed
+from utils import format_gtfs_time
+
+
+def rss_mib():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * 4096 / 2**20
+
+
+def latencies(fn, cases):
+    result = []
+    for args in cases:
+        start = time.perf_counter()
+        fn(*args)
+        result.append((time.perf_counter() - start) * 1000)
+    return result
+
+
+def summarize(label, values):
+    q = statistics.quantiles(values, n=100)
+    print(f"{label:<34} p50 {q[49]:7.3f} ms  p99 {q[98]:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trips", type=int, default=39000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    feed = generate_feed(trip_count=args.trips, seed=args.seed)
+    rng = random.Random(args.seed)
+    trip_ids = [trip[2] for trip in feed["trips.txt"]]
+    trip_cases = [(rng.choice(trip_ids),) for _ in range(args.queries)]
+    departure_cases = []
+    for _ in range(args.queries):
+        stop, end = rng.sample(feed["stops.txt"], 2)
+        start_time = f"2025-04-02T{format_gtfs_time(rng.randint(5 * 3600, 22 * 3600))}Z"
+        departure_cases.append((stop[3], stop[4], end[3], end[4], start_time, args.limit))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "trips.sqlite"
+        import_feed(write_feed(Path(tmp) / "gtfs", feed), db_path, verbose=False)
+        stop_times = len(feed["stop_times.txt"])
+        del feed
+        database.configure(db_path)
+        models.get_stop_index()
+
+        rss_before = rss_mib()
+        started = time.perf_counter()
+        models.set_backend("memory")
+        engine = models.get_backend()
+        load_s = time.perf_counter() - started
+        print(f"stop_times rows: {stop_times}, trips: {len(engine.trips)}")
+        print(f"engine load: {load_s:.2f} s, "
+              f"RSS +{rss_mib() - rss_before:.1f} MiB, arrays and records "
+              f"{engine.memory_footprint() / 2**20:.1f} MiB")
+
+        for backend in models.BACKENDS:
+            models.set_backend(backend)
+            summarize(f"{backend:<7} get_closest_departures",
+                      latencies(models.get_closest_departures, departure_cases))
+            summarize(f"{backend:<7} get_trip_details",
+                      latencies(models.get_trip_details, trip_cases))
+        models.set_backend("sqlite")
+        database.get_pool().close_all()
+
+
+if __name__ == "__main__":
+    main()
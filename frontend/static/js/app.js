@@ -48,6 +48,52 @@ class PublicTransportAPI {
         return response.json();
     }
 
+    static async streamClosestDepartures(startCoords, endCoords, startTime, limit, onDepartures) {
+        // NDJSON: a metadata line, then one departure per line as the server finds them
+        const params = new URLSearchParams({
+            start_coordinates: `${startCoords.lat},${startCoords.lng}`,
+            end_coordinates: `${endCoords.lat},${endCoords.lng}`,
+            start_time: startTime,
+            limit: limit,
+            format: 'ndjson'
+        });
+
+        const response = await fetch(`${CONFIG.API_BASE_URL}/closest_departures?${params}`);
+
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const departures = [];
+        let buffered = '';
+        let metadataSeen = false;
+
+        for (;;) {
+            const { done, value } = await reader.read();
+            buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffered.split('\n');
+            buffered = done ? '' : lines.pop();
+
+            const received = [];
+            lines.filter(line => line.trim()).forEach(line => {
+                if (metadataSeen) {
+                    received.push(JSON.parse(line));
+                } else {
+                    metadataSeen = true;
+                }
+            });
+            if (received.length > 0) {
+                departures.push(...received);
+                onDepartures(departures);
+            }
+            if (done) {
+                return departures;
+            }
+        }
+    }
+
     static async getTripDetails(tripId) {
         // Ensure proper URL construction with explicit path segments
         const baseUrl = CONFIG.API_BASE_URL.replace(/\/$/, ''); // Remove trailing slash if present
@@ -363,13 +409,17 @@ class PublicTransportApp {
             const { start, end } = this.mapManager.getRouteCoordinates();
             const { startTime, limit } = this.uiManager.getSearchParameters();
 
-            const data = await PublicTransportAPI.getClosestDepartures(start, end, startTime, limit);
-
-            // Handle both response formats: direct array or wrapped in departures property
-            const departures = Array.isArray(data) ? data : data.departures;
-
-            this.uiManager.displayDepartures(departures, (tripId) => this.showTripDetails(tripId));
-            this.mapManager.addDepartureMarkers(departures, (tripId) => this.showTripDetails(tripId));
+            const render = (departures) => {
+                this.uiManager.displayDepartures(departures, (tripId) => this.showTripDetails(tripId));
+                this.mapManager.addDepartureMarkers(departures, (tripId) => this.showTripDetails(tripId));
+            };
+
+            // Departures are rendered as they stream in; the final render
+            // also covers the case where none were found
+            const departures = await PublicTransportAPI.streamClosestDepartures(
+                start, end, startTime, limit, render
+            );
+            render(departures);
 
         } catch (error) {
             console.error('Error searching departures:', error);
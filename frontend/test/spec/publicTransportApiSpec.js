@@ -107,6 +107,53 @@ describe('PublicTransportAPI', function() {
         });
     });
 
+    describe('streamClosestDepartures', function() {
+        function streamOf(...chunks) {
+            const encoder = new TextEncoder();
+            const reads = chunks.map(chunk => ({ done: false, value: encoder.encode(chunk) }));
+            reads.push({ done: true, value: undefined });
+            return {
+                getReader: () => ({ read: () => Promise.resolve(reads.shift()) })
+            };
+        }
+
+        it('should report departures as lines arrive, across chunk boundaries', async function() {
+            // Arrange
+            const departure = JSON.stringify(mockDeparturesResponse.departures[0]);
+            const mockResponse = {
+                ok: true,
+                body: streamOf('{"metadata": {}}\n' + departure.slice(0, 10), departure.slice(10) + '\n')
+            };
+            window.fetch.and.returnValue(Promise.resolve(mockResponse));
+            const onDepartures = jasmine.createSpy('onDepartures');
+
+            // Act
+            const result = await PublicTransportAPI.streamClosestDepartures(
+                mockStartCoords, mockEndCoords, mockStartTime, mockLimit, onDepartures
+            );
+
+            // Assert
+            expect(window.fetch).toHaveBeenCalledWith(jasmine.stringMatching(/format=ndjson/));
+            expect(onDepartures).toHaveBeenCalledTimes(1);
+            expect(result).toEqual(mockDeparturesResponse.departures);
+        });
+
+        it('should throw an error when the response is not ok', async function() {
+            // Arrange
+            window.fetch.and.returnValue(Promise.resolve({ ok: false, status: 400 }));
+
+            // Act & Assert
+            try {
+                await PublicTransportAPI.streamClosestDepartures(
+                    mockStartCoords, mockEndCoords, mockStartTime, mockLimit, () => {}
+                );
+                fail('Expected method to throw an error');
+            } catch (error) {
+                expect(error.message).toBe('HTTP error! status: 400');
+            }
+        });
+    });
+
     describe('getTripDetails', function() {
         it('should make a correct API call and return trip details', async function() {
             // Arrange
@@ -1,8 +1,31 @@
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from collections import namedtuple
 from pathlib import Path
 
-from flask import Flask, jsonify, render_template, request
+from flask import Flask, g, json, jsonify, render_template, request, stream_with_context
 
-from models import get_closest_departures, get_trip_details
+import database
+import instrumentation
+import warmup
+from boards import get_departure_boards
+from cache import ResponseCache, departures_request
+from cities import DEFAULT_CITY, CityRegistry, normalize
+from instrumentation import span
+from models import (
+    get_closest_departures,
+    get_closest_departures_batch,
+    get_feed_version,
+    get_stop_index,
+    get_trip_details,
+    iter_closest_departures,
+    plan_journey,
+)
+from subscriptions import event, get_subscriptions
+from utils import format_service_time, parse_iso_datetime
 
 template_folder = Path(__file__).parent.parent / "frontend"
 static_folder = template_folder / "static"
@@ -14,24 +37,149 @@ app = Flask(
 )
 
 
+CityCaches = namedtuple("CityCaches", "departures trip_details")
+
+
+def make_city_caches(namespace=None):
+    return CityCaches(
+        ResponseCache.from_environment(namespace=namespace),
+        # Pre-serialized trip details; they only change with the feed
+        ResponseCache.from_environment(
+            "TRIP_CACHE", max_entries=5000, ttl_seconds=float("inf"), namespace=namespace
+        ),
+    )
+
+
+# The response caches of each loaded city; the default city's are kept
+departures_cache, trip_details_cache = _default_caches = make_city_caches()
+_city_caches = {DEFAULT_CITY: _default_caches}
+_city_caches_lock = threading.Lock()
+
+
+def city_caches(city):
+    name = normalize(city)
+    caches = _city_caches.get(name)
+    if caches is None:
+        with _city_caches_lock:
+            caches = _city_caches.setdefault(name, make_city_caches(name))
+    return caches
+
+
+def drop_city_caches(city):
+    if city != DEFAULT_CITY:
+        with _city_caches_lock:
+            _city_caches.pop(city, None)
+
+
+cities = CityRegistry.from_environment(on_evict=drop_city_caches)
+
+# How long clients may reuse trip details before revalidating them with the ETag
+TRIP_DETAILS_MAX_AGE = int(os.environ.get("TRIP_DETAILS_MAX_AGE", 86400))
+# Largest number of queries accepted by one closest_departures/batch request
+MAX_BATCH_QUERIES = 1000
+# Largest limit accepted by the departure endpoints
+MAX_LIMIT = 1000
+# Departures listed by a stop's departure board unless the request sets a limit
+BOARD_LIMIT = 10
+# Streamed closest_departures: a metadata line, then one departure per line
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Subscriptions: a metadata event, then a snapshot and diffs as departures change
+EVENT_STREAM_MIMETYPE = "text/event-stream"
+# Service day the times of trip details are given on; times past 24:00:00
+# roll over to the next date
+TRIP_SERVICE_DAY = "2025-04-02"
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4"
+
+
+@app.before_request
+def start_trace():
+    g.trace = instrumentation.start_trace(request.endpoint or "unmatched")
+
+
+@app.before_request
+def open_city():
+    city = (request.view_args or {}).get("city")
+    if city is None:
+        return None
+    if city not in cities:
+        return jsonify({"error": "City not found"}), 404
+    g.city = (city, cities.checkout(city))
+    g.city_token = database.use_pool(g.city[1])
+    return None
+
+
+@app.after_request
+def add_server_timing(response):
+    trace = g.get("trace")
+    if trace is not None:
+        g.status = response.status_code
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+@app.teardown_request
+def finish_trace(error):
+    token = g.pop("city_token", None)
+    if token is not None:
+        database.reset_pool(token)
+    city = g.pop("city", None)
+    if city is not None:
+        cities.checkin(city[0])
+    trace = g.pop("trace", None)
+    if trace is not None:
+        instrumentation.finish_trace(trace, g.get("status", 500), error=error is not None)
+
+
+@app.errorhandler(500)
+def internal_error(error):
+    return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route("/metrics")
+def metrics():
+    return app.response_class(instrumentation.render_metrics(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+@app.route("/healthz")
+def healthz():
+    # Liveness only: answered without touching the database
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz")
+def readyz():
+    ready, details = warmup.status()
+    try:
+        feed_version = get_feed_version()
+    except sqlite3.Error:
+        feed_version = None
+    ready = ready and feed_version is not None
+    return (
+        jsonify(
+            {
+                "status": "ready" if ready else "starting",
+                "feed_version": feed_version,
+                "warmup": details,
+            }
+        ),
+        200 if ready else 503,
+    )
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
 
 
-@app.route("/public_transport/city/<city>/trip/<trip_id>")
-def trip_details(city, trip_id):
-    trip, stops = get_trip_details(trip_id)
+def trip_details_payload(trip_id):
+    """Serialize the ``trip_details`` object of a trip, or return None if it is unknown."""
+    with span("query"):
+        trip, stops = get_trip_details(trip_id)
     if not trip:
-        return jsonify({"error": "Trip not found"}), 404
-    return jsonify(
-        {
-            "metadata": {
-                "self": request.path,
-                "city": city,
-                "query_parameters": {"trip_id": trip_id},
-            },
-            "trip_details": {
+        return None
+    with span("serialize"):
+        return json.dumps(
+            {
                 "trip_id": trip["trip_id"],
                 "route_id": trip["route_id"],
                 "trip_headsign": trip["trip_headsign"],
@@ -42,31 +190,302 @@ def trip_details(city, trip_id):
                             "latitude": stop["stop_lat"],
                             "longitude": stop["stop_lon"],
                         },
-                        "arrival_time": f"2025-04-02T{stop['arrival_time']}Z",
-                        "departure_time": f"2025-04-02T{stop['departure_time']}Z",
+                        "arrival_time": format_service_time(TRIP_SERVICE_DAY, stop["arrival_sec"]),
+                        "departure_time": format_service_time(TRIP_SERVICE_DAY, stop["departure_sec"]),
                     }
                     for stop in stops
                 ],
-            },
-        }
-    )
+            }
+        )
+
+
+@app.route("/public_transport/city/<city>/trip/<trip_id>")
+def trip_details(city, trip_id):
+    # The response only depends on the URL and the feed, so a matching ETag
+    # is answered before the trip is even looked up.
+    feed_version = get_feed_version()
+    path_digest = hashlib.blake2b(request.path.encode(), digest_size=8).hexdigest()
+    etag = f"{feed_version}-{path_digest}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        trip_details_cache = city_caches(city).trip_details
+        trip_details_cache.set_generation(feed_version)
+        payload = trip_details_cache.get_or_compute(
+            trip_id, lambda: trip_details_payload(trip_id)
+        )
+        if payload is None:
+            return jsonify({"error": "Trip not found"}), 404
+        metadata = json.dumps(
+            {
+                "self": request.path,
+                "city": city,
+                "query_parameters": {"trip_id": trip_id},
+            }
+        )
+        response = app.response_class(
+            f'{{"metadata":{metadata},"trip_details":{payload}}}',
+            mimetype="application/json",
+        )
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = TRIP_DETAILS_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def parse_coordinates(params, name):
+    """Return a ``"lat,lon"`` parameter with its latitude and longitude.
+
+    Raises ValueError when it is missing or malformed, like every parser of
+    request parameters; the endpoints answer those with a 400.
+    """
+    value = params.get(name)
+    if not isinstance(value, str):
+        raise ValueError(f"Missing or invalid {name}")
+    lat, lon = map(float, value.split(","))
+    # float() also reads "nan" and "inf", which no grid cell or distance can take
+    if not (math.isfinite(lat) and math.isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"Invalid {name}")
+    return value, lat, lon
+
+
+def parse_start_time(params):
+    start_time = params.get("start_time")
+    if not isinstance(start_time, str):
+        raise ValueError("Missing or invalid start_time")
+    parse_iso_datetime(start_time)
+    return start_time
+
+
+def parse_limit(params, default=3):
+    limit = params.get("limit", default)
+    if isinstance(limit, bool) or not isinstance(limit, (int, str)):
+        raise ValueError("Invalid limit")
+    limit = int(limit)
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError("Invalid limit")
+    return limit
+
+
+def parse_departures_query(params):
+    """Return the ``query_parameters`` and ``get_closest_departures`` arguments
+    of one closest-departures query."""
+    if not isinstance(params, dict):
+        raise ValueError("Expected an object of query parameters")
+    start_coords, start_lat, start_lon = parse_coordinates(params, "start_coordinates")
+    end_coords, end_lat, end_lon = parse_coordinates(params, "end_coordinates")
+    start_time = parse_start_time(params)
+    limit = parse_limit(params)
+    query_parameters = {
+        "start_coordinates": start_coords,
+        "end_coordinates": end_coords,
+        "start_time": start_time,
+        "limit": limit,
+    }
+    return query_parameters, (start_lat, start_lon, end_lat, end_lon, start_time, limit)
 
 
 @app.route("/public_transport/city/<city>/closest_departures")
 def closest_departures(city):
     try:
-        start_coords = request.args.get("start_coordinates")
-        end_coords = request.args.get("end_coordinates")
-        start_time = request.args.get("start_time")
-        limit = int(request.args.get("limit", 3))
+        query_parameters, arguments = parse_departures_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    key, snapped = departures_request(*arguments)
+    departures_cache = city_caches(city).departures
+    departures_cache.set_generation(get_feed_version())
+    metadata = {
+        "self": request.full_path,
+        "city": city,
+        "query_parameters": query_parameters,
+    }
+    if wants_ndjson():
+        return stream_departures(departures_cache, metadata, key, snapped)
+    departures = departures_cache.get_or_compute(
+        key, lambda: get_closest_departures(*snapped)
+    )
+
+    with span("serialize"):
+        return jsonify({"metadata": metadata, "departures": departures})
+
+
+def wants_ndjson():
+    return (
+        request.args.get("format") == "ndjson"
+        or request.accept_mimetypes.best == NDJSON_MIMETYPE
+    )
+
+
+def stream_departures(departures_cache, metadata, key, snapped):
+    """Stream the metadata and then one departure per line as they are found.
+
+    A cached result is replayed; otherwise the departures are read from the
+    backend while they are sent and cached once the last one is out.
+    """
+    cached = departures_cache.get(key)
+
+    def generate():
+        yield json.dumps({"metadata": metadata}) + "\n"
+        if cached is not None:
+            for departure in cached:
+                yield json.dumps(departure) + "\n"
+            return
+        departures = []
+        for departure in iter_closest_departures(*snapped):
+            departures.append(departure)
+            yield json.dumps(departure) + "\n"
+        departures_cache.set(key, departures)
+
+    body = generate()
+    # The trace and the use of the city end with the stream instead of with this view
+    trace = g.pop("trace", None)
+    if trace is not None:
+        body = instrumentation.traced_stream(trace, body)
+    city = g.pop("city", None)
+    if city is not None:
+        body = cities.stream(*city, body)
+    return app.response_class(stream_with_context(body), mimetype=NDJSON_MIMETYPE)
+
+
+@app.route("/public_transport/city/<city>/stop/<int:stop_id>/departures")
+def stop_departures(city, stop_id):
+    try:
+        limit = parse_limit(request.args, BOARD_LIMIT)
+        # The current minute unless a start_time is given
+        start_time = parse_start_time(request.args) if "start_time" in request.args else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    with span("query"):
+        board = get_departure_boards().departures(stop_id, limit, start_time)
+    if board is None:
+        return jsonify({"error": "Stop not found"}), 404
+    board_time, payload = board
+    metadata = json.dumps(
+        {
+            "self": request.full_path,
+            "city": city,
+            "query_parameters": {"stop_id": stop_id, "start_time": board_time, "limit": limit},
+        }
+    )
+    return app.response_class(
+        f'{{"metadata":{metadata},"departures":{payload}}}', mimetype="application/json"
+    )
+
+
+@app.route("/public_transport/city/<city>/stop/<int:stop_id>/departures/stream")
+def stop_departures_stream(city, stop_id):
+    try:
+        limit = parse_limit(request.args, BOARD_LIMIT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if get_stop_index().get(stop_id) is None:
+        return jsonify({"error": "Stop not found"}), 404
+
+    def evaluate():
+        return get_departure_boards().next_departures(stop_id, limit)
+
+    query_parameters = {"stop_id": stop_id, "limit": limit}
+    return subscribe(city, ("stop", stop_id, limit), evaluate, query_parameters)
+
+
+@app.route("/public_transport/city/<city>/closest_departures/stream")
+def closest_departures_stream(city):
+    try:
+        start_coords, start_lat, start_lon = parse_coordinates(request.args, "start_coordinates")
+        end_coords, end_lat, end_lon = parse_coordinates(request.args, "end_coordinates")
+        limit = parse_limit(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Always the current minute; subscribers near the same points share a topic
+    _, snapped = departures_request(
+        start_lat, start_lon, end_lat, end_lon, get_departure_boards().now(), limit
+    )
+    points = snapped[:4]
+
+    def evaluate():
+        start_time = get_departure_boards().now()
+        return start_time, get_closest_departures(*points, start_time, limit)
+
+    query_parameters = {
+        "start_coordinates": start_coords,
+        "end_coordinates": end_coords,
+        "limit": limit,
+    }
+    return subscribe(city, ("closest_departures", *points, limit), evaluate, query_parameters)
+
+
+def subscribe(city, key, evaluate, query_parameters):
+    """Stream the events of the subscription ``key`` as Server-Sent Events."""
+    subscriptions = get_subscriptions()
+    with span("query"):
+        topic = subscriptions.subscribe(key, evaluate)
+    if topic is None:
+        return jsonify({"error": "Too many subscriptions"}), 503, {"Retry-After": "5"}
+    metadata = event(
+        "metadata",
+        {"self": request.full_path, "city": city, "query_parameters": query_parameters},
+    )
+    # The trace covers subscribing, not the hours a display may stay connected
+    trace = g.pop("trace", None)
+    if trace is not None:
+        instrumentation.finish_trace(trace, 200)
+    # The city stays in use until the stream is closed
+    checked_out = g.pop("city", None)
+    on_close = None if checked_out is None else (lambda: cities.checkin(checked_out[0]))
+    body = subscriptions.stream(topic, metadata, on_close)
+    # Passed through as it is, so the ASGI mode can await its events on the event loop
+    response = app.response_class(body, mimetype=EVENT_STREAM_MIMETYPE, direct_passthrough=True)
+    response.headers["Cache-Control"] = "no-cache"
+    # Proxies must not buffer the events
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
-        start_lat, start_lon = map(float, start_coords.split(","))
-        end_lat, end_lon = map(float, end_coords.split(","))
 
-        departures = get_closest_departures(
-            start_lat, start_lon, end_lat, end_lon, start_time, limit
+@app.route("/public_transport/city/<city>/closest_departures/batch", methods=["POST"])
+def closest_departures_batch(city):
+    try:
+        body = request.get_json(silent=True)
+        queries = body.get("queries") if isinstance(body, dict) else None
+        if not isinstance(queries, list):
+            raise ValueError("Expected a JSON object with a list of queries")
+        if len(queries) > MAX_BATCH_QUERIES:
+            raise ValueError(f"At most {MAX_BATCH_QUERIES} queries per batch")
+        parsed = [parse_departures_query(query) for query in queries]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results = get_closest_departures_batch([arguments for _, arguments in parsed])
+    with span("serialize"):
+        return jsonify(
+            {
+                "metadata": {
+                    "self": request.path,
+                    "city": city,
+                    "count": len(results),
+                },
+                "results": [
+                    {"query_parameters": query_parameters, "departures": departures}
+                    for (query_parameters, _), departures in zip(parsed, results)
+                ],
+            }
         )
 
+
+@app.route("/public_transport/city/<city>/journeys")
+def journeys(city):
+    try:
+        start_coords, start_lat, start_lon = parse_coordinates(request.args, "start_coordinates")
+        end_coords, end_lat, end_lon = parse_coordinates(request.args, "end_coordinates")
+        start_time = parse_start_time(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    journey = plan_journey(start_lat, start_lon, end_lat, end_lon, start_time)
+    with span("serialize"):
         return jsonify(
             {
                 "metadata": {
@@ -76,15 +495,39 @@ def closest_departures(city):
                         "start_coordinates": start_coords,
                         "end_coordinates": end_coords,
                         "start_time": start_time,
-                        "limit": limit,
                     },
                 },
-                "departures": departures,
+                "journeys": [journey] if journey else [],
             }
         )
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/public_transport/cache/stats")
+def cache_stats():
+    return jsonify(
+        {
+            "closest_departures": departures_cache.stats(),
+            "trip_details": trip_details_cache.stats(),
+            "departure_boards": get_departure_boards().stats(),
+            "subscriptions": get_subscriptions().stats(),
+            "cities": {
+                city: {
+                    "closest_departures": caches.departures.stats(),
+                    "trip_details": caches.trip_details.stats(),
+                }
+                for city, caches in list(_city_caches.items())
+            },
+        }
+    )
+
+
+@app.route("/public_transport/cities")
+def city_stats():
+    return jsonify(cities.stats())
 
 
 if __name__ == "__main__":
+    # The reloader's child process is the one serving requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warmup.start()
     app.run(debug=True, port=5002)
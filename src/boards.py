@@ -0,0 +1,246 @@
+"""Departure boards: the next departures from one stop, kept ready.
+
+Kiosk displays poll the next departures of a single stop every few seconds.
+``DepartureBoards`` keeps a board per stop and service date: all of that
+day's departures from the stop in time order, including the previous day's
+trips still running after midnight, read with one backend lookup on the
+first request for the stop (``models.get_stop_day``). Each board has a
+cursor at the first departure of a minute. A minute tick moves the cursors
+of the current service day's boards to the current minute, so the next
+``limit`` departures are the slice after the cursor, and each slice is
+serialized once per minute and limit. Requests for another minute search
+the board without moving its cursor.
+
+The current minute is the wall clock in ``FEED_TIMEZONE`` (default
+``Europe/Warsaw``), written in the API's timestamp format. Boards are kept
+for ``DEPARTURE_BOARDS_SIZE`` stops and dates (2,000 by default) and dropped
+after ``DEPARTURE_BOARDS_IDLE_MINUTES`` (10) without requests; a new feed
+version, checked once a minute, drops them all.
+"""
+
+import json
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import database
+import models
+from cache import time_bucket
+from utils import time_of_day_seconds
+
+DEFAULT_MAX_BOARDS = 2000
+DEFAULT_IDLE_MINUTES = 10
+DEFAULT_TIMEZONE = 'Europe/Warsaw'
+
+
+class _Board:
+    __slots__ = ('secs', 'departures', 'position', 'payloads', 'last_used')
+
+    def __init__(self, departures, now):
+        self.secs = [sec for sec, _ in departures]
+        self.departures = [departure for _, departure in departures]
+        # (sec, cursor), replaced as a whole so requests racing a tick never
+        # see the cursor of another minute
+        self.position = (0, 0)
+        # (sec, limit) -> serialized departures from the cursor; a request
+        # of the previous minute may still store its slice after a seek
+        self.payloads = {}
+        self.last_used = now
+
+    @property
+    def sec(self):
+        return self.position[0]
+
+    def seek(self, sec):
+        current, cursor = self.position
+        self.position = (sec, bisect_left(self.secs, sec, cursor if sec >= current else 0))
+        self.payloads = {}
+
+    def slice(self, sec, limit):
+        current, cursor = self.position
+        start = cursor if sec == current else bisect_left(self.secs, sec)
+        return self.departures[start:start + limit]
+
+
+class DepartureBoards:
+    """Boards of the stops of one database, advanced by ``tick()``.
+
+    ``clock`` returns the current datetime in the feed's timezone.
+    """
+
+    def __init__(self, max_boards=DEFAULT_MAX_BOARDS, idle_minutes=DEFAULT_IDLE_MINUTES,
+                 clock=datetime.now):
+        self.max_boards = max_boards
+        self.idle_seconds = idle_minutes * 60
+        self._clock = clock
+        self._boards = OrderedDict()  # (stop_id, day) -> _Board, least recently used first
+        self._lock = threading.Lock()
+        self._minute = None  # (day, sec) the cursors were last moved to
+        self._feed_minute = None
+        self._feed_version = None
+        self._counts = dict.fromkeys(('builds', 'hits', 'misses', 'ticks', 'evictions'), 0)
+
+    @classmethod
+    def from_environment(cls):
+        """Configure from ``DEPARTURE_BOARDS_SIZE``, ``DEPARTURE_BOARDS_IDLE_MINUTES``
+        and ``FEED_TIMEZONE``."""
+        zone = ZoneInfo(os.environ.get('FEED_TIMEZONE', DEFAULT_TIMEZONE))
+        return cls(
+            max_boards=int(os.environ.get('DEPARTURE_BOARDS_SIZE', DEFAULT_MAX_BOARDS)),
+            idle_minutes=float(os.environ.get('DEPARTURE_BOARDS_IDLE_MINUTES',
+                                              DEFAULT_IDLE_MINUTES)),
+            clock=lambda: datetime.now(zone),
+        )
+
+    def now(self):
+        """Return the current minute as a ``start_time``."""
+        return self._clock().strftime('%Y-%m-%dT%H:%M:00Z')
+
+    def tick(self, start_time=None):
+        """Move the cursors of the boards of ``start_time``'s day (default:
+        the current minute) to its minute, and drop boards of earlier days and
+        idle ones."""
+        start_time = start_time or self.now()
+        minute = (start_time[:10], time_of_day_seconds(start_time))
+        with self._lock:
+            if minute == self._minute:
+                return
+            self._minute = minute
+            self._counts['ticks'] += 1
+            now = time.monotonic()
+            for key, board in list(self._boards.items()):
+                if key[1] < minute[0] or now - board.last_used >= self.idle_seconds:
+                    # Past days' trips after midnight are on the current day's boards
+                    del self._boards[key]
+                    self._counts['evictions'] += 1
+                elif key[1] == minute[0]:
+                    board.seek(minute[1])
+
+    def departures(self, stop_id, limit, start_time=None):
+        """Return ``(start_time, serialized departures)`` for the next ``limit``
+        departures from ``stop_id`` at ``start_time``, rounded down to the
+        minute (default: the current minute), or None for an unknown stop."""
+        found = self._find(stop_id, start_time)
+        if found is None:
+            return None
+        start_time, board, sec = found
+        limit = max(limit, 0)
+        if board.sec != sec:
+            return start_time, json.dumps(board.slice(sec, limit), sort_keys=True)
+        payload = board.payloads.get((sec, limit))
+        if payload is None:
+            # Serialized like flask.json would
+            payload = json.dumps(board.slice(sec, limit), sort_keys=True)
+            board.payloads[sec, limit] = payload
+        return start_time, payload
+
+    def next_departures(self, stop_id, limit, start_time=None):
+        """Like ``departures``, with the departures as a list of the board's
+        dictionaries, which must not be modified."""
+        found = self._find(stop_id, start_time)
+        if found is None:
+            return None
+        start_time, board, sec = found
+        return start_time, board.slice(sec, max(limit, 0))
+
+    def _find(self, stop_id, start_time):
+        current = self.now()
+        start_time = current if start_time is None else time_bucket(start_time)
+        self._check_feed(current)
+        if start_time == current:
+            # The ticker may not have got to this minute yet
+            self.tick(current)
+        board = self._board(stop_id, start_time[:10])
+        if board is None:
+            return None
+        return start_time, board, time_of_day_seconds(start_time)
+
+    def _check_feed(self, current):
+        # Once a minute, by the first request of the minute
+        if current == self._feed_minute:
+            return
+        feed_version = models.get_feed_version()
+        with self._lock:
+            self._feed_minute = current
+            if feed_version != self._feed_version:
+                self._feed_version = feed_version
+                self._boards.clear()
+
+    def _board(self, stop_id, day):
+        key = (stop_id, day)
+        now = time.monotonic()
+        with self._lock:
+            board = self._boards.get(key)
+            if board is not None:
+                self._boards.move_to_end(key)
+                board.last_used = now
+                self._counts['hits'] += 1
+                return board
+            self._counts['misses'] += 1
+        stop, departures = models.get_stop_day(stop_id, day)
+        if stop is None:
+            return None
+        board = _Board(departures, now)
+        with self._lock:
+            board = self._boards.setdefault(key, board)
+            if self._minute is not None and self._minute[0] == day:
+                board.seek(self._minute[1])
+            self._counts['builds'] += 1
+            while len(self._boards) > self.max_boards:
+                self._boards.popitem(last=False)
+                self._counts['evictions'] += 1
+        return board
+
+    def stats(self):
+        with self._lock:
+            return {
+                'boards': len(self._boards),
+                'max_boards': self.max_boards,
+                'minute': None if self._minute is None else list(self._minute),
+                **self._counts,
+            }
+
+
+class MinuteTicker:
+    """Daemon thread calling ``tick()`` on registered objects at every minute."""
+
+    def __init__(self):
+        self._registered = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, ticked):
+        with self._lock:
+            self._registered.add(ticked)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='minute-ticker',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            # Just past the minute, so the tick sees the new one
+            time.sleep(60 - time.time() % 60 + 0.01)
+            with self._lock:
+                registered = list(self._registered)
+            for ticked in registered:
+                ticked.tick()
+
+
+minute_ticker = MinuteTicker()
+
+
+def _create_boards(conn):
+    boards = DepartureBoards.from_environment()
+    minute_ticker.register(boards)
+    return boards
+
+
+def get_departure_boards():
+    """Return the departure boards of the current pool, created on first use."""
+    return database.get_pool().shared('departure_boards', _create_boards, lasting=True)
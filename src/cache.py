@@ -0,0 +1,233 @@
+"""Response caches for ``closest_departures`` and ``trip_details``.
+
+Requests are keyed on snapped grid cells of the start and end points, a
+minute bucket of ``start_time`` and ``limit``, so users clicking near the same
+stops at the same time share one computation. The response is computed for
+the snapped request, which makes it valid for every request with that key.
+
+``ResponseCache`` is an in-process LRU with a TTL and a size bound. With a
+``SqliteStore`` it also reads and writes through a SQLite file shared by
+every worker process on the machine. Entries belong to a feed generation;
+when a new feed is imported the generation changes and older entries are
+dropped. Trip details never change within a generation, so they are cached
+pre-serialized without a TTL.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from math import floor, isfinite, isinf
+from pathlib import Path
+
+from utils import parse_iso_datetime
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 120
+# ~110 m cells around Wrocław (a degree of longitude is ~70 km there)
+DEFAULT_CELL_LAT = 0.001
+DEFAULT_CELL_LON = 0.0015
+DEFAULT_BUCKET_MINUTES = 1
+
+
+def snap(value, step):
+    """Return the centre of the grid cell of size ``step`` containing ``value``.
+
+    Raises ValueError for NaN and infinities, which have no cell.
+    """
+    if not isfinite(value):
+        raise ValueError(f'Cannot snap {value!r} to a grid cell')
+    return round((floor(value / step) + 0.5) * step, 7)
+
+
+def time_bucket(timestamp, minutes=DEFAULT_BUCKET_MINUTES):
+    """Round an ISO timestamp down to a ``minutes`` bucket, keeping its offset."""
+    moment = parse_iso_datetime(timestamp)
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = (moment - midnight) // timedelta(minutes=minutes)
+    bucket = (midnight + elapsed * timedelta(minutes=minutes)).isoformat()
+    return bucket[:-6] + 'Z' if bucket.endswith('+00:00') else bucket
+
+
+def departures_request(start_lat, start_lon, end_lat, end_lon, start_time, limit,
+                       cell_lat=DEFAULT_CELL_LAT, cell_lon=DEFAULT_CELL_LON,
+                       bucket_minutes=DEFAULT_BUCKET_MINUTES):
+    """Snap a ``closest_departures`` request; returns ``(key, snapped arguments)``."""
+    args = (
+        snap(start_lat, cell_lat), snap(start_lon, cell_lon),
+        snap(end_lat, cell_lat), snap(end_lon, cell_lon),
+        time_bucket(start_time, bucket_minutes), limit,
+    )
+    return 'closest_departures:' + ':'.join(map(str, args)), args
+
+
+class SqliteStore:
+    """Cache entries shared through a SQLite file, e.g. by several workers."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute(
+            '''CREATE TABLE IF NOT EXISTS response_cache (
+                   key TEXT PRIMARY KEY,
+                   generation TEXT NOT NULL,
+                   value TEXT NOT NULL,
+                   expires_at REAL NOT NULL
+               ) WITHOUT ROWID'''
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')  # losing the cache is harmless
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, generation, now):
+        row = self._connection().execute(
+            'SELECT value, expires_at FROM response_cache WHERE key = ? AND generation = ?',
+            (key, generation),
+        ).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, generation, value, expires_at):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)',
+            (key, generation, json.dumps(value, separators=(',', ':')), expires_at),
+        )
+
+    def prune(self, generation, now):
+        self._connection().execute(
+            'DELETE FROM response_cache WHERE generation != ? OR expires_at <= ?',
+            (generation, now),
+        )
+
+    def clear(self):
+        self._connection().execute('DELETE FROM response_cache')
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a TTL, optionally backed by a ``SqliteStore``."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 store=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._generation = None
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(
+            ('hits', 'shared_hits', 'misses', 'expired', 'evictions', 'invalidations'), 0
+        )
+
+    @classmethod
+    def from_environment(cls, prefix='RESPONSE_CACHE', max_entries=DEFAULT_MAX_ENTRIES,
+                         ttl_seconds=DEFAULT_TTL_SECONDS, namespace=None):
+        """Configure from ``<prefix>_SIZE``, ``<prefix>_TTL`` and ``<prefix>_PATH``
+        (the shared SQLite store, off by default).
+
+        A ``namespace`` gets a store file of its own next to ``<prefix>_PATH``,
+        since each store holds a single feed generation.
+        """
+        path = os.environ.get(f'{prefix}_PATH')
+        if path and namespace:
+            path = Path(path)
+            path = path.with_name(f'{path.stem}.{namespace}{path.suffix}')
+        return cls(
+            max_entries=int(os.environ.get(f'{prefix}_SIZE', max_entries)),
+            ttl_seconds=float(os.environ.get(f'{prefix}_TTL', ttl_seconds)),
+            store=SqliteStore(path) if path else None,
+        )
+
+    def set_generation(self, generation):
+        """Drop every entry if ``generation`` (the feed version) has changed."""
+        if generation == self._generation:
+            return
+        with self._lock:
+            if generation == self._generation:
+                return
+            if self._generation is not None:
+                self._counts['invalidations'] += 1
+            self._generation = generation
+            self._entries.clear()
+        if self.store is not None:
+            self.store.prune(generation, self._clock())
+
+    def get(self, key):
+        """Return the cached value, or None on a miss."""
+        now = self._clock()
+        outcome = 'misses'
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self._counts['hits'] += 1
+                    return entry[0]
+                del self._entries[key]
+                outcome = 'expired'
+            generation = self._generation
+        if self.store is not None:
+            shared = self.store.get(key, generation, now)
+            if shared is not None:
+                with self._lock:
+                    self._counts['shared_hits'] += 1
+                    self._insert(key, shared)
+                return shared[0]
+        with self._lock:
+            self._counts[outcome] += 1
+        return None
+
+    def set(self, key, value):
+        expires_at = self._clock() + self.ttl_seconds
+        with self._lock:
+            self._insert(key, (value, expires_at))
+            generation = self._generation
+        if self.store is not None:
+            self.store.set(key, generation, value, expires_at)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value, or compute and cache it unless it is None."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counts['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            entries = len(self._entries)
+        lookups = counts['hits'] + counts['shared_hits'] + counts['misses'] + counts['expired']
+        return {
+            **counts,
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'ttl_seconds': None if isinf(self.ttl_seconds) else self.ttl_seconds,
+            'shared_store': self.store.path if self.store is not None else None,
+            'hit_rate': (counts['hits'] + counts['shared_hits']) / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,193 @@
+"""Registry of the cities served by the API, each with its own database.
+
+``CITIES`` lists them as comma-separated ``name=path`` pairs, e.g.
+``CITIES=wroclaw=/data/wroclaw.sqlite,krakow=/data/krakow.sqlite``. Without
+it the only city is ``wroclaw``, served from the process-wide pool of
+``database.py`` (``TRIPS_DB_PATH``). City names are case-insensitive.
+
+A city's ``ConnectionPool``, and with it its stop index, timetable and other
+shared objects, is only opened by its first request, so startup does not
+grow with the number of cities. Loaded cities are closed again when they
+have not been used for ``CITY_IDLE_SECONDS`` (default 900), and, least
+recently used first, while the memory taken by their shared objects is over
+``CITY_MEMORY_BUDGET_MIB`` (unlimited by default). A city with requests in
+flight is never closed, and neither is the process-wide pool. Names that are
+not configured are rejected without touching the disk.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import database
+from database import FEED_CHECK_SECONDS, ConnectionPool
+
+DEFAULT_CITY = 'wroclaw'
+DEFAULT_IDLE_SECONDS = 900
+
+
+def normalize(city):
+    return city.strip().lower()
+
+
+def parse_cities(value):
+    """Parse ``name=path,...`` into ``{name: Path}``."""
+    paths = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, sep, path = item.partition('=')
+        if not sep or not normalize(name) or not path.strip():
+            raise ValueError(f'Expected name=path in CITIES, got {item!r}')
+        paths[normalize(name)] = Path(path.strip())
+    return paths
+
+
+class _LoadedCity:
+    __slots__ = ('pool', 'in_use', 'last_used')
+
+    def __init__(self, pool, now):
+        self.pool = pool
+        self.in_use = 0
+        self.last_used = now
+
+
+class CityRegistry:
+    """Connection pools of the configured cities, opened on first use.
+
+    ``paths`` maps each city to its database; a path of None stands for the
+    process-wide pool. ``on_evict(city)`` is called after a city is closed.
+    """
+
+    def __init__(self, paths, memory_budget_bytes=None, idle_seconds=DEFAULT_IDLE_SECONDS,
+                 on_evict=None, clock=time.monotonic, **pool_options):
+        self.paths = {normalize(name): path for name, path in paths.items()}
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_seconds = idle_seconds
+        self.on_evict = on_evict
+        self.pool_options = pool_options
+        self._clock = clock
+        self._loaded = OrderedDict()  # city -> _LoadedCity, least recently used first
+        self._lock = threading.Lock()
+        self._counts = {'loads': 0, 'evictions': 0}
+
+    @classmethod
+    def from_environment(cls, on_evict=None):
+        """Configure from ``CITIES``, ``CITY_IDLE_SECONDS`` and ``CITY_MEMORY_BUDGET_MIB``."""
+        cities = os.environ.get('CITIES')
+        budget_mib = os.environ.get('CITY_MEMORY_BUDGET_MIB')
+        idle_seconds = float(os.environ.get('CITY_IDLE_SECONDS', DEFAULT_IDLE_SECONDS))
+        return cls(
+            parse_cities(cities) if cities else {DEFAULT_CITY: None},
+            memory_budget_bytes=float(budget_mib) * 2**20 if budget_mib else None,
+            idle_seconds=idle_seconds if idle_seconds > 0 else None,
+            on_evict=on_evict,
+            immutable=os.environ.get('TRIPS_DB_IMMUTABLE', '') == '1',
+            check_seconds=float(os.environ.get('FEED_CHECK_SECONDS', FEED_CHECK_SECONDS)),
+        )
+
+    def __contains__(self, city):
+        return normalize(city) in self.paths
+
+    def checkout(self, city):
+        """Return the pool of ``city``, opening it if needed, and mark it in use
+        until ``checkin``. Raises KeyError for a city that is not configured."""
+        name = normalize(city)
+        path = self.paths[name]
+        now = self._clock()
+        with self._lock:
+            loaded = self._loaded.get(name)
+            if loaded is None:
+                # Opening a pool reads nothing yet; its first query does
+                pool = None if path is None else ConnectionPool(path, **self.pool_options)
+                loaded = self._loaded[name] = _LoadedCity(pool, now)
+                self._counts['loads'] += 1
+            self._loaded.move_to_end(name)
+            loaded.in_use += 1
+            loaded.last_used = now
+            evicted = self._evictions(now)
+        self._close(evicted)
+        # The process-wide pool may have been reconfigured since
+        return database.get_pool() if loaded.pool is None else loaded.pool
+
+    def checkin(self, city):
+        """End a use of ``city`` started by ``checkout``."""
+        name = normalize(city)
+        now = self._clock()
+        with self._lock:
+            loaded = self._loaded.get(name)
+            if loaded is not None:
+                loaded.in_use -= 1
+                loaded.last_used = now
+            evicted = self._evictions(now)
+        self._close(evicted)
+
+    def stream(self, city, pool, iterable):
+        """Yield from ``iterable`` with ``pool`` current and ``city`` in use,
+        for a response body produced after its view has returned."""
+        token = database.use_pool(pool)
+        try:
+            yield from iterable
+        finally:
+            try:
+                database.reset_pool(token)
+            except ValueError:
+                pass  # closed by the garbage collector, in another context
+            self.checkin(city)
+
+    def _memory(self, loaded):
+        pool = database.get_pool() if loaded.pool is None else loaded.pool
+        return pool.memory_bytes()
+
+    def _evictions(self, now):
+        # Called with the lock held; returns the closed cities and their pools
+        evicted = []
+        if self.idle_seconds is not None:
+            for name, loaded in list(self._loaded.items()):
+                if (loaded.pool is not None and not loaded.in_use
+                        and now - loaded.last_used >= self.idle_seconds):
+                    evicted.append((name, self._loaded.pop(name).pool))
+        if self.memory_budget_bytes is not None:
+            total = sum(self._memory(loaded) for loaded in self._loaded.values())
+            for name, loaded in list(self._loaded.items()):
+                if total <= self.memory_budget_bytes:
+                    break
+                if loaded.pool is not None and not loaded.in_use:
+                    total -= self._memory(loaded)
+                    evicted.append((name, self._loaded.pop(name).pool))
+        self._counts['evictions'] += len(evicted)
+        return evicted
+
+    def _close(self, evicted):
+        for name, pool in evicted:
+            pool.close_all()
+            if self.on_evict is not None:
+                self.on_evict(name)
+
+    def close_all(self):
+        with self._lock:
+            evicted = [(name, loaded.pool) for name, loaded in self._loaded.items()
+                       if loaded.pool is not None]
+            self._loaded.clear()
+        self._close(evicted)
+
+    def stats(self):
+        now = self._clock()
+        with self._lock:
+            loaded = {
+                name: {
+                    'in_use': city.in_use,
+                    'idle_seconds': round(now - city.last_used, 1),
+                    'memory_mib': round(self._memory(city) / 2**20, 1),
+                }
+                for name, city in self._loaded.items()
+            }
+            return {
+                'configured': sorted(self.paths),
+                'loaded': loaded,
+                'memory_budget_mib': (None if self.memory_budget_bytes is None
+                                      else round(self.memory_budget_bytes / 2**20, 1)),
+                **self._counts,
+            }
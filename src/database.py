@@ -1,6 +1,309 @@
+"""Pooled, read-only SQLite connections for the API.
+
+Every worker thread opens one connection on first use and keeps it for the
+life of the process, so requests no longer pay for opening the file, parsing
+the schema and warming the page cache. Connections are opened read-only
+(``mode=ro``, or ``immutable=1`` for databases that are never updated while
+the app runs) with memory-mapped I/O, a larger page cache and a bigger
+prepared-statement cache. The database is kept in WAL mode by the GTFS
+import, so readers are never blocked by a feed update.
+
+Pools follow feed changes. At most once every ``FEED_CHECK_SECONDS`` (1 s by
+default) a pool checks whether the file was replaced (a full import moves a
+new file into place) or written to (``PRAGMA data_version``, which an
+update's commit changes). Either way the threads reopen their connections
+and the shared objects derived from the feed are built again on next use.
+
+The database path defaults to ``trips.sqlite`` in the repository root and can
+be changed with the ``TRIPS_DB_PATH`` environment variable or ``configure()``.
+``use_pool()`` makes another pool current for the calling context, e.g. the
+pool of the city a request is for (see ``cities.py``).
+"""
+
+import contextvars
+import os
 import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import instrumentation
+
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / 'trips.sqlite'
+
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+CACHED_STATEMENTS = 256
+FEED_CHECK_SECONDS = 1.0
+
+
+class ConnectionPool:
+    """One read-only connection per thread to a single database file.
+
+    The pool also holds process-wide objects derived from the database (see
+    ``shared()``), so they are rebuilt whenever the pool is replaced or the
+    database changes.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, immutable=False, mmap_size=MMAP_SIZE,
+                 cache_size_kib=CACHE_SIZE_KIB, cached_statements=CACHED_STATEMENTS,
+                 check_seconds=FEED_CHECK_SECONDS):
+        self.path = Path(path).resolve()
+        self.immutable = immutable
+        self.check_seconds = check_seconds
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._build_locks = {}  # name -> lock held while that shared object is built
+        self._connections = {}  # thread -> connection
+        self._shared = {}
+        self._lasting = set()  # shared objects that outlive a feed change
+        self._shared_bytes = 0
+        self._opened = 0
+        self._checkouts = 0
+        # Bumped on a feed change; connections of an older generation are reopened
+        self._generation = 0
+        self._check_lock = threading.Lock()
+        self._next_check = 0.0
+        self._file_id = None
+        self._watcher = None  # connection reading PRAGMA data_version
+        self._data_version = None
+        self._changes = 0
+        # Set while a background warm-up builds the shared objects (see warmup.py)
+        self.defer_builds = False
+
+    def _connect(self):
+        uri = f'{self.path.as_uri()}?mode=ro'
+        if self.immutable:
+            uri += '&immutable=1'
+        # The connection only ever runs on the thread that opened it, but
+        # close_all() may close it from another one.
+        conn = sqlite3.connect(
+            uri, uri=True, check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = {-int(self.cache_size_kib)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.execute('PRAGMA query_only = ON')
+        if instrumentation.sql_trace_enabled():
+            instrumentation.trace_connection(conn)
+        return conn
+
+    def connection(self):
+        """Return the calling thread's connection, opening it on first use."""
+        if not self.immutable:
+            self.check_for_changes()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.generation != self._generation:
+            if conn is not None:
+                conn.close()
+            generation = self._generation
+            conn = self._connect()
+            self._local.conn, self._local.generation = conn, generation
+            with self._lock:
+                self._opened += 1
+                # Threads that have finished will never reuse their connection.
+                for thread in [t for t in self._connections if not t.is_alive()]:
+                    self._connections.pop(thread).close()
+                self._connections[threading.current_thread()] = conn
+        self._checkouts += 1
+        return conn
+
+    def check_for_changes(self, force=False):
+        """Start a new generation if the database file was replaced or
+        written to since the last check; return whether it was.
+
+        Checks run at most every ``check_seconds`` unless ``force`` is set,
+        and a caller never waits for another thread's check.
+        """
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return False
+        if not self._check_lock.acquire(blocking=force):
+            return False
+        try:
+            self._next_check = now + self.check_seconds
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return False  # not imported yet, or being moved into place
+            file_id = (stat.st_dev, stat.st_ino)
+            if file_id != self._file_id:
+                if self._watcher is not None:
+                    self._watcher.close()
+                self._watcher = self._connect()
+                data_version = self._watcher.execute('PRAGMA data_version').fetchone()[0]
+                changed = self._file_id is not None
+                self._file_id = file_id
+            else:
+                data_version = self._watcher.execute('PRAGMA data_version').fetchone()[0]
+                changed = data_version != self._data_version
+            self._data_version = data_version
+            if changed:
+                self._new_generation()
+            return changed
+        finally:
+            self._check_lock.release()
+
+    def _new_generation(self):
+        with self._lock:
+            self._generation += 1
+            self._changes += 1
+            self._shared = {name: self._shared[name] for name in self._lasting
+                            if name in self._shared}
+            self._shared_bytes = 0
+
+    def shared(self, name, build, fallback=None, lasting=False):
+        """Return the object ``build(conn)`` derived from this database.
+
+        It is built once per pool and feed, on first use, and shared by all
+        threads; a ``lasting`` object, which follows feed changes itself, is
+        kept when the feed changes. While ``defer_builds`` is set, an object
+        that is not built yet is not waited for when a ``fallback`` is given;
+        ``fallback`` is returned instead.
+        """
+        if not self.immutable:
+            self.check_for_changes()
+        try:
+            return self._shared[name]
+        except KeyError:
+            pass
+        if fallback is not None and self.defer_builds:
+            return fallback
+        # One lock per object: a build may use other objects, and a caller
+        # never waits for the build of an object it did not ask for.
+        with self._lock:
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+        with build_lock:
+            shared = self._shared.get(name)
+            if shared is None:
+                generation = self._generation
+                before, counted = resident_bytes(), self._shared_bytes
+                shared = build(self.connection())
+                with self._lock:
+                    # Built from a feed that has changed since: not kept
+                    if generation == self._generation:
+                        self._shared[name] = shared
+                        if lasting:
+                            self._lasting.add(name)
+                        if before is not None:
+                            # Objects built by a nested call are in both measurements
+                            self._shared_bytes = max(self._shared_bytes,
+                                                     counted + resident_bytes() - before)
+            return shared
+
+    def memory_bytes(self):
+        """Approximate resident memory taken by building the shared objects.
+
+        It is the growth of the process RSS while they were built, so
+        objects built concurrently, here or by other pools, are only
+        approximately accounted for.
+        """
+        return self._shared_bytes
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+            self._shared.clear()
+            self._shared_bytes = 0
+            if self._watcher is not None:
+                self._watcher.close()
+                self._watcher = None
+            self._file_id = None
+        self._local = threading.local()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': str(self.path),
+                'immutable': self.immutable,
+                'open_connections': len(self._connections),
+                'connections_opened': self._opened,
+                'checkouts': self._checkouts,
+                'reuse_ratio': 1 - self._opened / self._checkouts if self._checkouts else 0.0,
+                'shared_mib': round(self._shared_bytes / 2**20, 1),
+                'feed_changes': self._changes,
+            }
+
+
+def resident_bytes():
+    """Return the resident set size of the process, or None where unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pool used instead of the process-wide one in the current context
+_current_pool = contextvars.ContextVar('current_pool', default=None)
+
+
+def _settings_from_environment():
+    return {
+        'path': os.environ.get('TRIPS_DB_PATH', DEFAULT_DB_PATH),
+        'immutable': os.environ.get('TRIPS_DB_IMMUTABLE', '') == '1',
+        'check_seconds': float(os.environ.get('FEED_CHECK_SECONDS', FEED_CHECK_SECONDS)),
+    }
+
+
+def configure(path=None, immutable=None, **options):
+    """Point the process-wide pool at a database, closing the previous one.
+
+    ``path`` and ``immutable`` default to the ``TRIPS_DB_PATH`` and
+    ``TRIPS_DB_IMMUTABLE`` environment variables.
+    """
+    global _pool
+    settings = _settings_from_environment()
+    options.setdefault('check_seconds', settings['check_seconds'])
+    pool = ConnectionPool(
+        settings['path'] if path is None else path,
+        settings['immutable'] if immutable is None else immutable,
+        **options,
+    )
+    with _pool_lock:
+        previous, _pool = _pool, pool
+    if previous is not None:
+        previous.close_all()
+    return pool
+
+
+def get_pool():
+    """Return the current context's pool, or else the process-wide one."""
+    global _pool
+    current = _current_pool.get()
+    if current is not None:
+        return current
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(**_settings_from_environment())
+    return _pool
+
+
+def use_pool(pool):
+    """Make ``pool`` the calling context's pool until ``reset_pool(token)``;
+    None stands for the process-wide pool."""
+    return _current_pool.set(pool)
+
+
+def reset_pool(token):
+    _current_pool.reset(token)
+
 
 def get_db_connection():
-    conn = sqlite3.connect('trips.sqlite')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Return the calling thread's pooled connection; do not close it."""
+    return get_pool().connection()
+
+
+def pool_stats():
+    return get_pool().stats()
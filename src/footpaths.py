@@ -0,0 +1,122 @@
+"""Walking transfers between stops, computed once per feed at import.
+
+``footpath_rows`` pairs every stop with the stops within walking distance and
+groups stops into stations; the import stores the result in the
+``footpaths`` and ``stop_stations`` tables. ``Footpaths`` loads them into
+arrays grouped by stop, so the neighbours of a stop are one slice away
+instead of a distance computation over the stop index.
+
+Stops sharing a ``stop_name`` are platforms of one station when each is
+within ``STATION_RADIUS_KM`` of another one of them. Two stops of a station
+are linked by a footpath when they are within ``STATION_RADIUS_KM`` of each
+other, even when further apart than the footpath radius; platforms of a
+station chained over a longer distance are not linked directly.
+"""
+
+from array import array
+
+from spatial import StopIndex
+from utils import walking_seconds
+
+# Stops within this distance of each other are linked by a footpath
+FOOTPATH_RADIUS_KM = 0.4
+# Stops sharing a name within this distance of each other form a station
+STATION_RADIUS_KM = 1.0
+
+
+def _station_ids(stops, neighbours):
+    # Union-find over the same-name pairs within STATION_RADIUS_KM; a
+    # station is identified by its lowest stop_id.
+    parent = {stop["stop_id"]: stop["stop_id"] for stop in stops}
+
+    def root(stop_id):
+        while parent[stop_id] != stop_id:
+            parent[stop_id] = parent[parent[stop_id]]
+            stop_id = parent[stop_id]
+        return stop_id
+
+    for stop, nearby in zip(stops, neighbours):
+        for distance_km, other in nearby:
+            if distance_km <= STATION_RADIUS_KM and other["stop_name"] == stop["stop_name"]:
+                a, b = root(stop["stop_id"]), root(other["stop_id"])
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+    return {stop_id: root(stop_id) for stop_id in parent}
+
+
+def footpath_rows(stops, radius_km=FOOTPATH_RADIUS_KM):
+    """Return ``(footpaths, stations)`` rows for a list of stop records.
+
+    Footpaths are ``(from_stop_id, to_stop_id, distance_m, walk_sec)`` in
+    both directions; stations are ``(stop_id, station_id)`` for the stops
+    grouped with another one.
+    """
+    stops = list(stops)
+    index = StopIndex(stops)
+    reach_km = max(radius_km, STATION_RADIUS_KM)
+    neighbours = [
+        [(distance_km, other)
+         for distance_km, other in index.nearest(stop["stop_lat"], stop["stop_lon"],
+                                                 k=len(index), radius_km=reach_km)
+         if other["stop_id"] != stop["stop_id"]]
+        for stop in stops
+    ]
+    station_of = _station_ids(stops, neighbours)
+    footpaths = [
+        (stop["stop_id"], other["stop_id"], round(distance_km * 1000), walking_seconds(distance_km))
+        for stop, nearby in zip(stops, neighbours)
+        for distance_km, other in nearby
+        if distance_km <= radius_km or station_of[stop["stop_id"]] == station_of[other["stop_id"]]
+    ]
+    grouped = {station for stop_id, station in station_of.items() if stop_id != station}
+    stations = sorted(
+        (stop_id, station) for stop_id, station in station_of.items() if station in grouped
+    )
+    return footpaths, stations
+
+
+class Footpaths:
+    """Footpath adjacency lists held in flat arrays.
+
+    The footpaths of a stop are a contiguous slice of the arrays, sorted by
+    distance, so ``neighbours`` costs O(degree).
+    """
+
+    def __init__(self, rows, stations=()):
+        """``rows`` are ``(from_stop_id, to_stop_id, distance_m, walk_sec)``."""
+        rows = sorted(rows, key=lambda row: (row[0], row[2], row[1]))
+        self._slices = {}
+        for i, (from_stop, *_) in enumerate(rows):
+            start, _ = self._slices.get(from_stop, (i, i))
+            self._slices[from_stop] = (start, i + 1)
+        self.to_stop = array('q', (row[1] for row in rows))
+        self.distance_m = array('I', (row[2] for row in rows))
+        self.walk_sec = array('I', (row[3] for row in rows))
+        self._station = dict(stations)
+        self._station_stops = {}
+        for stop_id, station in sorted(self._station.items()):
+            self._station_stops.setdefault(station, []).append(stop_id)
+
+    @classmethod
+    def from_connection(cls, conn):
+        return cls(
+            conn.execute('SELECT from_stop_id, to_stop_id, distance_m, walk_sec FROM footpaths'),
+            conn.execute('SELECT stop_id, station_id FROM stop_stations'),
+        )
+
+    def __len__(self):
+        return len(self.to_stop)
+
+    def neighbours(self, stop_id):
+        """Return ``(stop_id, distance_m, walk_sec)`` for the stops reachable on foot."""
+        start, end = self._slices.get(stop_id, (0, 0))
+        return list(zip(self.to_stop[start:end], self.distance_m[start:end],
+                        self.walk_sec[start:end]))
+
+    def station(self, stop_id):
+        """Return the id of the station of a stop; a stop on its own is its own station."""
+        return self._station.get(stop_id, stop_id)
+
+    def station_stops(self, stop_id):
+        """Return the ids of all stops of the station of ``stop_id``."""
+        return self._station_stops.get(self.station(stop_id), [stop_id])
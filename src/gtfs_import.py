@@ -0,0 +1,516 @@
+"""Import of a GTFS feed into the SQLite database used by the API.
+
+A full import streams every GTFS file into its table with batched
+``executemany`` calls inside a single transaction, with journaling and syncing
+switched off for the duration of the load. The database is built in a
+temporary file and moved into place once complete, so a re-import never
+appends duplicate rows.
+
+An update (``--update``) applies a newer feed to a live database instead:
+files whose hash did not change are skipped, and only trips that were
+inserted, changed or deleted are rewritten together with their stop times.
+The database runs in WAL mode, so readers keep answering from the previous
+version until the update commits.
+
+Both also write the binary timetable snapshot that the API workers map
+(see ``snapshot.py``) next to the database::
+
+    python src/gtfs_import.py [--gtfs-dir DIR] [--db trips.sqlite] [--update]
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+
+from footpaths import FOOTPATH_RADIUS_KM, footpath_rows
+from schema import (DERIVED_TABLES, FEED_METADATA, INDEXES, SCHEMA_VERSION, TABLES,
+                    create_table_sql)
+from snapshot import write_snapshot
+from utils import parse_gtfs_time
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_GTFS_DIR = REPO_ROOT / "OtwartyWroclaw_rozklad_jazdy_GTFS"
+DEFAULT_DB_PATH = REPO_ROOT / "trips.sqlite"
+BATCH_SIZE = 10000
+
+# Tables whose rows belong to a trip; they are diffed trip by trip.
+TRIP_TABLES = ("trips", "stop_times")
+
+FAST_LOAD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",
+]
+
+
+def _numeric(convert):
+    # Like SQLite's column affinity, keep values that are not numbers as text.
+    def converter(value):
+        try:
+            return convert(value)
+        except ValueError:
+            return value
+    return converter
+
+
+CONVERTERS = {
+    "INTEGER": _numeric(int),
+    "REAL": _numeric(float),
+    "TEXT": str,
+    "TIME": parse_gtfs_time,
+}
+
+
+def _row_converter(table, header, trip_keys=None):
+    """Build a function mapping a CSV row to the table's column values.
+
+    ``TRIP`` columns are looked up in ``trip_keys``, ``{trip_id: trip_key}``.
+    """
+    positions = {name: i for i, name in enumerate(header)}
+    fields = []
+    for column in table.columns:
+        position = positions.get(column.source)
+        converter = trip_keys.get if column.type == "TRIP" else CONVERTERS[column.type]
+        fields.append((position, converter))
+
+    def convert(row):
+        values = []
+        for position, converter in fields:
+            value = row[position] if position is not None and position < len(row) else ""
+            values.append(converter(value) if value != "" else None)
+        return values
+
+    return convert
+
+
+def _read_csv(path):
+    """Yield the header and then the rows of a GTFS file."""
+    # utf-8-sig strips the byte order mark the published feed starts with.
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        yield [name.strip() for name in next(reader)]
+        for row in reader:
+            if row:
+                yield row
+
+
+class TripDigests:
+    """Order-independent digest of every trip row and its stop_times rows.
+
+    Each row is hashed on its own and the hashes of a trip are summed, so the
+    digest does not depend on the order in which the feed lists stop times.
+    """
+
+    MASK = (1 << 63) - 1  # fits a signed SQLite INTEGER
+
+    def __init__(self):
+        self.digests = {}
+
+    def add(self, trip_id, row):
+        row_hash = hashlib.blake2b("\x1f".join(row).encode(), digest_size=8).digest()
+        total = self.digests.get(trip_id, 0) + int.from_bytes(row_hash, "big")
+        self.digests[trip_id] = total & self.MASK
+
+    @classmethod
+    def from_files(cls, gtfs_dir):
+        digests = cls()
+        for name in TRIP_TABLES:
+            rows = _read_csv(Path(gtfs_dir) / f"{name}.txt")
+            position = next(rows).index("trip_id")
+            for row in rows:
+                digests.add(row[position], row)
+        return digests
+
+
+def load_table(conn, table, path, batch_size=BATCH_SIZE, trip_ids=None, digests=None):
+    """Stream one GTFS file into its table and return the number of rows.
+
+    With ``trip_ids`` only the rows of those trips are inserted. ``digests``
+    (a ``TripDigests``) is fed with every row of the file. Tables referring
+    to trips by ``trip_key`` are loaded after ``trips``; their rows of trips
+    missing from it are skipped.
+    """
+    placeholders = ", ".join("?" * len(table.columns))
+    insert = f"INSERT INTO {table.name} VALUES ({placeholders})"
+    rows = _read_csv(path)
+    header = next(rows)
+    trip_keys = None
+    if any(column.type == "TRIP" for column in table.columns):
+        trip_keys = dict(conn.execute("SELECT trip_id, trip_key FROM trips"))
+    convert = _row_converter(table, header, trip_keys)
+    if trip_ids is not None or digests is not None or trip_keys is not None:
+        position = header.index("trip_id")
+        if digests is not None:
+            rows = (digests.add(row[position], row) or row for row in rows)
+        if trip_ids is not None:
+            rows = (row for row in rows if row[position] in trip_ids)
+        if trip_keys is not None:
+            rows = (row for row in rows if row[position] in trip_keys)
+
+    count = 0
+    values = (convert(row) for row in rows)
+    while True:
+        batch = list(islice(values, batch_size))
+        if not batch:
+            break
+        conn.executemany(insert, batch)
+        count += len(batch)
+    return count
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def feed_file_hashes(gtfs_dir):
+    """Return ``{file name: sha256}`` for the feed files present in ``gtfs_dir``."""
+    return {
+        table.file: file_sha256(Path(gtfs_dir) / table.file)
+        for table in TABLES
+        if (Path(gtfs_dir) / table.file).exists()
+    }
+
+
+def current_feed_version(conn):
+    """Return the latest applied ``feed_versions`` row, or None."""
+    return conn.execute(
+        "SELECT * FROM feed_versions ORDER BY version DESC LIMIT 1"
+    ).fetchone()
+
+
+def feed_version_key(conn):
+    """Return an identifier of the feed version in the database, or None."""
+    row = current_feed_version(conn)
+    return f"{row[0]}:{row[1][:16]}" if row else None
+
+
+def _record_feed(conn, file_hashes, mode, inserted, changed, deleted):
+    conn.execute("DELETE FROM feed_files")
+    conn.executemany("INSERT INTO feed_files VALUES (?, ?)", sorted(file_hashes.items()))
+    feed_hash = hashlib.sha256(
+        "".join(f"{name}:{sha}\n" for name, sha in sorted(file_hashes.items())).encode()
+    ).hexdigest()
+    feed_dates = conn.execute(
+        "SELECT feed_start_date, feed_end_date FROM feed_info LIMIT 1"
+    ).fetchone() or (None, None)
+    conn.execute(
+        """INSERT INTO feed_versions (
+               feed_hash, feed_start_date, feed_end_date, mode, applied_at,
+               trips_inserted, trips_changed, trips_deleted
+           ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (feed_hash, *feed_dates, mode,
+         datetime.now(timezone.utc).isoformat(timespec="seconds"),
+         inserted, changed, deleted),
+    )
+
+
+def build_variant_stops(conn):
+    """Rebuild ``variant_stops`` from one trip of every variant.
+
+    Trips of a variant share its stop sequence. Walking it backwards, every
+    stop gets the bounding box of the stops after it. Returns the row count.
+    """
+    for statement in DERIVED_TABLES:
+        conn.execute(statement)
+    conn.execute("DELETE FROM variant_stops")
+    rows = conn.execute(
+        """SELECT v.variant_id, st.stop_sequence, st.stop_id, s.stop_lat, s.stop_lon
+           FROM (SELECT variant_id, MIN(trip_key) AS trip_key
+                 FROM trips
+                 WHERE variant_id IS NOT NULL
+                 GROUP BY variant_id) v
+           JOIN stop_times st ON st.trip_key = v.trip_key
+           JOIN stops s ON s.stop_id = st.stop_id
+           ORDER BY v.variant_id, st.stop_sequence DESC"""
+    )
+    paths = []
+    variant = box = None
+    for variant_id, sequence, stop_id, lat, lon in rows:
+        if variant_id != variant:
+            variant, box = variant_id, None
+        if box is not None:
+            paths.append((variant_id, sequence, stop_id, *box))
+            min_lat, max_lat, min_lon, max_lon = box
+            box = (min(min_lat, lat), max(max_lat, lat), min(min_lon, lon), max(max_lon, lon))
+        else:
+            box = (lat, lat, lon, lon)
+    conn.executemany("INSERT INTO variant_stops VALUES (?, ?, ?, ?, ?, ?, ?)", paths)
+    return len(paths)
+
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+def _gtfs_date(value):
+    return datetime.strptime(str(value), "%Y%m%d").date()
+
+
+def build_service_dates(conn):
+    """Rebuild ``service_dates`` from ``calendar`` and ``calendar_dates``.
+
+    Every date between a service's start and end date on which its weekday
+    flag is set gets a row, then exception type 1 adds a date and type 2
+    removes one. Returns the row count.
+    """
+    for statement in DERIVED_TABLES:
+        conn.execute(statement)
+    conn.execute("DELETE FROM service_dates")
+    active = set()
+    for service_id, *weekdays, start_date, end_date in conn.execute(
+        f"SELECT service_id, {', '.join(WEEKDAYS)}, start_date, end_date FROM calendar"
+    ):
+        day, last = _gtfs_date(start_date), _gtfs_date(end_date)
+        while day <= last:
+            if weekdays[day.weekday()] == 1:
+                active.add((int(day.strftime("%Y%m%d")), service_id))
+            day += timedelta(days=1)
+    for service_id, date, exception_type in conn.execute(
+        "SELECT service_id, date, exception_type FROM calendar_dates"
+    ):
+        if exception_type == 1:
+            active.add((date, service_id))
+        elif exception_type == 2:
+            active.discard((date, service_id))
+    conn.executemany("INSERT INTO service_dates VALUES (?, ?)", sorted(active))
+    return len(active)
+
+
+def build_footpaths(conn, radius_km=FOOTPATH_RADIUS_KM):
+    """Rebuild ``footpaths`` and ``stop_stations`` from ``stops``.
+
+    Stops within ``radius_km`` of each other, and the stops of a station,
+    are linked with their distance and walking time. Returns the footpath
+    count.
+    """
+    for statement in DERIVED_TABLES:
+        conn.execute(statement)
+    conn.execute("DELETE FROM footpaths")
+    conn.execute("DELETE FROM stop_stations")
+    stops = [
+        {"stop_id": stop_id, "stop_name": name, "stop_lat": lat, "stop_lon": lon}
+        for stop_id, name, lat, lon in conn.execute(
+            "SELECT stop_id, stop_name, stop_lat, stop_lon FROM stops"
+        )
+    ]
+    footpaths, stations = footpath_rows(stops, radius_km)
+    conn.executemany("INSERT INTO footpaths VALUES (?, ?, ?, ?)", footpaths)
+    conn.executemany("INSERT INTO stop_stations VALUES (?, ?)", stations)
+    return len(footpaths)
+
+
+def _report(label, rows, seconds):
+    rate = rows / seconds if seconds > 0 else float("inf")
+    print(f"{label:<20} {rows:>10,} rows {seconds:8.2f} s {rate:>12,.0f} rows/s")
+
+
+def import_feed(gtfs_dir=DEFAULT_GTFS_DIR, db_path=DEFAULT_DB_PATH,
+                batch_size=BATCH_SIZE, verbose=True, footpath_radius_km=FOOTPATH_RADIUS_KM):
+    """Build a fresh database from ``gtfs_dir`` and move it to ``db_path``.
+
+    Returns ``{table name: row count}``.
+    """
+    gtfs_dir, db_path = Path(gtfs_dir), Path(db_path)
+    tmp_path = db_path.with_name(db_path.name + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    counts = {}
+    digests = TripDigests()
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        for pragma in FAST_LOAD_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("BEGIN")
+        for statement in FEED_METADATA:
+            conn.execute(statement)
+        for table in TABLES:
+            conn.execute(create_table_sql(table))
+            path = gtfs_dir / table.file
+            if not path.exists():
+                if verbose:
+                    print(f"{table.file:<20} missing, table left empty")
+                continue
+            started = time.perf_counter()
+            counts[table.name] = load_table(
+                conn, table, path, batch_size,
+                digests=digests if table.name in TRIP_TABLES else None,
+            )
+            if verbose:
+                _report(table.file, counts[table.name], time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for statement in INDEXES:
+            conn.execute(statement)
+        counts["variant_stops"] = build_variant_stops(conn)
+        counts["service_dates"] = build_service_dates(conn)
+        counts["footpaths"] = build_footpaths(conn, footpath_radius_km)
+        conn.executemany("INSERT INTO trip_digests VALUES (?, ?)", digests.digests.items())
+        _record_feed(conn, feed_file_hashes(gtfs_dir), "full", len(digests.digests), 0, 0)
+        conn.execute("ANALYZE")
+        conn.execute("COMMIT")
+        feed_version = feed_version_key(conn)
+        if verbose:
+            print(f"{'indexes':<20} {len(INDEXES):>10} built {time.perf_counter() - started:8.2f} s")
+        # Leave the database in WAL mode so later updates don't block readers.
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+    except BaseException:
+        conn.close()
+        tmp_path.unlink()
+        raise
+    conn.close()
+    replace_database(tmp_path, db_path)
+    save_snapshot(db_path, feed_version, verbose)
+    return counts
+
+
+def save_snapshot(db_path, feed_version, verbose=True, conn=None):
+    """Write the timetable snapshot of the database at ``db_path``."""
+    started = time.perf_counter()
+    path, size = write_snapshot(db_path, feed_version, conn=conn)
+    if verbose:
+        print(f"{path.name:<20} {size / 2**20:>10.1f} MiB {time.perf_counter() - started:8.2f} s")
+
+
+def replace_database(tmp_path, db_path):
+    """Move a database built at ``tmp_path`` over the one at ``db_path``."""
+    # WAL files of a previous database must not be applied to the new one.
+    for suffix in ("-wal", "-shm"):
+        stale = db_path.with_name(db_path.name + suffix)
+        if stale.exists():
+            stale.unlink()
+    os.replace(tmp_path, db_path)
+
+
+def update_feed(gtfs_dir=DEFAULT_GTFS_DIR, db_path=DEFAULT_DB_PATH,
+                batch_size=BATCH_SIZE, verbose=True, footpath_radius_km=FOOTPATH_RADIUS_KM):
+    """Apply the feed in ``gtfs_dir`` to an existing database in place.
+
+    Returns ``{"inserted": n, "changed": n, "deleted": n}`` trip counts, or
+    None when the feed files are identical to the ones already applied. A
+    missing database gets a full import instead.
+    """
+    gtfs_dir, db_path = Path(gtfs_dir), Path(db_path)
+    if not db_path.exists():
+        import_feed(gtfs_dir, db_path, batch_size, verbose, footpath_radius_km)
+        return None
+
+    file_hashes = feed_file_hashes(gtfs_dir)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            raise RuntimeError(f"{db_path} has schema version {version}, convert it first "
+                               f"with: python src/migrate.py --db {db_path}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        applied = dict(conn.execute("SELECT file, sha256 FROM feed_files"))
+        changed_files = {name for name, sha in file_hashes.items() if applied.get(name) != sha}
+        if not changed_files:
+            if verbose:
+                print("Feed unchanged, nothing to update.")
+            return None
+
+        # Readers keep seeing the previous version until this transaction commits.
+        conn.execute("BEGIN IMMEDIATE")
+        for table in TABLES:
+            if table.file not in changed_files or table.name in TRIP_TABLES:
+                continue
+            started = time.perf_counter()
+            conn.execute(f"DELETE FROM {table.name}")
+            rows = load_table(conn, table, gtfs_dir / table.file, batch_size)
+            if verbose:
+                _report(table.file, rows, time.perf_counter() - started)
+
+        diff = {"inserted": 0, "changed": 0, "deleted": 0}
+        if changed_files & {f"{name}.txt" for name in TRIP_TABLES}:
+            started = time.perf_counter()
+            new = TripDigests.from_files(gtfs_dir).digests
+            old = dict(conn.execute("SELECT trip_id, digest FROM trip_digests"))
+            inserted = new.keys() - old.keys()
+            deleted = old.keys() - new.keys()
+            changed = {t for t in new.keys() & old.keys() if new[t] != old[t]}
+            diff = {"inserted": len(inserted), "changed": len(changed), "deleted": len(deleted)}
+
+            conn.execute("CREATE TEMP TABLE stale_trips (trip_id TEXT PRIMARY KEY)")
+            conn.executemany("INSERT INTO stale_trips VALUES (?)", ((t,) for t in changed | deleted))
+            conn.execute("""DELETE FROM stop_times WHERE trip_key IN (
+                                SELECT trip_key FROM trips
+                                WHERE trip_id IN (SELECT trip_id FROM stale_trips))""")
+            for name in ("trips", "trip_digests"):
+                conn.execute(f"DELETE FROM {name} WHERE trip_id IN (SELECT trip_id FROM stale_trips)")
+            conn.execute("DROP TABLE stale_trips")
+
+            fresh = inserted | changed
+            rows = sum(
+                load_table(conn, table, gtfs_dir / table.file, batch_size, trip_ids=fresh)
+                for table in TABLES
+                if table.name in TRIP_TABLES
+            )
+            conn.executemany("INSERT INTO trip_digests VALUES (?, ?)", ((t, new[t]) for t in fresh))
+            if verbose:
+                _report("trips + stop_times", rows, time.perf_counter() - started)
+                print(f"trips: {diff['inserted']} inserted, {diff['changed']} changed, "
+                      f"{diff['deleted']} deleted")
+
+        if changed_files & {"stops.txt", *(f"{name}.txt" for name in TRIP_TABLES)}:
+            build_variant_stops(conn)
+        # Databases imported before a derived table existed get it on their next update
+        existing = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+        if changed_files & {"calendar.txt", "calendar_dates.txt"} or "service_dates" not in existing:
+            build_service_dates(conn)
+        if "stops.txt" in changed_files or "footpaths" not in existing:
+            build_footpaths(conn, footpath_radius_km)
+        _record_feed(conn, file_hashes, "update", diff["inserted"], diff["changed"], diff["deleted"])
+        # Written from the uncommitted rows: workers that notice the commit map
+        # the new snapshot instead of building the timetable from SQLite.
+        save_snapshot(db_path, feed_version_key(conn), verbose, conn=conn)
+        conn.execute("COMMIT")
+        conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return diff
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a GTFS feed into SQLite.")
+    parser.add_argument("--gtfs-dir", default=DEFAULT_GTFS_DIR, type=Path)
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, type=Path)
+    parser.add_argument("--batch-size", default=BATCH_SIZE, type=int)
+    parser.add_argument("--update", action="store_true",
+                        help="apply only the differences to an existing database")
+    parser.add_argument("--footpath-radius", default=FOOTPATH_RADIUS_KM, type=float,
+                        help="link stops within this many km by footpaths")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.update:
+        update_feed(args.gtfs_dir, args.db, args.batch_size,
+                    footpath_radius_km=args.footpath_radius)
+        print(f"{'total':<20} {time.perf_counter() - started:25.2f} s")
+    else:
+        counts = import_feed(args.gtfs_dir, args.db, args.batch_size,
+                             footpath_radius_km=args.footpath_radius)
+        _report("total", sum(counts.values()), time.perf_counter() - started)
+    print(f"✅ Feed applied to '{args.db}'.")
+
+
+if __name__ == "__main__":
+    main()
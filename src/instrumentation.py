@@ -0,0 +1,448 @@
+"""Per-request timing, Prometheus metrics and an opt-in profiler for the API.
+
+Every request gets a trace that ``span()`` blocks add their time to: the
+stop lookup, the SQL queries, the materialization of rows into departures
+and the JSON serialization. When the request finishes the spans are sent in
+a ``Server-Timing`` header and observed into latency histograms, which
+``render_metrics()`` writes out in the Prometheus text format for the
+``/metrics`` endpoint. Outside a request a span costs one context variable
+lookup.
+
+Two more costly tools are off unless enabled in the environment:
+
+``SQL_TRACE=1``
+    Times every SQL statement with the ``sqlite3`` trace and progress
+    callbacks of each pooled connection, into a histogram per statement
+    (with literal values replaced by ``?``), and counts its VM steps.
+
+``PROFILE_SLOW_MS=<ms>``
+    Profiles the requests and writes the profiles of those that took at
+    least that long to ``PROFILE_DIR`` (default ``profiles`` in the system
+    temp directory). ``PROFILE_MODE=sample`` (the default) samples the
+    request's stack every ``PROFILE_INTERVAL_MS`` from a background thread
+    and writes folded stacks for ``flamegraph.pl`` or speedscope;
+    ``PROFILE_MODE=cprofile`` runs ``cProfile`` and writes ``.pstats`` files;
+    it profiles one request at a time and skips the requests overlapping it.
+"""
+
+import contextvars
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0)
+# The progress handler runs every this many SQLite VM instructions; a statement
+# ends at the last call, so shorter statements are timed as 0
+SQL_PROGRESS_STEPS = 100
+# Longest statement label; the whole statement text is rarely needed
+SQL_LABEL_LENGTH = 160
+PROFILE_MODES = ('sample', 'cprofile')
+DEFAULT_PROFILE_INTERVAL_MS = 5
+
+
+class Histogram:
+    """Cumulative latency histogram with one series per label values tuple."""
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, values, seconds):
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, seconds)] += 1
+            series[-1] += seconds
+
+    def snapshot(self):
+        """Return ``{label values: (cumulative bucket counts, count, sum)}``."""
+        with self._lock:
+            series = {values: list(counts) for values, counts in self._series.items()}
+        result = {}
+        for values, counts in series.items():
+            cumulative, total = [], 0
+            for count in counts[:-1]:
+                total += count
+                cumulative.append(total)
+            result[values] = (cumulative, total, counts[-1])
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+        for values, (cumulative, count, total) in sorted(self.snapshot().items()):
+            labels = ','.join(f'{name}="{_escape(value)}"'
+                              for name, value in zip(self.labels, values))
+            sep = ',' if labels else ''
+            for bound, bucket_count in zip(bounds, cumulative):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total!r}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to answer a request.', ('endpoint', 'status')
+)
+SPAN_SECONDS = Histogram(
+    'request_span_duration_seconds', 'Time spent in each part of a request.',
+    ('endpoint', 'span')
+)
+SQL_SECONDS = Histogram(
+    'sqlite_statement_duration_seconds', 'Time to run an SQL statement.', ('statement',)
+)
+HISTOGRAMS = (REQUEST_SECONDS, SPAN_SECONDS, SQL_SECONDS)
+# Counters rendered along with the histograms
+_counters = Counter()  # (metric name, label values) -> count
+_counters_lock = threading.Lock()
+COUNTERS = {
+    'http_request_errors_total': ('Requests that raised an unhandled exception.', ('endpoint',)),
+    'sqlite_statement_vm_steps_total': ('SQLite VM steps of each SQL statement.', ('statement',)),
+}
+
+
+def increment(name, values, amount=1):
+    with _counters_lock:
+        _counters[name, values] += amount
+
+
+def render_metrics():
+    """Return all metrics in the Prometheus text exposition format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+    with _counters_lock:
+        counters = dict(_counters)
+    for name, (help, label_names) in COUNTERS.items():
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+        for (metric, values), count in sorted(counters.items()):
+            if metric == name:
+                labels = ','.join(f'{label}="{_escape(value)}"'
+                                  for label, value in zip(label_names, values))
+                lines.append(f'{name}{{{labels}}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+    with _counters_lock:
+        _counters.clear()
+
+
+class RequestTrace:
+    """Time spent in each span of one request."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.thread_id = threading.get_ident()
+        self.profile = None
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def server_timing(self):
+        """The spans as a ``Server-Timing`` header value, in milliseconds."""
+        _finish_statement()
+        total = time.perf_counter() - self.started
+        return ', '.join(
+            f'{name};dur={seconds * 1000:.3f}'
+            for name, seconds in (*self.spans.items(), ('total', total))
+        )
+
+
+_trace = contextvars.ContextVar('request_trace', default=None)
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def span(name):
+    """Add the time of the ``with`` block to span ``name`` of the current request."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+def timed_iter(name, iterable):
+    """Yield from ``iterable``, adding the time spent producing items to span ``name``.
+
+    The time the consumer spends between items is not counted, so a lazily
+    fetched cursor is timed only while it is reading rows.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                total += time.perf_counter() - started
+            yield item
+    finally:
+        trace.add(name, total)
+
+
+def start_trace(endpoint):
+    """Start the trace of a request on the calling thread and return it."""
+    trace = RequestTrace(endpoint)
+    _trace.set(trace)
+    if _profiler is not None:
+        _profiler.start(trace)
+    return trace
+
+
+def finish_trace(trace, status, error=False):
+    """Stop ``trace`` and observe its duration and spans into the histograms."""
+    _finish_statement()
+    duration = time.perf_counter() - trace.started
+    if _trace.get() is trace:
+        _trace.set(None)
+    if _profiler is not None:
+        _profiler.finish(trace, duration)
+    endpoint = trace.endpoint
+    REQUEST_SECONDS.observe((endpoint, str(status)), duration)
+    for name, seconds in trace.spans.items():
+        SPAN_SECONDS.observe((endpoint, name), seconds)
+    if error:
+        increment('http_request_errors_total', (endpoint,))
+    return duration
+
+
+def traced_stream(trace, iterable, status=200):
+    """Yield from the body ``iterable`` of a streamed response as part of ``trace``.
+
+    The trace is finished when the body is exhausted or closed rather than
+    when the view returns, so it covers the time spent producing the stream.
+    """
+    _trace.set(trace)
+    error = False
+    try:
+        yield from iterable
+    except Exception:
+        error = True
+        raise
+    finally:
+        finish_trace(trace, status, error=error)
+
+
+# SQL statement timing ---------------------------------------------------------
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b|\bNULL\b")
+_VALUE_LISTS = re.compile(r'\?(?:\s*,\s*\?)+')
+_VALUE_TUPLES = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_label(sql):
+    """Normalize ``sql`` for grouping: literals become ``?``, lists one ``?``."""
+    label = _LITERALS.sub('?', sql)
+    label = _VALUE_LISTS.sub('?', label)
+    label = _VALUE_TUPLES.sub('(?)', label)
+    label = _WHITESPACE.sub(' ', label).strip()
+    if len(label) > SQL_LABEL_LENGTH:
+        label = label[:SQL_LABEL_LENGTH - 3] + '...'
+    return label
+
+
+_statement = threading.local()  # the statement running on each thread
+
+
+def _trace_statement(sql):
+    # Called by SQLite as each statement starts; the previous one on this
+    # thread ended at its last progress call.
+    _finish_statement()
+    now = time.perf_counter()
+    _statement.label = statement_label(sql)
+    _statement.started = _statement.last = now
+    _statement.steps = 0
+
+
+def _progress():
+    _statement.last = time.perf_counter()
+    _statement.steps += SQL_PROGRESS_STEPS
+    return 0
+
+
+def _finish_statement():
+    label = getattr(_statement, 'label', None)
+    if label is None:
+        return
+    _statement.label = None
+    seconds = _statement.last - _statement.started
+    SQL_SECONDS.observe((label,), seconds)
+    if _statement.steps:
+        increment('sqlite_statement_vm_steps_total', (label,), _statement.steps)
+    trace = _trace.get()
+    if trace is not None:
+        trace.add('sql', seconds)
+
+
+def sql_trace_enabled():
+    return os.environ.get('SQL_TRACE', '') not in ('', '0')
+
+
+def trace_connection(conn):
+    """Time the statements of ``conn`` into the SQL histograms."""
+    conn.set_trace_callback(_trace_statement)
+    conn.set_progress_handler(_progress, SQL_PROGRESS_STEPS)
+
+
+# Profiling ----------------------------------------------------------------------
+
+class SlowRequestProfiler:
+    """Profile requests, keeping the profiles of those slower than ``slow_seconds``.
+
+    In ``sample`` mode a daemon thread records the stack of every running
+    request each ``interval`` seconds; in ``cprofile`` mode a request runs
+    under its own ``cProfile.Profile``. Only one profiler can be enabled per
+    process from Python 3.12, so requests starting while another one is
+    profiled are not.
+    """
+
+    def __init__(self, slow_seconds, directory, mode='sample',
+                 interval=DEFAULT_PROFILE_INTERVAL_MS / 1000):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f'Unknown profile mode {mode!r}, expected one of {PROFILE_MODES}')
+        self.slow_seconds = slow_seconds
+        self.directory = Path(directory)
+        self.mode = mode
+        self.interval = interval
+        self.written = 0
+        self._running = {}  # thread id -> trace
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._profiling = threading.Lock()  # held while a cProfile is enabled
+
+    @classmethod
+    def from_environment(cls):
+        """Configure from ``PROFILE_SLOW_MS``, ``PROFILE_DIR``, ``PROFILE_MODE``
+        and ``PROFILE_INTERVAL_MS``; return None when profiling is off."""
+        slow_ms = os.environ.get('PROFILE_SLOW_MS')
+        if not slow_ms:
+            return None
+        directory = os.environ.get('PROFILE_DIR') or Path(tempfile.gettempdir()) / 'profiles'
+        interval_ms = float(os.environ.get('PROFILE_INTERVAL_MS', DEFAULT_PROFILE_INTERVAL_MS))
+        return cls(float(slow_ms) / 1000, directory,
+                   os.environ.get('PROFILE_MODE', 'sample'), interval_ms / 1000)
+
+    def start(self, trace):
+        if self.mode == 'cprofile':
+            import cProfile  # only needed in this mode
+
+            if not self._profiling.acquire(blocking=False):
+                return
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # another profiler is enabled
+                self._profiling.release()
+                return
+            trace.profile = profile
+            return
+        trace.profile = Counter()  # folded stack -> samples
+        with self._lock:
+            self._running[trace.thread_id] = trace
+            if self._sampler is None:
+                self._sampler = threading.Thread(
+                    target=self._sample, name='request-profiler', daemon=True
+                )
+                self._sampler.start()
+
+    def finish(self, trace, duration):
+        if self.mode == 'cprofile':
+            if trace.profile is None:
+                return  # not profiled
+            trace.profile.disable()
+            self._profiling.release()
+        else:
+            with self._lock:
+                self._running.pop(trace.thread_id, None)
+        if duration >= self.slow_seconds:
+            self._write(trace, duration)
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                running = list(self._running.items())
+            if not running:
+                continue
+            frames = sys._current_frames()
+            for thread_id, trace in running:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    trace.profile[_folded_stack(frame)] += 1
+
+    def _write(self, trace, duration):
+        if self.mode == 'sample' and not trace.profile:
+            return  # faster than the sampling interval
+        with self._lock:
+            self.written += 1
+            number = self.written
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stem = (f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{number}-'
+                f'{trace.endpoint}-{duration * 1000:.0f}ms')
+        if self.mode == 'cprofile':
+            trace.profile.dump_stats(self.directory / f'{stem}.pstats')
+        else:
+            (self.directory / f'{stem}.folded').write_text(''.join(
+                f'{stack} {count}\n' for stack, count in trace.profile.most_common()
+            ))
+
+
+def _folded_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+_profiler = SlowRequestProfiler.from_environment()
+
+
+def set_profiler(profiler):
+    """Replace the slow request profiler; None turns profiling off."""
+    global _profiler
+    _profiler = profiler
@@ -0,0 +1,208 @@
+"""Earliest-arrival journey planner using the Connection Scan Algorithm.
+
+The planner is built once per feed on top of the in-memory ``Timetable``:
+
+* every pair of consecutive stop times of a trip is a connection. The
+  connections are kept in arrays sorted by departure time (departure,
+  arrival, from stop, to stop and trip), so a query scans a contiguous
+  range of them;
+* footpaths link every stop to the stops within walking distance, with
+  their walking time, for transfers between nearby stops. They are read
+  from the ``footpaths`` table built by the import (see ``footpaths.py``).
+
+A query starts from the stops within walking distance of the origin and
+scans the connections from the start time in departure order. It keeps the
+earliest arrival at every stop and how it was reached. A connection can be
+taken when its trip has been boarded already or its stop has been reached
+before it departs. The scan stops at the first connection departing after
+the best arrival found at the destination, so its cost grows with the
+duration of the journey, not with the size of the feed.
+"""
+
+import sys
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from itertools import repeat
+from operator import sub
+
+from timetable import ROW_BITS, ROW_MASK, service_days
+
+# Stops within this distance of the start and end points are walked to and from
+ACCESS_RADIUS_KM = 0.8
+ACCESS_STOPS_LIMIT = 20
+UNREACHED = sys.maxsize
+
+
+class JourneyPlanner:
+
+    def __init__(self, timetable, footpaths):
+        """Build the connection arrays of ``timetable``.
+
+        ``footpaths`` maps every stop position of the timetable to a list of
+        ``(stop position, walking seconds)`` pairs.
+        """
+        self.timetable = timetable
+        self.footpaths = footpaths
+        st_trip, st_departure = timetable.st_trip, timetable.st_departure
+        # A connection leaves from row r and arrives at row r + 1 of the same
+        # trip; sort them as packed (departure time, row) integers.
+        keys = sorted(
+            (st_departure[row] << ROW_BITS) | row
+            for trip in timetable.trips
+            for row in range(trip.start, trip.end - 1)
+        )
+        rows = [key & ROW_MASK for key in keys]
+        self.c_dep = array('i', (key >> ROW_BITS for key in keys))
+        self.c_arr = array('i', (timetable.st_arrival[row + 1] for row in rows))
+        self.c_from = array('I', (timetable.st_stop[row] for row in rows))
+        self.c_to = array('I', (timetable.st_stop[row + 1] for row in rows))
+        self.c_trip = array('I', (st_trip[row] for row in rows))
+        self._active_trips = {}
+
+    @classmethod
+    def from_timetable(cls, timetable, footpaths):
+        """Build the planner with the footpaths of a ``footpaths.Footpaths``."""
+        position = timetable.stop_position
+        return cls(timetable, [
+            [(position(other), walk)
+             for other, _, walk in footpaths.neighbours(stop['stop_id'])
+             if position(other) is not None]
+            for stop in timetable.stops
+        ])
+
+    def active_trips(self, service_date):
+        """Return a flag per trip telling whether it runs on ``service_date``."""
+        active = self._active_trips.get(service_date)
+        if active is None:
+            trips = self.timetable.trips
+            if service_date is None:
+                active = bytes([1]) * len(trips)
+            else:
+                services = self.timetable.active_services(service_date)
+                active = bytes(trip.service_id in services for trip in trips)
+            # One entry per date the API is asked about; a handful at a time
+            if len(self._active_trips) >= 8:
+                self._active_trips.clear()
+            self._active_trips[service_date] = active
+        return active
+
+    def _connections(self, start_sec, service_date):
+        # Iterators of (departure, connection, day offset) from start_sec on
+        # in time order, with the trip flags of their day. After midnight the
+        # previous day's trips still running come first, shifted onto the
+        # requested day like in Timetable.iter_departures.
+        c_dep = self.c_dep
+        days = [(0, None)]
+        if service_date is not None:
+            days = service_days(start_sec, service_date, self.timetable.last_departure_sec)
+        streams = []
+        for offset, date in reversed(days):
+            first = bisect_left(c_dep, start_sec + offset)
+            departures = memoryview(c_dep)[first:]
+            if offset:
+                departures = map(sub, departures, repeat(offset))
+            streams.append((zip(departures, range(first, len(c_dep)), repeat(offset)),
+                            offset, self.active_trips(date)))
+        return streams
+
+    def earliest_arrival(self, access, egress, start_sec, service_date=None, direct_walk=None):
+        """Return the legs of the earliest-arriving journey, or None.
+
+        ``access`` and ``egress`` are ``(stop_id, walking seconds)`` pairs
+        for the stops around the start and end points, ``direct_walk`` the
+        walking seconds between the two points, if walking is an option.
+        The journey leaves the start point as late as it can; walks of no
+        length are left out.
+        Legs are ``('walk', from stop, to stop, departure, arrival)`` and
+        ``('ride', trip, from stop, to stop, departure, arrival)`` tuples with
+        stop and trip positions in the timetable (None for the start and end
+        points), and times in seconds from the start of ``service_date``.
+        """
+        timetable = self.timetable
+        arrival = [UNREACHED] * len(timetable.stops)
+        # How each stop was reached: ('access', walk), ('walk', from, walk)
+        # or ('ride', trip, boarding connection, alighting connection, offset)
+        reached = [None] * len(timetable.stops)
+        for stop_id, walk in access:
+            pos = timetable.stop_position(stop_id)
+            if pos is not None and start_sec + walk < arrival[pos]:
+                arrival[pos] = start_sec + walk
+                reached[pos] = ('access', walk)
+        egress_walk = {}
+        for stop_id, walk in egress:
+            pos = timetable.stop_position(stop_id)
+            if pos is not None:
+                egress_walk[pos] = walk
+        best, best_stop = UNREACHED, None
+        if direct_walk is not None:
+            best = start_sec + direct_walk
+        for pos, walk in egress_walk.items():
+            if arrival[pos] + walk < best:
+                best, best_stop = arrival[pos] + walk, pos
+
+        c_arr, c_from, c_to, c_trip = self.c_arr, self.c_from, self.c_to, self.c_trip
+        footpaths = self.footpaths
+        trip_count = len(timetable.trips)
+        streams = self._connections(start_sec, service_date)
+        active_on = {offset: active for _, offset, active in streams}
+        if len(streams) == 1:
+            connections = streams[0][0]
+        else:
+            connections = merge(*(stream for stream, _, _ in streams))
+        boarded = {}  # trip (+ trip_count for the previous day) -> boarding connection
+        for dep, i, offset in connections:
+            if dep >= best:
+                break
+            trip = c_trip[i]
+            key = trip + trip_count if offset else trip
+            board = boarded.get(key)
+            if board is None:
+                if arrival[c_from[i]] > dep or not active_on[offset][trip]:
+                    continue
+                board = boarded[key] = i
+            arr = c_arr[i] - offset
+            to = c_to[i]
+            if arr >= arrival[to]:
+                continue
+            arrival[to] = arr
+            reached[to] = ('ride', trip, board, i, offset)
+            if to in egress_walk and arr + egress_walk[to] < best:
+                best, best_stop = arr + egress_walk[to], to
+            for neighbour, walk in footpaths[to]:
+                if arr + walk < arrival[neighbour]:
+                    arrival[neighbour] = arr + walk
+                    reached[neighbour] = ('walk', to, walk)
+                    if neighbour in egress_walk and arr + walk + egress_walk[neighbour] < best:
+                        best, best_stop = arr + walk + egress_walk[neighbour], neighbour
+
+        if best == UNREACHED:
+            return None
+        if best_stop is None:
+            return [('walk', None, None, start_sec, best)]
+        return self._legs(reached, arrival, best_stop, best)
+
+    def _legs(self, reached, arrival, stop, end_sec):
+        legs = [('walk', stop, None, arrival[stop], end_sec)]
+        # Every step goes back in time, so the chain ends at an access stop
+        for _ in range(len(reached)):
+            how = reached[stop]
+            if how[0] == 'access':
+                legs.append(('walk', None, stop, arrival[stop] - how[1], arrival[stop]))
+                break
+            if how[0] == 'walk':
+                _, origin, walk = how
+                legs.append(('walk', origin, stop, arrival[stop] - walk, arrival[stop]))
+            else:
+                _, trip, board, alight, offset = how
+                origin = self.c_from[board]
+                legs.append(('ride', trip, origin, stop,
+                             self.c_dep[board] - offset, self.c_arr[alight] - offset))
+            stop = origin
+        legs.reverse()
+        if len(legs) > 1 and legs[1][0] == 'ride':
+            # Leave the start point just in time for the first ride
+            _, origin, destination, departure, arrival = legs[0]
+            wait = legs[1][4] - arrival
+            legs[0] = ('walk', origin, destination, departure + wait, arrival + wait)
+        return [leg for leg in legs if leg[0] == 'ride' or leg[-1] > leg[-2]]
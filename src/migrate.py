@@ -0,0 +1,253 @@
+"""Convert an existing ``trips.sqlite`` to the current schema.
+
+Databases imported before schema version 2 refer to trips by their text
+``trip_id`` in ``stop_times`` and have no primary keys; the original ones
+also keep times as ``HH:MM:SS`` text and have only ``stops``, ``trips`` and
+``stop_times``. The migration copies every table into a new database with
+the current schema, numbering trips in their original order, converting
+text times to seconds and writing ``stop_times`` in primary key order. Rows
+loaded more than once, e.g. by running the populate scripts twice, are
+copied once. Tables
+the database lacks are loaded from the feed files in ``--gtfs-dir`` when
+present, as the import does. It then rebuilds the derived tables, checks
+that every row and time was copied, writes the timetable snapshot and only
+then swaps the new file in. It reports the size of the database before and
+after, per table and index, and the query plans of the API's lookups on the
+converted database::
+
+    python src/migrate.py [--db trips.sqlite] [--gtfs-dir DIR]
+"""
+
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+import models
+from gtfs_import import (DEFAULT_DB_PATH, DEFAULT_GTFS_DIR, FAST_LOAD_PRAGMAS, _record_feed,
+                         build_footpaths, build_service_dates, build_variant_stops,
+                         feed_version_key, file_sha256, load_table, replace_database,
+                         save_snapshot)
+from schema import (DERIVED_TABLES, FEED_METADATA, INDEXES, SCHEMA_VERSION, TABLES,
+                    create_table_sql)
+from utils import parse_gtfs_time
+
+# Bookkeeping tables copied as they are; the derived tables are rebuilt
+COPIED_METADATA = ("feed_files", "trip_digests", "feed_versions")
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def object_sizes(conn):
+    """Return ``{table or index name: bytes}`` from the ``dbstat`` table."""
+    return dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+
+
+def _old_columns(conn, name):
+    """Return ``{column name: name in the old table}``; tables imported with
+    other tools may have a byte order mark before the first column's name."""
+    return {row[1].lstrip("\ufeff"): row[1]
+            for row in conn.execute(f"PRAGMA old.table_info({name})")}
+
+
+def _gtfs_seconds(value):
+    return parse_gtfs_time(value) if value else None
+
+
+def _copy_columns(table, old_columns):
+    # (column, old column, expression) for the columns copied; columns the old
+    # table lacks stay NULL, TRIP columns become trip keys and text times
+    # are converted to seconds
+    columns = []
+    for column in table.columns:
+        if column.type == "TRIP":
+            columns.append((column.name, None, "t.trip_key"))
+        elif column.name in old_columns:
+            old = old_columns[column.name]
+            columns.append((column.name, old, f'o."{old}"'))
+        elif column.type == "TIME" and column.source in old_columns:
+            old = old_columns[column.source]
+            columns.append((column.name, old, f'gtfs_seconds(o."{old}")'))
+    return columns
+
+
+def _old_key(table, old_columns):
+    # The old columns identifying a row: those of the table's primary key,
+    # with trips identified by their trip_id, or every copied column for a
+    # table without one. Rows loaded twice are copied once.
+    if not table.primary_key:
+        return [value for _, _, value in _copy_columns(table, old_columns)]
+    types = {column.name: column.type for column in table.columns}
+    return [f'o."{old_columns["trip_id" if name == "trip_key" or types[name] == "TRIP" else name]}"'
+            for name in table.primary_key.split(", ")]
+
+
+def _copy_sql(table, old_columns):
+    columns = _copy_columns(table, old_columns)
+    source, order = f"old.{table.name} o", "MIN(o.rowid)"
+    if any(column.type == "TRIP" for column in table.columns):
+        # stop_times, in the order of its (trip_key, stop_sequence) primary key
+        source += f' JOIN main.trips t ON t.trip_id = o."{old_columns["trip_id"]}"'
+        order = "t.trip_key, o.stop_sequence"
+    return (f"INSERT INTO main.{table.name} ({', '.join(name for name, _, _ in columns)}) "
+            f"SELECT {', '.join(value for _, _, value in columns)} FROM {source} "
+            f"GROUP BY {', '.join(_old_key(table, old_columns))} ORDER BY {order}")
+
+
+def _check_copy(conn, table, old_columns):
+    """Raise RuntimeError unless every distinct row of the old table, and
+    every value of the columns copied from it, is in the new one."""
+    labels, values, old_counts, new_counts = ["rows"], [], ["COUNT(*)"], ["COUNT(*)"]
+    for name, old, value in _copy_columns(table, old_columns):
+        if old is None:
+            continue  # rows of unknown trips are missing from the row count
+        labels.append(name)
+        values.append(f'o."{old}" AS {name}')
+        # empty text times are NULL seconds
+        old_counts.append(f"COUNT(NULLIF({name}, ''))" if value.startswith("gtfs_seconds")
+                          else f"COUNT({name})")
+        new_counts.append(f"COUNT({name})")
+    before = conn.execute(
+        f"SELECT {', '.join(old_counts)} FROM (SELECT {', '.join(values)} FROM old.{table.name} o "
+        f"GROUP BY {', '.join(_old_key(table, old_columns))})"
+    ).fetchone()
+    after = conn.execute(f"SELECT {', '.join(new_counts)} FROM main.{table.name}").fetchone()
+    for label, old, new in zip(labels, before, after):
+        if old != new:
+            raise RuntimeError(f"{table.name}.{label}: {old:,} in the old database, {new:,} copied")
+
+
+def migrate(db_path=DEFAULT_DB_PATH, gtfs_dir=DEFAULT_GTFS_DIR, verbose=True):
+    """Convert the database at ``db_path``; return ``(bytes before, bytes after)``.
+
+    Returns None when it already has the current schema. Tables missing from
+    the database are loaded from the files in ``gtfs_dir`` that exist.
+    """
+    db_path, gtfs_dir = Path(db_path), Path(gtfs_dir)
+    conn = sqlite3.connect(db_path)
+    try:
+        if schema_version(conn) >= SCHEMA_VERSION:
+            if verbose:
+                print(f"{db_path} already has schema version {SCHEMA_VERSION}.")
+            return None
+        sizes_before = object_sizes(conn)
+    finally:
+        conn.close()
+    size_before = db_path.stat().st_size
+
+    tmp_path = db_path.with_name(db_path.name + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    conn.create_function("gtfs_seconds", 1, _gtfs_seconds, deterministic=True)
+    try:
+        for pragma in FAST_LOAD_PRAGMAS:
+            conn.execute(pragma)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.execute("ATTACH DATABASE ? AS old", (str(db_path),))
+        old_tables = {name for (name,) in conn.execute(
+            "SELECT name FROM old.sqlite_master WHERE type = 'table'"
+        )}
+        conn.execute("BEGIN")
+        for statement in (*FEED_METADATA, *DERIVED_TABLES):
+            conn.execute(statement)
+        loaded = {}
+        for table in TABLES:
+            conn.execute(create_table_sql(table))
+            started = time.perf_counter()
+            if table.name in old_tables:
+                old_columns = _old_columns(conn, table.name)
+                rows = conn.execute(_copy_sql(table, old_columns)).rowcount
+                _check_copy(conn, table, old_columns)
+            elif (gtfs_dir / table.file).exists():
+                rows = load_table(conn, table, gtfs_dir / table.file)
+                loaded[table.file] = file_sha256(gtfs_dir / table.file)
+            else:
+                if verbose:
+                    print(f"{table.name:<20} missing, table left empty")
+                continue
+            if verbose:
+                print(f"{table.name:<20} {rows:>10,} rows {time.perf_counter() - started:8.2f} s")
+        for name in COPIED_METADATA:
+            if name in old_tables:
+                conn.execute(f"INSERT INTO main.{name} SELECT * FROM old.{name}")
+        if "trip_digests" not in old_tables:
+            # No digest matches a real trip, so the next update rewrites them all
+            conn.execute("INSERT INTO trip_digests SELECT trip_id, 0 FROM trips")
+        if "feed_versions" not in old_tables:
+            _record_feed(conn, loaded, "migrate", 0, 0, 0)
+        else:
+            conn.executemany("INSERT OR REPLACE INTO feed_files VALUES (?, ?)", loaded.items())
+        started = time.perf_counter()
+        for statement in INDEXES:
+            conn.execute(statement)
+        build_variant_stops(conn)
+        build_service_dates(conn)
+        build_footpaths(conn)
+        conn.execute("ANALYZE")
+        conn.execute("COMMIT")
+        conn.execute("DETACH DATABASE old")
+        if verbose:
+            print(f"{'indexes':<20} {len(INDEXES):>10} built {time.perf_counter() - started:8.2f} s")
+        sizes_after = object_sizes(conn)
+        # In place before the new database is, like an update's
+        save_snapshot(db_path, feed_version_key(conn), verbose, conn=conn)
+        conn.execute("PRAGMA locking_mode = NORMAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+    except BaseException:
+        conn.close()
+        tmp_path.unlink()
+        raise
+    conn.close()
+    replace_database(tmp_path, db_path)
+    size_after = db_path.stat().st_size
+
+    if verbose:
+        _report_sizes(sizes_before, sizes_after)
+        print(f"{'database':<32} {size_before / 2**20:9.1f} MiB {size_after / 2**20:9.1f} MiB")
+        conn = sqlite3.connect(db_path)
+        print_query_plans(conn)
+        conn.close()
+    return size_before, size_after
+
+
+def _report_sizes(before, after):
+    print(f"{'table or index':<32} {'before':>13} {'after':>13}")
+    for name in sorted(before.keys() | after.keys(),
+                       key=lambda name: -max(before.get(name, 0), after.get(name, 0))):
+        if name.startswith("sqlite_"):
+            continue
+        old, new = (f"{sizes[name] / 2**20:9.1f} MiB" if name in sizes else f"{'—':>13}"
+                    for sizes in (before, after))
+        print(f"{name:<32} {old} {new}")
+
+
+def print_query_plans(conn):
+    """Print ``EXPLAIN QUERY PLAN`` of the API's lookups."""
+    departures = models._departures_query(2, heading=True, service_days=2)
+    lookups = [
+        ("trip details", models.TRIP_QUERY),
+        ("trip stop times", models.TRIP_STOP_TIMES_QUERY),
+        ("departures", departures),
+        ("departures batch", models.BATCH_DEPARTURES_QUERY),
+    ]
+    for label, sql in lookups:
+        print(f"{label}:")
+        params = [None] * sql.count("?")
+        for *_, detail in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+            print(f"    {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, type=Path)
+    parser.add_argument("--gtfs-dir", default=DEFAULT_GTFS_DIR, type=Path,
+                        help="load the tables the database lacks from this feed")
+    args = parser.parse_args()
+    migrate(args.db, args.gtfs_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,504 @@
-from database import get_db_connection
-from utils import haversine
-from datetime import datetime
+import json
+import os
+
+from database import get_db_connection, get_pool
+from footpaths import Footpaths
+from gtfs_import import feed_version_key
+from instrumentation import span, timed_iter
+from journeys import ACCESS_RADIUS_KM, ACCESS_STOPS_LIMIT, JourneyPlanner
+from snapshot import MappedTimetable, snapshot_path
+from spatial import StopIndex, StopScan, planar_distance_sq, planar_frame
+from timetable import Timetable, service_days
+from utils import (format_service_time, haversine, service_date, time_of_day_seconds,
+                   walking_seconds)
+
+# Number of stops closest to the start point that are searched for departures
+NEARBY_STOPS_LIMIT = 20
+# Most departures read for one stop and service day (see get_stop_day)
+STOP_DAY_LIMIT = 10000
+
+# 'sqlite' queries the database on every request, 'memory' answers from the
+# in-memory timetable engine loaded once per process
+BACKENDS = ('sqlite', 'memory')
+_backend_name = os.environ.get('TIMETABLE_BACKEND', 'sqlite')
+USE_SNAPSHOT = os.environ.get('TIMETABLE_SNAPSHOT', '1') != '0'
+
+
+def get_stop_index():
+    """Return the process-wide stop index, building it on first use.
+
+    While a background warm-up has yet to build it, the stops are scanned
+    in SQL instead (``spatial.StopScan``).
+    """
+    return get_pool().shared('stop_index', StopIndex.from_connection, fallback=_stop_scan)
+
+
+def get_footpaths():
+    """Return the process-wide footpaths between stops, loaded on first use."""
+    return get_pool().shared('footpaths', Footpaths.from_connection)
+
+
+def _read_last_departure_sec(conn):
+    return conn.execute('SELECT MAX(departure_sec) FROM stop_times').fetchone()[0] or 0
+
+
+def get_last_departure_sec():
+    """Return the latest ``departure_sec`` of the feed, read once per pool."""
+    return get_pool().shared('last_departure_sec', _read_last_departure_sec)
+
+
+def find_nearby_stops(lat, lon, k=NEARBY_STOPS_LIMIT, radius_km=None):
+    """Return up to ``k`` ``(distance_km, stop)`` pairs closest to a point."""
+    return get_stop_index().nearest(lat, lon, k=k, radius_km=radius_km)
+
+
+def _departures_query(stop_count, heading=False, service_days=0):
+    # Candidate stops are ranked by distance. For each of them the correlated
+    # subquery range-scans idx_stop_times_stop_departure and materializes the
+    # primary keys of at most `limit` rows, so the whole lookup is a single
+    # statement. The index covers the subquery; trips are looked up by key.
+    #
+    # With `heading` only departures whose remaining path gets closer to the
+    # destination are kept: the distance from the destination to the
+    # variant_stops bounding box of the stops still ahead must be smaller
+    # than the distance to the departure stop (spatial.box_distance_sq).
+    #
+    # With `service_days` every stop is scanned once per (day_offset, date)
+    # row of `days`, keeping only trips whose service runs on that date (one
+    # service_dates primary key lookup per scanned row). A previous service
+    # day has a day_offset of 86400: its scan starts at start_sec + 86400,
+    # past midnight, and its times are shifted back onto the requested day.
+    days = day_join = start = service = ''
+    times = 'st.arrival_sec, st.departure_sec'
+    order = 'c.rank, st.departure_sec'
+    if service_days:
+        days = f", days(day_offset, date) AS (VALUES {', '.join(['(?, ?)'] * service_days)})"
+        day_join = 'CROSS JOIN days day'
+        start = ' + day.day_offset'
+        service = '''AND EXISTS (SELECT 1 FROM service_dates sd
+                                    WHERE sd.date = day.date AND sd.service_id = at.service_id)'''
+        times = ('''st.arrival_sec - day.day_offset AS arrival_sec,
+                          st.departure_sec - day.day_offset AS departure_sec''')
+        order = 'c.rank, st.departure_sec - day.day_offset, day.day_offset DESC'
+    if not heading:
+        candidates = ', '.join(['(?, ?)'] * stop_count)
+        trips = 'JOIN trips at ON at.trip_key = ahead.trip_key' if service_days else ''
+        return f'''WITH candidates(stop_id, rank) AS (VALUES {candidates}){days}
+                   SELECT c.rank, t.trip_id, {times},
+                          t.route_id, t.trip_headsign
+                   FROM candidates c
+                   {day_join}
+                   JOIN stop_times st ON (st.trip_key, st.stop_sequence) IN (
+                       SELECT ahead.trip_key, ahead.stop_sequence
+                       FROM stop_times ahead
+                       {trips}
+                       WHERE ahead.stop_id = c.stop_id AND ahead.departure_sec >= ?{start}
+                         {service}
+                       ORDER BY ahead.departure_sec
+                       LIMIT ?)
+                   JOIN trips t ON t.trip_key = st.trip_key
+                   ORDER BY {order}
+                   LIMIT ?'''
+    candidates = ', '.join(['(?, ?, ?)'] * stop_count)
+    dx = '((MAX(vs.min_lon, MIN(vs.max_lon, d.lon)) - d.lon) * d.lon_scale)'
+    dy = '(MAX(vs.min_lat, MIN(vs.max_lat, d.lat)) - d.lat)'
+    return f'''WITH candidates(stop_id, rank, distance_sq) AS (VALUES {candidates}),
+                    destination(lat, lon, lon_scale) AS (VALUES (?, ?, ?)){days}
+               SELECT c.rank, t.trip_id, {times},
+                      t.route_id, t.trip_headsign
+               FROM candidates c
+               {day_join}
+               JOIN stop_times st ON (st.trip_key, st.stop_sequence) IN (
+                   SELECT ahead.trip_key, ahead.stop_sequence
+                   FROM stop_times ahead
+                   -- CROSS JOIN keeps the index scan of stop_times outermost,
+                   -- so rows come out in departure order and LIMIT stops it early
+                   CROSS JOIN destination d
+                   JOIN trips at ON at.trip_key = ahead.trip_key
+                   JOIN variant_stops vs ON vs.variant_id = at.variant_id
+                                        AND vs.stop_sequence = ahead.stop_sequence
+                   WHERE ahead.stop_id = c.stop_id AND ahead.departure_sec >= ?{start}
+                     {service}
+                     AND {dx} * {dx} + {dy} * {dy} < c.distance_sq
+                   ORDER BY ahead.departure_sec
+                   LIMIT ?)
+               JOIN trips t ON t.trip_key = st.trip_key
+               ORDER BY {order}
+               LIMIT ?'''
+
+
+# Departures of a whole batch of requests. The batch's distinct (stop, start
+# time, date, destination) lookups come in as one JSON parameter, one [lookup,
+# stop_id, distance_sq, start_sec, lat, lon, lon_scale, date, day_offset] row
+# per service day to scan, so the statement does not hit SQLite's limit on
+# host parameters. Each row runs the per-stop scan of the heading query above,
+# cut at the largest limit of the batch; a null date keeps trips of every
+# service.
+_BATCH_DX = '((MAX(vs.min_lon, MIN(vs.max_lon, c.lon)) - c.lon) * c.lon_scale)'
+_BATCH_DY = '(MAX(vs.min_lat, MIN(vs.max_lat, c.lat)) - c.lat)'
+BATCH_DEPARTURES_QUERY = f'''
+    WITH lookups(lookup, stop_id, distance_sq, start_sec, lat, lon, lon_scale, date, day_offset)
+    AS MATERIALIZED (
+        SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'),
+               json_extract(value, '$[2]'), json_extract(value, '$[3]'),
+               json_extract(value, '$[4]'), json_extract(value, '$[5]'),
+               json_extract(value, '$[6]'), json_extract(value, '$[7]'),
+               json_extract(value, '$[8]')
+        FROM json_each(?))
+    SELECT c.lookup, t.trip_id, st.arrival_sec - c.day_offset AS arrival_sec,
+           st.departure_sec - c.day_offset AS departure_sec,
+           t.route_id, t.trip_headsign
+    FROM lookups c
+    -- json_each has no statistics; CROSS JOIN fixes the join order
+    CROSS JOIN stop_times st ON (st.trip_key, st.stop_sequence) IN (
+        SELECT ahead.trip_key, ahead.stop_sequence
+        FROM stop_times ahead
+        JOIN trips at ON at.trip_key = ahead.trip_key
+        JOIN variant_stops vs ON vs.variant_id = at.variant_id
+                             AND vs.stop_sequence = ahead.stop_sequence
+        WHERE ahead.stop_id = c.stop_id AND ahead.departure_sec >= c.start_sec
+          AND (c.date IS NULL OR EXISTS (SELECT 1 FROM service_dates sd
+                                         WHERE sd.date = c.date
+                                           AND sd.service_id = at.service_id))
+          AND {_BATCH_DX} * {_BATCH_DX} + {_BATCH_DY} * {_BATCH_DY} < c.distance_sq
+        ORDER BY ahead.departure_sec
+        LIMIT ?)
+    CROSS JOIN trips t ON t.trip_key = st.trip_key
+    ORDER BY c.lookup, st.departure_sec - c.day_offset, c.day_offset DESC'''
+
+
+# The stop times of a trip are one range of the stop_times primary key
+TRIP_QUERY = 'SELECT * FROM trips WHERE trip_id = ?'
+TRIP_STOP_TIMES_QUERY = '''
+    SELECT t.trip_id, st.arrival_sec, st.departure_sec, st.stop_id,
+           st.stop_sequence, s.stop_name, s.stop_lat, s.stop_lon
+    FROM trips t
+    JOIN stop_times st ON st.trip_key = t.trip_key
+    JOIN stops s ON st.stop_id = s.stop_id
+    WHERE t.trip_id = ?
+    ORDER BY st.stop_sequence ASC'''
+
+
+class SqliteBackend:
+    """Timetable lookups answered by querying the pooled database connection."""
+
+    def get_trip_details(self, trip_id):
+        conn = get_db_connection()
+        trip = conn.execute(TRIP_QUERY, (trip_id,)).fetchone()
+        stop_times = conn.execute(TRIP_STOP_TIMES_QUERY, (trip_id,)).fetchall()
+        return trip, stop_times
+
+    def departures(self, stop_ids, start_sec, limit, destination=None, service_date=None):
+        """Next departures from ``stop_ids``; see ``Timetable.departures``."""
+        return self.iter_departures(
+            stop_ids, start_sec, limit, destination, service_date
+        ).fetchall()
+
+    def iter_departures(self, stop_ids, start_sec, limit, destination=None, service_date=None):
+        """Return the cursor of ``departures``; rows are fetched as it is iterated."""
+        params = []
+        if destination is None:
+            for rank, stop_id in enumerate(stop_ids):
+                params += [stop_id, rank]
+        else:
+            frame = planar_frame(*destination)
+            index = get_stop_index()
+            for rank, stop_id in enumerate(stop_ids):
+                stop = index.get(stop_id)
+                params += [stop_id, rank,
+                           planar_distance_sq(frame, stop['stop_lat'], stop['stop_lon'])]
+            params += frame
+        days = []
+        if service_date is not None:
+            days = service_days(start_sec, service_date, get_last_departure_sec())
+            for offset, date in days:
+                params += [offset, date]
+        params += [start_sec, limit, limit]
+        query = _departures_query(len(stop_ids), heading=destination is not None,
+                                  service_days=len(days))
+        return get_db_connection().execute(query, params)
+
+    def departures_batch(self, queries):
+        """``departures`` for many ``(stop_ids, start_sec, limit, destination,
+        service_date)`` queries; returns a list of rows per query.
+
+        Queries sharing a stop, start time, date and destination share its
+        lookup, and all lookups run in one statement.
+        """
+        index = get_stop_index()
+        lookups = {}
+        for stop_ids, start_sec, _, destination, service_date in queries:
+            for stop_id in stop_ids:
+                lookups.setdefault((stop_id, start_sec, service_date, destination), len(lookups))
+        if not lookups:
+            return [[] for _ in queries]
+
+        params = []
+        last_departure_sec = get_last_departure_sec()
+        for (stop_id, start_sec, service_date, destination), number in lookups.items():
+            frame = planar_frame(*destination)
+            stop = index.get(stop_id)
+            distance_sq = planar_distance_sq(frame, stop['stop_lat'], stop['stop_lon'])
+            days = [(0, None)]
+            if service_date is not None:
+                days = service_days(start_sec, service_date, last_departure_sec)
+            for offset, date in days:
+                params.append([number, stop_id, distance_sq, start_sec + offset, *frame,
+                               date, offset])
+        found = [[] for _ in lookups]
+        max_limit = max(query[2] for query in queries)
+        for row in get_db_connection().execute(
+            BATCH_DEPARTURES_QUERY, (json.dumps(params), max_limit)
+        ):
+            found[row['lookup']].append(row)
+
+        # Reassemble every query from its stops in rank order, like the
+        # ORDER BY rank, departure_sec LIMIT of the single query.
+        results = []
+        for stop_ids, start_sec, limit, destination, service_date in queries:
+            rows = []
+            for rank, stop_id in enumerate(stop_ids):
+                for row in found[lookups[stop_id, start_sec, service_date, destination]]:
+                    if len(rows) >= limit:
+                        break
+                    rows.append({
+                        'rank': rank,
+                        'trip_id': row['trip_id'],
+                        'arrival_sec': row['arrival_sec'],
+                        'departure_sec': row['departure_sec'],
+                        'route_id': row['route_id'],
+                        'trip_headsign': row['trip_headsign'],
+                    })
+            results.append(rows)
+        return results
+
+
+_sqlite_backend = SqliteBackend()
+_stop_scan = StopScan(get_db_connection)
+
+
+def set_backend(name):
+    global _backend_name
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown timetable backend {name!r}, expected one of {BACKENDS}')
+    _backend_name = name
+
+
+def _load_timetable(conn):
+    # The snapshot written by the import, when it is of the database's feed
+    if USE_SNAPSHOT:
+        timetable = MappedTimetable.open(snapshot_path(get_pool().path), get_feed_version())
+        if timetable is not None:
+            return timetable
+    return Timetable.from_connection(conn)
+
+
+def get_timetable():
+    """Return the process-wide in-memory timetable, loading it on first use.
+
+    It maps the database's timetable snapshot (see ``snapshot.py``) unless
+    that is missing, of another feed version or ``TIMETABLE_SNAPSHOT=0``;
+    then it is built from the database.
+    """
+    return get_pool().shared('timetable', _load_timetable)
+
+
+def get_backend():
+    if _backend_name == 'memory':
+        # SQLite answers until a background warm-up has loaded the timetable
+        return get_pool().shared('timetable', _load_timetable, fallback=_sqlite_backend)
+    return _sqlite_backend
+
+
+def _build_journey_planner(conn):
+    return JourneyPlanner.from_timetable(get_timetable(), get_footpaths())
+
+
+def get_journey_planner():
+    """Return the process-wide journey planner, building it on first use.
+
+    It works on the in-memory timetable whichever backend answers the other
+    lookups, so both are loaded in memory.
+    """
+    return get_pool().shared('journey_planner', _build_journey_planner)
+
+
+def warmup_steps():
+    """The ``(name, build)`` pairs of the shared objects, cheapest first, for
+    a warm-up to build ahead of the requests (see ``warmup.py``)."""
+    return [
+        ('last_departure_sec', _read_last_departure_sec),
+        ('stop_index', StopIndex.from_connection),
+        ('timetable', _load_timetable),
+        ('footpaths', Footpaths.from_connection),
+        ('journey_planner', _build_journey_planner),
+    ]
+
+
+def get_feed_version():
+    """Return an identifier of the feed in the database, or None before any import.
+
+    It changes with every full import or update, so anything derived from
+    the timetable can be keyed on it.
+    """
+    return feed_version_key(get_db_connection())
+
 
 def get_trip_details(trip_id):
-    conn = get_db_connection()
-    trip = conn.execute('SELECT * FROM trips WHERE trip_id = ?', (trip_id,)).fetchone()
-    stop_times = conn.execute(
-        '''SELECT st.*, s.stop_name, s.stop_lat, s.stop_lon
-           FROM stop_times st
-           JOIN stops s ON st.stop_id = s.stop_id
-           WHERE st.trip_id = ?
-           ORDER BY st.stop_sequence ASC''', (trip_id,)
-    ).fetchall()
-    conn.close()
-    return trip, stop_times
+    return get_backend().get_trip_details(trip_id)
+
+
+def _departure(row, stop, start_time):
+    return {
+        "trip_id": row["trip_id"],
+        "route_id": row["route_id"],
+        "trip_headsign": row["trip_headsign"],
+        "stop": {
+            "name": stop["stop_name"],
+            "coordinates": {
+                "latitude": stop["stop_lat"],
+                "longitude": stop["stop_lon"]
+            },
+            "arrival_time": format_service_time(start_time[:10], row["arrival_sec"]),
+            "departure_time": format_service_time(start_time[:10], row["departure_sec"])
+        }
+    }
+
 
 def get_closest_departures(start_lat, start_lon, end_lat, end_lon, start_time, limit=3):
-    conn = get_db_connection()
-    # Load all stops with coordinates
-    stops = conn.execute('SELECT * FROM stops').fetchall()
-
-    # Compute distance from start to each stop
-    nearby_stops = sorted([
-        {
-            "stop": stop,
-            "distance": haversine(
-                start_lat, start_lon,
-                float(stop['stop_lat']), float(stop['stop_lon'])
-            )
-        } for stop in stops
-    ], key=lambda x: x['distance'])[:20]
-
-
-    # Check which trips go through those stops after the specified time
-    matching_departures = []
-    for item in nearby_stops:
-        stop = item["stop"]
-        rows = conn.execute(
-            '''SELECT st.*, t.route_id, t.trip_headsign
-               FROM stop_times st
-               JOIN trips t ON st.trip_id = t.trip_id
-               WHERE st.stop_id = ?
-               AND time(st.departure_time) >= time(?)
-               ORDER BY st.departure_time ASC''',
-            (stop['stop_id'], start_time)
-        ).fetchall()
-        for row in rows:
-            matching_departures.append({
-                "trip_id": row["trip_id"],
-                "route_id": row["route_id"],
-                "trip_headsign": row["trip_headsign"],
-                "stop": {
-                    "name": stop["stop_name"],
-                    "coordinates": {
-                        "latitude": stop["stop_lat"],
-                        "longitude": stop["stop_lon"]
-                    },
-                    "arrival_time": f"{start_time[:10]}T{row['arrival_time']}Z",
-                    "departure_time": f"{start_time[:10]}T{row['departure_time']}Z"
-                }
-            })
-            if len(matching_departures) >= limit:
-                conn.close()
-                return matching_departures
-    conn.close()
-    return matching_departures
+    return list(iter_closest_departures(start_lat, start_lon, end_lat, end_lon, start_time, limit))
+
+
+def iter_closest_departures(start_lat, start_lon, end_lat, end_lon, start_time, limit=3):
+    """Yield the departures of ``get_closest_departures`` as the backend returns them."""
+    with span('stop_lookup'):
+        nearby_stops = [stop for _, stop in find_nearby_stops(start_lat, start_lon)]
+    if not nearby_stops or limit <= 0:
+        return
+
+    with span('query'):
+        rows = get_backend().iter_departures(
+            [stop['stop_id'] for stop in nearby_stops], time_of_day_seconds(start_time), limit,
+            destination=(end_lat, end_lon), service_date=service_date(start_time),
+        )
+    # Rows of the SQLite cursor are read while it is iterated, so fetching
+    # them counts as materialization
+    yield from timed_iter('materialize', (
+        _departure(row, nearby_stops[row["rank"]], start_time) for row in rows
+    ))
+
+
+def get_stop_day(stop_id, day, limit=STOP_DAY_LIMIT):
+    """Return a stop and its departures on service day ``day`` (YYYY-MM-DD).
+
+    The departures are ``(departure_sec, departure)`` pairs in time order and
+    include the previous day's trips still running after midnight, with
+    their times on ``day``. The stop is None when it is unknown.
+    """
+    stop = get_stop_index().get(stop_id)
+    if stop is None:
+        return None, []
+    start_time = f'{day}T00:00:00Z'
+    rows = get_backend().departures([stop_id], 0, limit, service_date=service_date(start_time))
+    return stop, [(row['departure_sec'], _departure(row, stop, start_time)) for row in rows]
+
+
+def get_closest_departures_batch(requests):
+    """Answer many ``get_closest_departures`` requests, returning results in order.
+
+    ``requests`` are ``(start_lat, start_lon, end_lat, end_lon, start_time,
+    limit)`` tuples. Requests from the same start point share one nearest-stop
+    lookup, and the departures of the whole batch come from one backend call.
+    """
+    nearby = {}
+    queries, request_stops = [], []
+    for start_lat, start_lon, end_lat, end_lon, start_time, limit in requests:
+        point = (start_lat, start_lon)
+        if point not in nearby:
+            with span('stop_lookup'):
+                nearby[point] = [stop for _, stop in find_nearby_stops(start_lat, start_lon)]
+        stops = nearby[point] if limit > 0 else []
+        request_stops.append(stops)
+        queries.append(([stop['stop_id'] for stop in stops], time_of_day_seconds(start_time),
+                        limit, (end_lat, end_lon), service_date(start_time)))
+
+    with span('query'):
+        results = get_backend().departures_batch(queries)
+    with span('materialize'):
+        return [
+            [_departure(row, stops[row["rank"]], request[4]) for row in rows]
+            for request, stops, rows in zip(requests, request_stops, results)
+        ]
+
+
+def _journey_stop(stop, lat, lon):
+    # The start and end points of a journey are not stops
+    if stop is None:
+        return {"name": None, "coordinates": {"latitude": lat, "longitude": lon}}
+    return {
+        "name": stop["stop_name"],
+        "coordinates": {"latitude": stop["stop_lat"], "longitude": stop["stop_lon"]},
+    }
+
+
+def plan_journey(start_lat, start_lon, end_lat, end_lon, start_time):
+    """Return the earliest-arriving journey from the start to the end point, or None.
+
+    The journey walks to one of the stops around the start point, rides
+    trips with walking transfers in between, and walks from a stop around
+    the end point. Points within ``ACCESS_RADIUS_KM`` of each other may be
+    joined by a single walk instead.
+    """
+    planner = get_journey_planner()
+    with span('stop_lookup'):
+        access, egress = (
+            [(stop['stop_id'], walking_seconds(distance_km))
+             for distance_km, stop in find_nearby_stops(lat, lon, k=ACCESS_STOPS_LIMIT,
+                                                        radius_km=ACCESS_RADIUS_KM)]
+            for lat, lon in ((start_lat, start_lon), (end_lat, end_lon))
+        )
+    direct_km = haversine(start_lat, start_lon, end_lat, end_lon)
+    direct_walk = walking_seconds(direct_km) if direct_km <= ACCESS_RADIUS_KM else None
+    with span('query'):
+        legs = planner.earliest_arrival(
+            access, egress, time_of_day_seconds(start_time), service_date(start_time),
+            direct_walk,
+        )
+    if legs is None:
+        return None
+
+    timetable = planner.timetable
+    day = start_time[:10]
+
+    def point(pos, lat, lon):
+        return _journey_stop(None if pos is None else timetable.stops[pos], lat, lon)
+
+    journey_legs = []
+    for leg in legs:
+        if leg[0] == 'walk':
+            _, origin, destination, departure, arrival = leg
+            journey_leg = {"mode": "walk"}
+        else:
+            _, trip, origin, destination, departure, arrival = leg
+            trip = timetable.trips[trip]
+            journey_leg = {
+                "mode": "transit",
+                "trip_id": trip.trip_id,
+                "route_id": trip.route_id,
+                "trip_headsign": trip.trip_headsign,
+            }
+        journey_leg.update({
+            "from": point(origin, start_lat, start_lon),
+            "to": point(destination, end_lat, end_lon),
+            "departure_time": format_service_time(day, departure),
+            "arrival_time": format_service_time(day, arrival),
+        })
+        journey_legs.append(journey_leg)
+    rides = sum(leg["mode"] == "transit" for leg in journey_legs)
+    return {
+        "departure_time": journey_legs[0]["departure_time"],
+        "arrival_time": journey_legs[-1]["arrival_time"],
+        "duration_seconds": legs[-1][-1] - legs[0][-2],
+        "transfers": max(rides - 1, 0),
+        "legs": journey_legs,
+    }
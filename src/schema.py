@@ -0,0 +1,186 @@
+"""Database schema of an imported GTFS feed.
+
+Each table is loaded from one GTFS file. Columns are matched to CSV fields by
+name; ``TIME`` columns hold ``HH:MM:SS`` values converted to integer seconds
+since the start of the service day.
+
+Every table but ``feed_info``, which holds the feed's single row, has a
+primary key. Trips get an integer surrogate key, ``trip_key``, assigned at
+import; ``stop_times`` refers to trips by it
+(``TRIP`` columns hold the ``trip_key`` of the CSV's ``trip_id``) and is a
+``WITHOUT ROWID`` table clustered on ``(trip_key, stop_sequence)``, so the
+stop times of a trip are stored together. The departure index on
+``(stop_id, departure_sec, arrival_sec)`` carries the primary key columns
+too, so departure lookups never read the table itself.
+"""
+
+from collections import namedtuple
+
+# Stored in PRAGMA user_version; databases of an older version are converted
+# by migrate.py.
+SCHEMA_VERSION = 2
+
+Column = namedtuple("Column", "name type source")
+Table = namedtuple("Table", "name file columns primary_key without_rowid",
+                   defaults=(None, False))
+
+
+def _columns(*specs):
+    # (name, type) or (name, type, source field); a None source is not in the file
+    return [Column(spec[0], spec[1], spec[2] if len(spec) > 2 else spec[0]) for spec in specs]
+
+
+TABLES = [
+    Table("stops", "stops.txt", _columns(
+        ("stop_id", "INTEGER"),
+        ("stop_code", "INTEGER"),
+        ("stop_name", "TEXT"),
+        ("stop_lat", "REAL"),
+        ("stop_lon", "REAL"),
+    ), "stop_id"),
+    Table("routes", "routes.txt", _columns(
+        ("route_id", "TEXT"),
+        ("agency_id", "INTEGER"),
+        ("route_short_name", "TEXT"),
+        ("route_long_name", "TEXT"),
+        ("route_desc", "TEXT"),
+        ("route_type", "INTEGER"),
+        ("route_type2_id", "INTEGER"),
+        ("valid_from", "TEXT"),
+        ("valid_until", "TEXT"),
+    ), "route_id", True),
+    Table("trips", "trips.txt", _columns(
+        ("trip_key", "INTEGER", None),
+        ("route_id", "TEXT"),
+        ("service_id", "INTEGER"),
+        ("trip_id", "TEXT"),
+        ("trip_headsign", "TEXT"),
+        ("direction_id", "INTEGER"),
+        ("shape_id", "INTEGER"),
+        ("brigade_id", "INTEGER"),
+        ("vehicle_id", "INTEGER"),
+        ("variant_id", "INTEGER"),
+    ), "trip_key"),
+    Table("stop_times", "stop_times.txt", _columns(
+        ("trip_key", "TRIP", "trip_id"),
+        ("arrival_sec", "TIME", "arrival_time"),
+        ("departure_sec", "TIME", "departure_time"),
+        ("stop_id", "INTEGER"),
+        ("stop_sequence", "INTEGER"),
+        ("pickup_type", "INTEGER"),
+        ("drop_off_type", "INTEGER"),
+    ), "trip_key, stop_sequence", True),
+    Table("calendar", "calendar.txt", _columns(
+        ("service_id", "INTEGER"),
+        ("monday", "INTEGER"),
+        ("tuesday", "INTEGER"),
+        ("wednesday", "INTEGER"),
+        ("thursday", "INTEGER"),
+        ("friday", "INTEGER"),
+        ("saturday", "INTEGER"),
+        ("sunday", "INTEGER"),
+        ("start_date", "INTEGER"),
+        ("end_date", "INTEGER"),
+    ), "service_id"),
+    Table("calendar_dates", "calendar_dates.txt", _columns(
+        ("service_id", "INTEGER"),
+        ("date", "INTEGER"),
+        ("exception_type", "INTEGER"),
+    ), "date, service_id", True),
+    Table("variants", "variants.txt", _columns(
+        ("variant_id", "INTEGER"),
+        ("is_main", "INTEGER"),
+        ("equiv_main_variant_id", "INTEGER"),
+        ("join_stop_id", "INTEGER"),
+        ("disjoin_stop_id", "INTEGER"),
+    ), "variant_id"),
+    Table("feed_info", "feed_info.txt", _columns(
+        ("feed_publisher_name", "TEXT"),
+        ("feed_publisher_url", "TEXT"),
+        ("feed_lang", "TEXT"),
+        ("feed_start_date", "INTEGER"),
+        ("feed_end_date", "INTEGER"),
+    )),
+]
+
+# Built after the bulk load, when creating them in one pass is much cheaper
+# than maintaining them row by row.
+INDEXES = [
+    "CREATE UNIQUE INDEX idx_trips_trip_id ON trips (trip_id)",
+    "CREATE INDEX idx_stop_times_stop_departure ON stop_times (stop_id, departure_sec, arrival_sec)",
+]
+
+
+# Bookkeeping for incremental feed refreshes: the hash of every imported file,
+# a digest of every trip together with its stop times, and a log of the feed
+# versions applied to the database.
+FEED_METADATA = [
+    "CREATE TABLE feed_files (file TEXT PRIMARY KEY, sha256 TEXT NOT NULL)",
+    "CREATE TABLE trip_digests (trip_id TEXT PRIMARY KEY, digest INTEGER NOT NULL) WITHOUT ROWID",
+    """CREATE TABLE feed_versions (
+           version INTEGER PRIMARY KEY,
+           feed_hash TEXT NOT NULL,
+           feed_start_date INTEGER,
+           feed_end_date INTEGER,
+           mode TEXT NOT NULL,
+           applied_at TEXT NOT NULL,
+           trips_inserted INTEGER NOT NULL,
+           trips_changed INTEGER NOT NULL,
+           trips_deleted INTEGER NOT NULL
+       )""",
+]
+
+# Derived from the loaded feed by gtfs_import.build_variant_stops(),
+# build_service_dates() and build_footpaths().
+#
+# variant_stops holds, for every stop of a variant's stop sequence, the
+# bounding box of the stops still ahead, so whether a trip can still get
+# closer to a destination after a stop is a single-row check. The last stop
+# of a variant has no row.
+#
+# service_dates lists the services running on every date of the feed, from
+# calendar with the calendar_dates exceptions applied, so whether a trip runs
+# on a date is a membership check of its service_id.
+#
+# footpaths links every stop to the stops within walking distance, in both
+# directions, and stop_stations groups the stops sharing a name into
+# stations (see footpaths.py). Stops on their own have no stop_stations row.
+DERIVED_TABLES = [
+    """CREATE TABLE IF NOT EXISTS variant_stops (
+           variant_id INTEGER NOT NULL,
+           stop_sequence INTEGER NOT NULL,
+           stop_id INTEGER NOT NULL,
+           min_lat REAL NOT NULL,
+           max_lat REAL NOT NULL,
+           min_lon REAL NOT NULL,
+           max_lon REAL NOT NULL,
+           PRIMARY KEY (variant_id, stop_sequence)
+       ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS service_dates (
+           date INTEGER NOT NULL,
+           service_id INTEGER NOT NULL,
+           PRIMARY KEY (date, service_id)
+       ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS footpaths (
+           from_stop_id INTEGER NOT NULL,
+           to_stop_id INTEGER NOT NULL,
+           distance_m INTEGER NOT NULL,
+           walk_sec INTEGER NOT NULL,
+           PRIMARY KEY (from_stop_id, to_stop_id)
+       ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS stop_stations (
+           stop_id INTEGER PRIMARY KEY,
+           station_id INTEGER NOT NULL
+       ) WITHOUT ROWID""",
+]
+
+
+def create_table_sql(table):
+    columns = ", ".join(
+        f"{column.name} {'INTEGER' if column.type in ('TIME', 'TRIP') else column.type}"
+        for column in table.columns
+    )
+    if table.primary_key:
+        columns += f", PRIMARY KEY ({table.primary_key})"
+    return f"CREATE TABLE {table.name} ({columns}){' WITHOUT ROWID' if table.without_rowid else ''}"
+
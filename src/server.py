@@ -0,0 +1,342 @@
+"""Asynchronous (ASGI) serving mode for the Flask app.
+
+``AsyncApp`` wraps the WSGI app in an ASGI application. Requests are read on
+the event loop, and the Flask handlers with their synchronous sqlite3 calls
+run in a bounded thread pool:
+
+* at most ``max_threads`` requests run at once and ``max_queue`` more wait
+  for a thread. Beyond that, requests are rejected right away with ``503``
+  and a ``Retry-After`` header instead of piling up;
+* a request whose response has not started after ``timeout`` seconds is
+  answered with ``504``. Its thread completes in the background and keeps its
+  slot until then, so a slow database cannot oversubscribe the pool, and the
+  response it returns is closed unsent.
+
+Response bodies are forwarded chunk by chunk as the handler produces them, so
+streamed responses reach the client before the handler has finished. When the
+client disconnects, the body is closed at its next chunk. A body that can be
+iterated with ``async for``, such as a departure subscription's
+(``subscriptions.Stream``), is handed over to the event loop once the handler
+returns it instead: it frees its thread and slot, so open subscriptions never
+hold up other requests, and it is closed as soon as the client disconnects.
+
+Its lifespan startup calls ``on_startup``; ``application`` starts the
+background warm-up there when ``WARMUP=background`` (see ``warmup.py``).
+
+``application`` can be served by any ASGI server. The launcher runs it with
+uvicorn (``pip install .[asgi]``) in several worker processes::
+
+    python src/server.py [--host 127.0.0.1] [--port 5002] [--workers 4]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import warmup
+from app import app
+
+DEFAULT_THREADS = 8
+DEFAULT_QUEUE = 64
+DEFAULT_TIMEOUT_SECONDS = 10.0
+
+
+def wsgi_environ(scope, body):
+    """Build the WSGI environ of an ASGI HTTP ``scope`` with its request ``body``."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        # WSGI carries paths as latin-1 decoded bytes
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+class AsyncApp:
+    """ASGI application running a WSGI app in a bounded thread pool."""
+
+    def __init__(self, wsgi_app, max_threads=DEFAULT_THREADS, max_queue=DEFAULT_QUEUE,
+                 timeout=DEFAULT_TIMEOUT_SECONDS, on_startup=None):
+        self.wsgi_app = wsgi_app
+        self.on_startup = on_startup
+        self.max_threads = max_threads
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_threads, thread_name_prefix='request')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counts = dict.fromkeys(('completed', 'rejected', 'timed_out'), 0)
+
+    @classmethod
+    def from_environment(cls, wsgi_app, on_startup=None):
+        """Configure from ``ASYNC_THREADS``, ``ASYNC_QUEUE`` and ``ASYNC_TIMEOUT``."""
+        return cls(
+            wsgi_app,
+            max_threads=int(os.environ.get('ASYNC_THREADS', DEFAULT_THREADS)),
+            max_queue=int(os.environ.get('ASYNC_QUEUE', DEFAULT_QUEUE)),
+            timeout=float(os.environ.get('ASYNC_TIMEOUT', DEFAULT_TIMEOUT_SECONDS)),
+            on_startup=on_startup,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Must not block: the server only listens once startup completes
+                if self.on_startup is not None:
+                    self.on_startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        with self._lock:
+            admitted = self._in_flight < self.max_threads + self.max_queue
+            if admitted:
+                self._in_flight += 1
+            else:
+                self._counts['rejected'] += 1
+        if not admitted:
+            await self._send_error(send, 503, 'Server busy', [(b'retry-after', b'1')])
+            return
+
+        try:
+            body = await self._read_body(receive)
+        except BaseException:
+            self._release()
+            raise
+        # The handler thread hands the response over through this queue:
+        # ('start', status, headers), then ('body', chunk)..., then ('end',),
+        # or ('error', exception). An asynchronous body comes as ('stream',
+        # body) after 'start' and is sent from here.
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        disconnected = threading.Event()
+        abandoned = False  # set on a timeout, when nothing reads the queue any more
+        handover = threading.Lock()
+
+        def emit(event):
+            # Returns whether the event was handed over
+            with handover:
+                if abandoned:
+                    return False
+                loop.call_soon_threadsafe(events.put_nowait, event)
+            return True
+
+        future = self._executor.submit(
+            self._call_wsgi, wsgi_environ(scope, body), emit, disconnected
+        )
+        # The slot is freed when the handler finishes, not when we stop waiting.
+        future.add_done_callback(lambda _: self._release())
+        try:
+            event = await asyncio.wait_for(events.get(), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()  # still queued: it never runs
+            with handover:
+                abandoned = True
+            # Runs after the events handed over before that
+            loop.call_soon(self._discard, events)
+            with self._lock:
+                self._counts['timed_out'] += 1
+            await self._send_error(send, 504, 'Request timed out')
+            return
+
+        watcher = asyncio.ensure_future(self._watch_disconnect(receive, disconnected))
+        try:
+            while event[0] != 'end':
+                if event[0] == 'error':
+                    raise event[1]
+                if event[0] == 'start':
+                    await send({
+                        'type': 'http.response.start',
+                        'status': event[1],
+                        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                    for name, value in event[2]],
+                    })
+                elif event[0] == 'stream':
+                    await self._send_stream(event[1], send, watcher)
+                    break
+                else:
+                    await send({'type': 'http.response.body', 'body': event[1],
+                                'more_body': True})
+                event = await events.get()
+        finally:
+            watcher.cancel()
+        await send({'type': 'http.response.body', 'body': b''})
+        with self._lock:
+            self._counts['completed'] += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    @staticmethod
+    def _discard(events):
+        # The response of a timed-out request; an asynchronous body must be closed
+        while not events.empty():
+            event = events.get_nowait()
+            if event[0] == 'stream':
+                event[1].close()
+
+    @staticmethod
+    async def _send_stream(body, send, watcher):
+        """Send the chunks of an asynchronous body until it ends or ``watcher``
+        sees the client disconnect, then close it."""
+        async def forward():
+            async for chunk in body:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        sending = asyncio.ensure_future(forward())
+        try:
+            await asyncio.wait({sending, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sending.cancel()
+            await asyncio.wait({sending})
+            body.close()
+        if not sending.cancelled():
+            sending.result()  # raises what the body or send raised
+
+    @staticmethod
+    async def _watch_disconnect(receive, disconnected):
+        # Once the body is read, the next message is the client disconnecting
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            disconnected.set()
+
+    @staticmethod
+    async def _read_body(receive):
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+        return body
+
+    def _call_wsgi(self, environ, emit, disconnected):
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]), headers]
+
+        try:
+            result = self.wsgi_app(environ, start_response)
+            if hasattr(result, '__aiter__'):
+                if not (emit(('start', *response)) and emit(('stream', result))):
+                    result.close()  # timed out: nobody will send it
+                return
+            try:
+                # Headers go out with the first chunk, so a streamed body is
+                # forwarded as it is produced. Once the client is gone or the
+                # request timed out, closing the body ends it.
+                started = False
+                for chunk in result:
+                    if disconnected.is_set():
+                        break
+                    if not started:
+                        started = True
+                        if not emit(('start', *response)):
+                            break
+                    if chunk and not emit(('body', chunk)):
+                        break
+                if not started:
+                    emit(('start', *response))
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        except Exception as error:
+            emit(('error', error))
+            return
+        emit(('end',))
+
+    @staticmethod
+    async def _send_error(send, status, message, headers=()):
+        body = f'{{"error": "{message}"}}'.encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode()), *headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counts,
+                'in_flight': self._in_flight,
+                'max_threads': self.max_threads,
+                'max_queue': self.max_queue,
+                'timeout': self.timeout,
+            }
+
+
+application = AsyncApp.from_environment(app, on_startup=warmup.start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the API with uvicorn.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=5002, type=int)
+    parser.add_argument('--workers', default=1, type=int, help='worker processes')
+    parser.add_argument('--threads', default=DEFAULT_THREADS, type=int,
+                        help='request threads per worker')
+    parser.add_argument('--queue', default=DEFAULT_QUEUE, type=int,
+                        help='requests waiting for a thread before 503s')
+    parser.add_argument('--timeout', default=DEFAULT_TIMEOUT_SECONDS, type=float,
+                        help='seconds before a request is answered with 504')
+    args = parser.parse_args()
+    try:
+        import uvicorn
+    except ImportError:
+        parser.error('the launcher needs uvicorn: pip install .[asgi]')
+
+    # Worker processes configure their AsyncApp from the environment.
+    os.environ.update(
+        ASYNC_THREADS=str(args.threads), ASYNC_QUEUE=str(args.queue),
+        ASYNC_TIMEOUT=str(args.timeout),
+    )
+    uvicorn.run('server:application', host=args.host, port=args.port,
+                workers=args.workers, lifespan='on')
+
+
+if __name__ == '__main__':
+    main()
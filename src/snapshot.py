@@ -0,0 +1,342 @@
+"""Binary snapshot of the timetable, memory-mapped by the API workers.
+
+Building ``Timetable`` from SQLite takes seconds and every worker process
+holds its own copy. The import therefore also writes the timetable to
+``<database>.timetable`` (see ``snapshot_path()``), and workers map that
+file read-only instead: opening it parses a small header and nothing else,
+and all workers share the one copy in the page cache.
+
+The file starts with ``MAGIC``, the format version and the length of a JSON
+header, followed by the header and the sections it lists, each an array of
+fixed-width native integers or doubles aligned to 8 bytes:
+
+* stop times in trip order, one column per field (``st_trip``, ``st_stop``,
+  ``st_sequence``, ``st_arrival``, ``st_departure``) and ``st_box``, the
+  index in ``boxes`` of the bounding box of the trip's remaining path;
+* the per-stop departures sorted by time (``dep_offsets``, ``dep_secs``,
+  ``dep_rows``), as in ``Timetable``;
+* stop and trip columns, with names, route ids and headsigns as indexes into
+  a string table (``string_offsets`` and UTF-8 ``string_bytes``) and trip ids
+  in a table of their own; ``stop_order`` and ``trip_order`` sort them by id
+  for lookups;
+* ``(service_date, service_id)`` pairs sorted by date.
+
+``MappedTimetable`` reads every section zero-copy through ``memoryview``, so
+the lookups of ``Timetable`` run directly on the mapped buffer. The header
+holds the feed version the snapshot was written from; a snapshot of another
+version is not used.
+"""
+
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections.abc import Sequence
+from pathlib import Path
+
+from spatial import box_distance_sq
+from timetable import Timetable, TripRecord
+
+MAGIC = b'PTTIMETB'
+FORMAT_VERSION = 1
+# Magic, format version and header length
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 8
+# Stands for NULL in the integer columns
+NULL_INT = -2**63
+
+
+def snapshot_path(db_path):
+    """Return where the snapshot of the database at ``db_path`` is written."""
+    return Path(db_path).with_suffix('.timetable')
+
+
+def _int(value):
+    return NULL_INT if value is None else value
+
+
+def _nullable(value):
+    return None if value == NULL_INT else value
+
+
+class _StringTable:
+
+    def __init__(self, dedupe=True):
+        self.offsets = array('I', [0])
+        self.data = bytearray()
+        self._index = {} if dedupe else None
+
+    def add(self, value):
+        value = '' if value is None else str(value)
+        if self._index is not None and value in self._index:
+            return self._index[value]
+        self.data += value.encode()
+        self.offsets.append(len(self.data))
+        index = len(self.offsets) - 2
+        if self._index is not None:
+            self._index[value] = index
+        return index
+
+
+def _sections(timetable):
+    """Return ``{section name: array}`` of ``timetable``."""
+    strings, trip_ids = _StringTable(), _StringTable(dedupe=False)
+    stops, trips = timetable.stops, timetable.trips
+    sections = {
+        'stop_ids': array('q', (stop['stop_id'] for stop in stops)),
+        'stop_lat': array('d', (stop['stop_lat'] for stop in stops)),
+        'stop_lon': array('d', (stop['stop_lon'] for stop in stops)),
+        'stop_name': array('I', (strings.add(stop['stop_name']) for stop in stops)),
+        'stop_order': array('I', sorted(range(len(stops)), key=lambda pos: stops[pos]['stop_id'])),
+        'trip_route': array('I', (strings.add(trip.route_id) for trip in trips)),
+        'trip_headsign': array('I', (strings.add(trip.trip_headsign) for trip in trips)),
+        'trip_service': array('q', (_int(trip.service_id) for trip in trips)),
+        'trip_direction': array('q', (_int(trip.direction_id) for trip in trips)),
+        'trip_variant': array('q', (_int(trip.variant_id) for trip in trips)),
+        'trip_start': array('I', (trip.start for trip in trips)),
+        'trip_end': array('I', (trip.end for trip in trips)),
+        'trip_id_index': array('I', (trip_ids.add(trip.trip_id) for trip in trips)),
+        'trip_order': array('I', sorted(range(len(trips)),
+                                        key=lambda pos: trips[pos].trip_id.encode())),
+    }
+    sections['trip_id_offsets'], sections['trip_id_bytes'] = (
+        trip_ids.offsets, array('B', trip_ids.data))
+
+    box_index, boxes = {}, array('d')
+    st_box = array('i', bytes(4 * len(timetable.st_trip)))
+    for row, (trip, sequence) in enumerate(zip(timetable.st_trip, timetable.st_sequence)):
+        key = (trips[trip].variant_id, sequence)
+        box = timetable._remaining_box.get(key)
+        if box is None:
+            st_box[row] = -1
+            continue
+        if key not in box_index:
+            box_index[key] = len(boxes) // 4
+            boxes.extend(box)
+        st_box[row] = box_index[key]
+    sections.update(
+        st_trip=timetable.st_trip, st_stop=timetable.st_stop,
+        st_sequence=timetable.st_sequence, st_arrival=timetable.st_arrival,
+        st_departure=timetable.st_departure, st_box=st_box, boxes=boxes,
+        dep_offsets=timetable.dep_offsets, dep_secs=timetable.dep_secs,
+        dep_rows=timetable.dep_rows,
+    )
+
+    dates = sorted((date, service_id) for date, services in timetable._active_services.items()
+                   for service_id in services)
+    sections['service_date'] = array('q', (date for date, _ in dates))
+    sections['service_id'] = array('q', (service_id for _, service_id in dates))
+    sections['string_offsets'], sections['string_bytes'] = (
+        strings.offsets, array('B', strings.data))
+    return sections
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(db_path, feed_version, path=None, conn=None):
+    """Write the snapshot of the database at ``db_path``, whose feed version is
+    ``feed_version``; return the snapshot's path and size.
+
+    The timetable is read through ``conn`` when given, e.g. by an update
+    before it commits, so the snapshot is in place when readers see the feed.
+    """
+    db_path = Path(db_path)
+    path = snapshot_path(db_path) if path is None else Path(path)
+    if conn is not None:
+        timetable = Timetable.from_connection(conn)
+    else:
+        conn = sqlite3.connect(f'{db_path.resolve().as_uri()}?mode=ro', uri=True)
+        try:
+            timetable = Timetable.from_connection(conn)
+        finally:
+            conn.close()
+    sections = _sections(timetable)
+
+    layout, offset = {}, 0
+    for name, values in sections.items():
+        layout[name] = [values.typecode, offset, len(values)]
+        offset = _aligned(offset + values.itemsize * len(values))
+    header = json.dumps({
+        'feed_version': feed_version,
+        'byteorder': sys.byteorder,
+        'last_departure_sec': timetable.last_departure_sec,
+        'sections': layout,
+    }).encode()
+    start = _aligned(PREAMBLE.size + len(header))
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)) + header)
+        for name, values in sections.items():
+            f.seek(start + layout[name][1])
+            values.tofile(f)
+        f.truncate(start + offset)
+    os.replace(tmp_path, path)
+    return path, start + offset
+
+
+def _search(count, key, value):
+    # Leftmost position in range(count) whose key(position) is not below value
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key(mid) < value:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class _Stops(Sequence):
+    """The ``stops`` of a ``MappedTimetable``, as dicts made on access."""
+
+    def __init__(self, timetable):
+        self._timetable = timetable
+
+    def __len__(self):
+        return len(self._timetable.stop_ids)
+
+    def __getitem__(self, pos):
+        t = self._timetable
+        return {'stop_id': t.stop_ids[pos], 'stop_name': t.string(t.stop_name[pos]),
+                'stop_lat': t.stop_lat[pos], 'stop_lon': t.stop_lon[pos]}
+
+
+class _Trips(Sequence):
+    """The ``trips`` of a ``MappedTimetable``, as ``TripRecord``s made on access."""
+
+    def __init__(self, timetable):
+        self._timetable = timetable
+
+    def __len__(self):
+        return len(self._timetable.trip_start)
+
+    def __getitem__(self, pos):
+        t = self._timetable
+        trip = TripRecord(
+            t.trip_id(pos), t.string(t.trip_route[pos]), t.string(t.trip_headsign[pos]),
+            _nullable(t.trip_service[pos]), _nullable(t.trip_direction[pos]),
+            _nullable(t.trip_variant[pos]),
+        )
+        trip.start, trip.end = t.trip_start[pos], t.trip_end[pos]
+        return trip
+
+
+class MappedTimetable(Timetable):
+    """A ``Timetable`` reading a snapshot file in place.
+
+    Raises ValueError when the file is not a snapshot this code can read.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        magic, version, header_length = PREAMBLE.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} timetable snapshot')
+        header = json.loads(bytes(buffer[PREAMBLE.size:PREAMBLE.size + header_length]))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f'{path} was written on a {header["byteorder"]}-endian machine')
+        self.feed_version = header['feed_version']
+        self.last_departure_sec = header['last_departure_sec']
+        start = _aligned(PREAMBLE.size + header_length)
+        for name, (typecode, offset, length) in header['sections'].items():
+            size = array(typecode).itemsize * length
+            section = buffer[start + offset:start + offset + size]
+            setattr(self, name, section.cast(typecode))
+        self.stops = _Stops(self)
+        self.trips = _Trips(self)
+        self._strings = {}
+        self._active_services = {}
+
+    @classmethod
+    def open(cls, path, feed_version):
+        """Map the snapshot at ``path`` if it was written from ``feed_version``,
+        else return None."""
+        try:
+            timetable = cls(path)
+        except (OSError, ValueError):
+            return None
+        return timetable if timetable.feed_version == feed_version else None
+
+    def string(self, index):
+        value = self._strings.get(index)
+        if value is None:
+            offsets = self.string_offsets
+            value = str(self.string_bytes[offsets[index]:offsets[index + 1]], 'utf-8')
+            # Names, routes and headsigns: a few thousand at most
+            self._strings[index] = value
+        return value
+
+    def trip_id(self, pos):
+        index = self.trip_id_index[pos]
+        offsets = self.trip_id_offsets
+        return str(self.trip_id_bytes[offsets[index]:offsets[index + 1]], 'utf-8')
+
+    def stop_position(self, stop_id):
+        order, stop_ids = self.stop_order, self.stop_ids
+        i = _search(len(order), lambda i: stop_ids[order[i]], stop_id)
+        if i < len(order) and stop_ids[order[i]] == stop_id:
+            return order[i]
+        return None
+
+    def trip_position(self, trip_id):
+        order, offsets, data = self.trip_order, self.trip_id_offsets, self.trip_id_bytes
+        index = self.trip_id_index
+
+        def key(i):
+            j = index[order[i]]
+            return data[offsets[j]:offsets[j + 1]].tobytes()
+
+        wanted = trip_id.encode()
+        i = _search(len(order), key, wanted)
+        if i < len(order) and key(i) == wanted:
+            return order[i]
+        return None
+
+    def active_services(self, service_date):
+        services = self._active_services.get(service_date)
+        if services is None:
+            dates = self.service_date
+            services = frozenset(self.service_id[bisect_left(dates, service_date):
+                                                 bisect_right(dates, service_date)])
+            # One entry per date the API is asked about; a handful at a time
+            if len(self._active_services) >= 8:
+                self._active_services.clear()
+            self._active_services[service_date] = services
+        return services
+
+    def memory_footprint(self):
+        """Bytes of the mapped file, shared through the page cache by every process."""
+        return len(self._mmap)
+
+    def _scan_stop(self, rank, pos, start_sec, offset, active, frame, stop_distance):
+        # Timetable._scan_stop on the columns, without making trip records
+        st_trip, st_box, boxes = self.st_trip, self.st_box, self.boxes
+        trip_service = self.trip_service
+        lo, hi = self.dep_offsets[pos], self.dep_offsets[pos + 1]
+        for i in range(bisect_left(self.dep_secs, start_sec + offset, lo, hi), hi):
+            row = self.dep_rows[i]
+            trip = st_trip[row]
+            if active is not None and trip_service[trip] not in active:
+                continue
+            if frame is not None:
+                box = st_box[row]
+                if box < 0 or box_distance_sq(frame, *boxes[4 * box:4 * box + 4]) >= stop_distance:
+                    continue
+            yield {
+                'rank': rank,
+                'trip_id': self.trip_id(trip),
+                'arrival_sec': self.st_arrival[row] - offset,
+                'departure_sec': self.st_departure[row] - offset,
+                'route_id': self.string(self.trip_route[trip]),
+                'trip_headsign': self.string(self.trip_headsign[trip]),
+            }
+
@@ -0,0 +1,175 @@
+"""Grid-bucket spatial index answering "k nearest stops within radius" queries."""
+
+import heapq
+from math import cos, floor, radians
+
+from utils import EQUIRECTANGULAR_MAX_KM, equirectangular_many, haversine_many
+
+KM_PER_DEGREE_LAT = 111.195
+STOPS_QUERY = "SELECT stop_id, stop_code, stop_name, stop_lat, stop_lon FROM stops"
+
+
+def planar_frame(lat, lon):
+    """Reference point for the planar distance helpers: ``(lat, lon, lon scale)``."""
+    return lat, lon, cos(radians(lat))
+
+
+def planar_distance_sq(frame, lat, lon):
+    """Squared equirectangular distance from the frame's point, in degrees².
+
+    Only meant for comparing distances to the same point; the SQL in
+    ``models`` evaluates exactly the same expression.
+    """
+    ref_lat, ref_lon, lon_scale = frame
+    dx = (lon - ref_lon) * lon_scale
+    dy = lat - ref_lat
+    return dx * dx + dy * dy
+
+
+def box_distance_sq(frame, min_lat, max_lat, min_lon, max_lon):
+    """``planar_distance_sq`` from the frame's point to the closest point of a box."""
+    ref_lat, ref_lon, _ = frame
+    return planar_distance_sq(
+        frame, max(min_lat, min(max_lat, ref_lat)), max(min_lon, min(max_lon, ref_lon))
+    )
+
+
+class StopIndex:
+    """Buckets stops into a uniform lat/lon grid.
+
+    A query only visits the rings of cells around the query point until the
+    k-th best distance found so far is closer than anything an unvisited ring
+    could contain, so its cost depends on local stop density rather than on
+    the total number of stops.
+    """
+
+    def __init__(self, stops, cell_size_km=0.5):
+        self.cell_size_km = cell_size_km
+        self._stops = list(stops)
+        self._lats = [float(s["stop_lat"]) for s in self._stops]
+        self._lons = [float(s["stop_lon"]) for s in self._stops]
+        self._by_id = {s["stop_id"]: s for s in self._stops}
+
+        lats = self._lats or [0.0]
+        ref_lat = sum(lats) / len(lats)
+        self._cell_lat = cell_size_km / KM_PER_DEGREE_LAT
+        self._cell_lon = cell_size_km / (KM_PER_DEGREE_LAT * cos(radians(ref_lat)))
+        # Longitude cells shrink away from the equator; use the narrowest
+        # cell width in the covered area as a safe lower bound per ring.
+        widest_lat = max(abs(min(lats)), abs(max(lats)))
+        self._min_cell_km = min(
+            cell_size_km,
+            self._cell_lon * KM_PER_DEGREE_LAT * cos(radians(widest_lat)),
+        )
+
+        self._cells = {}
+        for idx, (lat, lon) in enumerate(zip(self._lats, self._lons)):
+            self._cells.setdefault(self._cell(lat, lon), []).append(idx)
+        if self._cells:
+            rows = [i for i, _ in self._cells]
+            cols = [j for _, j in self._cells]
+            self._bounds = (min(rows), max(rows), min(cols), max(cols))
+        else:
+            self._bounds = None
+
+    @classmethod
+    def from_connection(cls, conn, **kwargs):
+        return cls(conn.execute(STOPS_QUERY).fetchall(), **kwargs)
+
+    def __len__(self):
+        return len(self._stops)
+
+    def get(self, stop_id):
+        """Return the stop record with the given id, or None."""
+        return self._by_id.get(stop_id)
+
+    def _cell(self, lat, lon):
+        return floor(lat / self._cell_lat), floor(lon / self._cell_lon)
+
+    def _ring(self, ci, cj, r):
+        if r == 0:
+            yield ci, cj
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield ci - r, j
+            yield ci + r, j
+        for i in range(ci - r + 1, ci + r):
+            yield i, cj - r
+            yield i, cj + r
+
+    def nearest(self, lat, lon, k=20, radius_km=None, approximate=None):
+        """Return up to ``k`` ``(distance_km, stop)`` pairs sorted by distance.
+
+        Stops further than ``radius_km`` (when given) are never returned.
+        Distances are computed a ring at a time with the batch functions from
+        ``utils``; ``approximate`` selects the equirectangular approximation
+        and defaults to true for radii up to ``EQUIRECTANGULAR_MAX_KM``.
+        """
+        if approximate is None:
+            approximate = radius_km is not None and radius_km <= EQUIRECTANGULAR_MAX_KM
+        distances_from = equirectangular_many if approximate else haversine_many
+        if k <= 0 or self._bounds is None:
+            return []
+        ci, cj = self._cell(lat, lon)
+        min_i, max_i, min_j, max_j = self._bounds
+        # Queries outside the grid start at the first ring touching it and
+        # stop once the ring covers the whole grid.
+        first_ring = max(min_i - ci, ci - max_i, min_j - cj, cj - max_j, 0)
+        last_ring = max(ci - min_i, max_i - ci, cj - min_j, max_j - cj)
+
+        # Max-heap of (-distance, -idx): ties are broken by stop order so
+        # results match a stable sort over all stops.
+        best = []
+        cells = self._cells
+        lats, lons = self._lats, self._lons
+        for r in range(first_ring, last_ring + 1):
+            ring = [idx for cell in self._ring(ci, cj, r) for idx in cells.get(cell, ())]
+            distances = distances_from(lat, lon, [lats[i] for i in ring], [lons[i] for i in ring])
+            if not isinstance(distances, list):
+                distances = distances.tolist()
+            for idx, distance in zip(ring, distances):
+                if radius_km is not None and distance > radius_km:
+                    continue
+                entry = (-distance, -idx)
+                if len(best) < k:
+                    heapq.heappush(best, entry)
+                elif entry > best[0]:
+                    heapq.heapreplace(best, entry)
+            # Every stop in an unvisited ring is at least this far away.
+            reach_km = r * self._min_cell_km
+            if radius_km is not None and reach_km > radius_km:
+                break
+            if len(best) == k and -best[0][0] < reach_km:
+                break
+
+        return [(-neg, self._stops[-idx]) for neg, idx in sorted(best, reverse=True)]
+
+
+class StopScan:
+    """The lookups of ``StopIndex`` answered from the ``stops`` table.
+
+    Every ``nearest`` query reads and ranks all stops, so it is only meant
+    for the time before the index is built. ``connect()`` returns the
+    connection to query.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+
+    def get(self, stop_id):
+        """Return the stop record with the given id, or None."""
+        return self._connect().execute(f"{STOPS_QUERY} WHERE stop_id = ?", (stop_id,)).fetchone()
+
+    def nearest(self, lat, lon, k=20, radius_km=None, approximate=None):
+        """Return what ``StopIndex.nearest`` returns for the same arguments."""
+        if approximate is None:
+            approximate = radius_km is not None and radius_km <= EQUIRECTANGULAR_MAX_KM
+        distances_from = equirectangular_many if approximate else haversine_many
+        stops = self._connect().execute(STOPS_QUERY).fetchall()
+        distances = distances_from(lat, lon, [float(s["stop_lat"]) for s in stops],
+                                   [float(s["stop_lon"]) for s in stops])
+        if not isinstance(distances, list):
+            distances = distances.tolist()
+        ranked = sorted((distance, idx) for idx, distance in enumerate(distances)
+                        if radius_km is None or distance <= radius_km)
+        return [(distance, stops[idx]) for distance, idx in ranked[:k]] if k > 0 else []
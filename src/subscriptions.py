@@ -0,0 +1,314 @@
+"""Departure subscriptions pushed to clients as Server-Sent Events.
+
+Display clients subscribe to a stop's departure board or to a
+closest-departures query and keep the connection open instead of polling.
+Subscriptions with the same key (the stop and limit, or the snapped query)
+share one ``Topic``. At every minute tick (``boards.minute_ticker``) each
+topic is evaluated once and compared with its previous result, and the
+change is encoded once as a ``diff`` event that all of the topic's
+subscribers send. The work per tick grows with the number of distinct
+subscriptions, not with the number of clients.
+
+A subscriber first gets a ``snapshot`` event with the whole list, then a
+``diff`` whenever the list changes:
+``{"start_time": ..., "removed": [...], "added": [{"index": i, "departure": ...}]}``.
+Departures are identified by ``trip_id`` and ``departure_time``; the
+``removed`` ones are dropped first, then the ``added`` ones are inserted at
+their ``index`` in ascending order. A subscriber that has fallen more than
+``HISTORY`` events behind gets a new snapshot instead.
+
+A stream (``Stream``) sends a comment line when
+``SUBSCRIPTION_KEEPALIVE_SECONDS`` (15) pass without an event. The ASGI mode
+(``server.py``) awaits its events on the event loop, so open streams hold no
+request thread and only ``SUBSCRIPTION_MAX_STREAMS`` (1,000 per process)
+limits them; a WSGI server holds a thread per open stream instead.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+
+import database
+from boards import minute_ticker
+
+DEFAULT_MAX_STREAMS = 1000
+DEFAULT_KEEPALIVE_SECONDS = 15.0
+# Events a topic keeps for subscribers that are still sending earlier ones
+HISTORY = 16
+KEEPALIVE = b': keepalive\n\n'
+
+
+def event(name, data):
+    """Encode one Server-Sent Event."""
+    return f'event: {name}\ndata: {json.dumps(data, sort_keys=True)}\n\n'
+
+
+def _departure_id(departure):
+    return departure['trip_id'], departure['stop']['departure_time']
+
+
+def diff(old, new):
+    """Return the ``diff`` event data turning ``old`` into ``new`` (without
+    ``start_time``), None when they are equal, or False when the departures
+    kept from ``old`` are in another order and only a snapshot will do."""
+    if old == new:
+        return None
+    old_ids = {_departure_id(d): d for d in old}
+    new_ids = {_departure_id(d): d for d in new}
+    kept = [key for key, d in old_ids.items() if new_ids.get(key) == d]
+    if kept != [key for key, d in new_ids.items() if old_ids.get(key) == d]:
+        return False
+    removed = [key for key, d in old_ids.items() if new_ids.get(key) != d]
+    added = [(index, d) for index, d in enumerate(new) if old_ids.get(_departure_id(d)) != d]
+    return {
+        'removed': [{'trip_id': trip_id, 'departure_time': time} for trip_id, time in removed],
+        'added': [{'index': index, 'departure': d} for index, d in added],
+    }
+
+
+class Topic:
+    """The latest result of one subscription key and its recent events."""
+
+    def __init__(self, key, evaluate):
+        self.key = key
+        self.evaluate = evaluate
+        self.subscribers = 0
+        self.seq = 0
+        self._start_time, self._departures = evaluate()
+        self._snapshot = None
+        self._history = deque(maxlen=HISTORY)  # (seq, encoded event)
+        self._changed = threading.Condition()
+        # {future: its event loop} of the subscribers awaiting the next event
+        self._waiters = {}
+
+    def update(self):
+        """Evaluate the key again and publish the change; return whether
+        there was one."""
+        start_time, departures = self.evaluate()
+        change = diff(self._departures, departures)
+        if change is None:
+            with self._changed:
+                self._start_time = start_time
+                self._snapshot = None
+            return False
+        if change is False:
+            encoded = event('snapshot', {'start_time': start_time, 'departures': departures})
+        else:
+            encoded = event('diff', {'start_time': start_time, **change})
+        with self._changed:
+            self._start_time, self._departures = start_time, departures
+            self._snapshot = None
+            self.seq += 1
+            self._history.append((self.seq, encoded.encode()))
+            self._changed.notify_all()
+            waiters, self._waiters = self._waiters, {}
+        for future, loop in waiters.items():
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # the loop is closed
+        return True
+
+    def wait(self, after, timeout):
+        """Return ``(events, seq)``: the encoded events since ``after``, or a
+        snapshot for a new or lagging subscriber (``after`` None or too old),
+        waiting up to ``timeout`` seconds for one."""
+        with self._changed:
+            if after is not None and after == self.seq:
+                self._changed.wait(timeout)
+            return self._events(after)
+
+    async def wait_async(self, after, timeout):
+        """Like ``wait``, but awaits the next event on the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._changed:
+            if after is None or after != self.seq:
+                return self._events(after)
+            future = loop.create_future()
+            self._waiters[future] = loop
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._changed:
+                self._waiters.pop(future, None)
+        with self._changed:
+            return self._events(after)
+
+    def _events(self, after):
+        # Called with the condition held
+        if after is not None and (not self._history or self._history[0][0] <= after + 1):
+            return [encoded for seq, encoded in self._history if seq > after], self.seq
+        if self._snapshot is None:
+            self._snapshot = event('snapshot', {'start_time': self._start_time,
+                                                'departures': self._departures}).encode()
+        return [self._snapshot], self.seq
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Stream:
+    """The encoded events of one subscriber of ``topic``, after ``head``,
+    with keep-alive comments in between.
+
+    Iterating it waits for every event in the calling thread; ``async for``
+    awaits them on the event loop. Closing it unsubscribes and calls
+    ``on_close``.
+    """
+
+    def __init__(self, subscriptions, topic, head='', on_close=None):
+        self.subscriptions = subscriptions
+        self.topic = topic
+        self.on_close = on_close
+        self._head = head.encode()
+        self._seq = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        return self._chunk(*self.topic.wait(self._seq, self.subscriptions.keepalive_seconds))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._closed:
+            raise StopAsyncIteration
+        return self._chunk(*await self.topic.wait_async(self._seq,
+                                                        self.subscriptions.keepalive_seconds))
+
+    def _chunk(self, events, seq):
+        self._seq = seq
+        body = b''.join(events) if events else KEEPALIVE
+        if self._head:
+            body, self._head = self._head + body, b''
+        return body
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.subscriptions.unsubscribe(self.topic)
+        if self.on_close is not None:
+            self.on_close()
+
+    def __del__(self):
+        self.close()
+
+
+class Subscriptions:
+    """The topics of one database's subscriptions, updated by ``tick()``."""
+
+    def __init__(self, pool, max_streams=DEFAULT_MAX_STREAMS,
+                 keepalive_seconds=DEFAULT_KEEPALIVE_SECONDS):
+        self.pool = pool
+        self.max_streams = max_streams
+        self.keepalive_seconds = keepalive_seconds
+        self._topics = {}
+        self._lock = threading.Lock()
+        self._streams = 0
+        self._counts = dict.fromkeys(('ticks', 'evaluations', 'changes', 'errors'), 0)
+        self.error = None
+
+    @classmethod
+    def from_environment(cls, pool):
+        """Configure from ``SUBSCRIPTION_MAX_STREAMS`` and
+        ``SUBSCRIPTION_KEEPALIVE_SECONDS``."""
+        return cls(
+            pool,
+            max_streams=int(os.environ.get('SUBSCRIPTION_MAX_STREAMS', DEFAULT_MAX_STREAMS)),
+            keepalive_seconds=float(os.environ.get('SUBSCRIPTION_KEEPALIVE_SECONDS',
+                                                   DEFAULT_KEEPALIVE_SECONDS)),
+        )
+
+    def subscribe(self, key, evaluate):
+        """Return the topic of ``key``, evaluating ``evaluate()`` (returning
+        ``(start_time, departures)``) for a new one, or None when the stream
+        limit is reached. Each topic returned must be ``unsubscribe``d."""
+        with self._lock:
+            if self._streams >= self.max_streams:
+                return None
+            self._streams += 1
+            topic = self._topics.get(key)
+            if topic is not None:
+                topic.subscribers += 1
+                return topic
+        try:
+            topic = Topic(key, evaluate)
+        except BaseException:
+            with self._lock:
+                self._streams -= 1
+            raise
+        with self._lock:
+            self._counts['evaluations'] += 1
+            topic = self._topics.setdefault(key, topic)
+            topic.subscribers += 1
+        return topic
+
+    def unsubscribe(self, topic):
+        with self._lock:
+            self._streams -= 1
+            topic.subscribers -= 1
+            if topic.subscribers == 0 and self._topics.get(topic.key) is topic:
+                del self._topics[topic.key]
+
+    def stream(self, topic, head='', on_close=None):
+        """Return the ``Stream`` of one subscriber of ``topic``; closing it
+        unsubscribes."""
+        return Stream(self, topic, head, on_close)
+
+    def tick(self):
+        """Evaluate every topic once and publish the changes."""
+        with self._lock:
+            topics = list(self._topics.values())
+            self._counts['ticks'] += 1
+        # Evaluations look up the boards and the backend of this database
+        token = database.use_pool(self.pool)
+        try:
+            for topic in topics:
+                try:
+                    changed = topic.update()
+                except Exception as error:
+                    # The topic keeps its last result until a tick succeeds
+                    with self._lock:
+                        self._counts['errors'] += 1
+                    self.error = f'{type(error).__name__}: {error}'
+                    continue
+                with self._lock:
+                    self._counts['evaluations'] += 1
+                    self._counts['changes'] += changed
+        finally:
+            database.reset_pool(token)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'topics': len(self._topics),
+                'streams': self._streams,
+                'max_streams': self.max_streams,
+                'last_error': self.error,
+                **self._counts,
+            }
+
+
+def _create_subscriptions(conn):
+    subscriptions = Subscriptions.from_environment(database.get_pool())
+    minute_ticker.register(subscriptions)
+    return subscriptions
+
+
+def get_subscriptions():
+    """Return the subscriptions of the current pool, created on first use."""
+    return database.get_pool().shared('subscriptions', _create_subscriptions, lasting=True)
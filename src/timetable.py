@@ -0,0 +1,274 @@
+"""In-memory timetable engine answering departure and trip lookups without SQL.
+
+The timetable does not change within a feed version, so it is loaded once
+into compact array-backed structures:
+
+* stop times in trip order (stop, arrival, departure and sequence arrays),
+  with every trip owning a contiguous slice of them;
+* for every stop, the departures sorted by time (a departure-seconds array
+  and the matching stop-time rows), so "next departures after t" is a bisect;
+* trips as ``__slots__`` records with interned route and headsign strings;
+* the ``variant_stops`` bounding boxes of every variant's remaining path, for
+  the destination-direction filter;
+* the set of services running on every date, from ``service_dates``.
+
+``Timetable`` implements the same lookups as ``models.SqliteBackend``.
+"""
+
+import sys
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from operator import itemgetter
+
+from spatial import box_distance_sq, planar_distance_sq, planar_frame
+from utils import SECONDS_PER_DAY, previous_service_date
+
+# Bit widths used to pack (stop, departure time, row) into one sort key
+TIME_BITS = 18  # seconds up to ~72 hours after the start of the service day
+ROW_BITS = 26
+TIME_MASK = (1 << TIME_BITS) - 1
+ROW_MASK = (1 << ROW_BITS) - 1
+
+
+def service_days(start_sec, service_date, last_departure_sec):
+    """Return the ``(day_offset, date)`` service days to scan from ``start_sec``.
+
+    Trips of the previous service day that run past midnight have departure
+    times from 24:00:00 on, which are ``day_offset`` (86400) seconds after
+    the same moment of ``service_date``. That day is only scanned while a
+    departure of the feed is that late (``last_departure_sec``).
+    """
+    days = [(0, service_date)]
+    if start_sec + SECONDS_PER_DAY <= last_departure_sec:
+        days.append((SECONDS_PER_DAY, previous_service_date(service_date)))
+    return days
+
+
+class TripRecord:
+    __slots__ = ('trip_id', 'route_id', 'trip_headsign', 'service_id',
+                 'direction_id', 'variant_id', 'start', 'end')
+
+    def __init__(self, trip_id, route_id, trip_headsign, service_id, direction_id, variant_id):
+        self.trip_id = trip_id
+        self.route_id = route_id
+        self.trip_headsign = trip_headsign
+        self.service_id = service_id
+        self.direction_id = direction_id
+        self.variant_id = variant_id
+        self.start = self.end = 0  # slice of the trip's stop-time rows
+
+    def __getitem__(self, key):
+        # Lets callers treat records like the sqlite3.Row of the SQL backend
+        return getattr(self, key)
+
+
+class Timetable:
+
+    def __init__(self, stops, trips, stop_times, variant_stops=(), service_dates=()):
+        """Build the engine from iterables of rows.
+
+        ``stops`` yields ``(stop_id, stop_name, stop_lat, stop_lon)``,
+        ``trips`` yields ``(trip_id, route_id, trip_headsign, service_id,
+        direction_id, variant_id)`` and ``stop_times`` yields ``(trip_id,
+        stop_id, stop_sequence, arrival_sec, departure_sec)`` ordered by trip
+        and stop sequence. ``variant_stops`` yields ``(variant_id,
+        stop_sequence, min_lat, max_lat, min_lon, max_lon)`` and
+        ``service_dates`` yields ``(date, service_id)``.
+        """
+        self.stops = []
+        self._stop_pos = {}
+        for stop_id, name, lat, lon in stops:
+            self._stop_pos[stop_id] = len(self.stops)
+            self.stops.append({'stop_id': stop_id, 'stop_name': name,
+                               'stop_lat': lat, 'stop_lon': lon})
+
+        intern = sys.intern
+        self.trips = []
+        self._trip_pos = {}
+        for trip_id, route_id, headsign, service_id, direction_id, variant_id in trips:
+            self._trip_pos[trip_id] = len(self.trips)
+            self.trips.append(TripRecord(
+                intern(trip_id), intern(str(route_id)), intern(headsign or ''),
+                service_id, direction_id, variant_id,
+            ))
+
+        st_trip, st_stop, st_sequence, st_arrival, st_departure = [], [], [], [], []
+        trip_pos = self._trip_pos
+        stop_pos = self._stop_pos
+        current_id = trip = None
+        for trip_id, stop_id, sequence, arrival, departure in stop_times:
+            if trip_id != current_id:
+                current_id = trip_id
+                pos = trip_pos.get(trip_id)
+                trip = self.trips[pos] if pos is not None else None
+                if trip is not None:
+                    trip.start = trip.end = len(st_trip)
+            stop = stop_pos.get(stop_id)
+            if trip is None or stop is None:
+                continue
+            st_trip.append(pos)
+            st_stop.append(stop)
+            st_sequence.append(sequence)
+            st_arrival.append(arrival)
+            st_departure.append(departure)
+            trip.end = len(st_trip)
+        self.st_trip = array('I', st_trip)
+        self.st_stop = array('I', st_stop)
+        self.st_sequence = array('I', st_sequence)
+        self.st_arrival = array('i', st_arrival)
+        self.st_departure = array('i', st_departure)
+        self.last_departure_sec = max(st_departure, default=0)
+
+        # Per-stop departures: rows of stop s are dep_rows[dep_offsets[s]:dep_offsets[s + 1]],
+        # sorted by time, with their departure seconds in dep_secs. Sorting
+        # packed (stop, time, row) integers is much faster than sorting tuples.
+        keys = sorted(
+            (s << (TIME_BITS + ROW_BITS)) | (d << ROW_BITS) | r
+            for r, (s, d) in enumerate(zip(st_stop, st_departure))
+        )
+        self.dep_rows = array('I', (k & ROW_MASK for k in keys))
+        self.dep_secs = array('i', ((k >> ROW_BITS) & TIME_MASK for k in keys))
+        offsets = [0] * (len(self.stops) + 1)
+        for stop in st_stop:
+            offsets[stop + 1] += 1
+        for i in range(len(self.stops)):
+            offsets[i + 1] += offsets[i]
+        self.dep_offsets = array('I', offsets)
+
+        self._remaining_box = {
+            (variant_id, sequence): box for variant_id, sequence, *box in variant_stops
+        }
+        active = {}
+        for date, service_id in service_dates:
+            active.setdefault(date, set()).add(service_id)
+        self._active_services = {date: frozenset(ids) for date, ids in active.items()}
+
+    @classmethod
+    def from_connection(cls, conn):
+        return cls(
+            conn.execute('SELECT stop_id, stop_name, stop_lat, stop_lon FROM stops'),
+            conn.execute('''SELECT trip_id, route_id, trip_headsign, service_id,
+                                   direction_id, variant_id
+                            FROM trips'''),
+            conn.execute('''SELECT t.trip_id, st.stop_id, st.stop_sequence,
+                                   st.arrival_sec, st.departure_sec
+                            FROM stop_times st
+                            JOIN trips t ON t.trip_key = st.trip_key
+                            ORDER BY st.trip_key, st.stop_sequence'''),
+            conn.execute('''SELECT variant_id, stop_sequence, min_lat, max_lat, min_lon, max_lon
+                            FROM variant_stops'''),
+            conn.execute('SELECT date, service_id FROM service_dates'),
+        )
+
+    def stop_position(self, stop_id):
+        """Return the index of a stop in ``stops``, or None."""
+        return self._stop_pos.get(stop_id)
+
+    def trip_position(self, trip_id):
+        """Return the index of a trip in ``trips``, or None."""
+        return self._trip_pos.get(trip_id)
+
+    def active_services(self, service_date):
+        """Return the ids of the services running on a YYYYMMDD date."""
+        return self._active_services.get(service_date, frozenset())
+
+    def memory_footprint(self):
+        """Approximate bytes held by the engine's arrays and records."""
+        arrays = (self.st_trip, self.st_stop, self.st_sequence, self.st_arrival,
+                  self.st_departure, self.dep_rows, self.dep_secs, self.dep_offsets)
+        total = sum(a.itemsize * len(a) for a in arrays)
+        total += sum(sys.getsizeof(t) for t in self.trips)
+        total += sum(sys.getsizeof(s) for s in self.stops)
+        return total
+
+    def get_trip_details(self, trip_id):
+        pos = self.trip_position(trip_id)
+        if pos is None:
+            return None, []
+        trip = self.trips[pos]
+        stop_times = []
+        for row in range(trip.start, trip.end):
+            stop = self.stops[self.st_stop[row]]
+            stop_times.append({
+                'trip_id': trip.trip_id,
+                'arrival_sec': self.st_arrival[row],
+                'departure_sec': self.st_departure[row],
+                'stop_id': stop['stop_id'],
+                'stop_sequence': self.st_sequence[row],
+                'stop_name': stop['stop_name'],
+                'stop_lat': stop['stop_lat'],
+                'stop_lon': stop['stop_lon'],
+            })
+        return trip, stop_times
+
+    def departures(self, stop_ids, start_sec, limit, destination=None, service_date=None):
+        """Return the first ``limit`` departures at or after ``start_sec``.
+
+        Stops are searched in the order given (``rank`` is the position in
+        ``stop_ids``) and each stop's departures in time order. With a
+        ``(lat, lon)`` destination only departures whose remaining path gets
+        closer to it than the departure stop are returned. With a YYYYMMDD
+        ``service_date`` only trips whose service runs that day are returned,
+        together with the previous day's trips still running after midnight;
+        their times are given in seconds from the start of ``service_date``.
+        """
+        return list(self.iter_departures(stop_ids, start_sec, limit, destination, service_date))
+
+    def iter_departures(self, stop_ids, start_sec, limit, destination=None, service_date=None):
+        """Yield the rows of ``departures`` one at a time, as they are found."""
+        frame = planar_frame(*destination) if destination is not None else None
+        if service_date is None:
+            days = [(0, None)]
+        else:
+            # The previous day goes first, so it wins ties like in the SQL query
+            days = [
+                (offset, self.active_services(date))
+                for offset, date in reversed(
+                    service_days(start_sec, service_date, self.last_departure_sec)
+                )
+            ]
+        found = 0
+        for rank, stop_id in enumerate(stop_ids):
+            pos = self.stop_position(stop_id)
+            if pos is None:
+                continue
+            stop_distance = None
+            if frame is not None:
+                stop = self.stops[pos]
+                stop_distance = planar_distance_sq(frame, stop['stop_lat'], stop['stop_lon'])
+            scans = [self._scan_stop(rank, pos, start_sec, offset, active, frame, stop_distance)
+                     for offset, active in days]
+            rows = scans[0] if len(scans) == 1 else merge(*scans, key=itemgetter('departure_sec'))
+            for row in rows:
+                if found >= limit:
+                    return
+                found += 1
+                yield row
+
+    def _scan_stop(self, rank, pos, start_sec, offset, active, frame, stop_distance):
+        # Departures of one stop and service day in time order, shifted by
+        # `offset` onto the requested day
+        lo, hi = self.dep_offsets[pos], self.dep_offsets[pos + 1]
+        for i in range(bisect_left(self.dep_secs, start_sec + offset, lo, hi), hi):
+            row = self.dep_rows[i]
+            trip = self.trips[self.st_trip[row]]
+            if active is not None and trip.service_id not in active:
+                continue
+            if frame is not None:
+                box = self._remaining_box.get((trip.variant_id, self.st_sequence[row]))
+                if box is None or box_distance_sq(frame, *box) >= stop_distance:
+                    continue
+            yield {
+                'rank': rank,
+                'trip_id': trip.trip_id,
+                'arrival_sec': self.st_arrival[row] - offset,
+                'departure_sec': self.st_departure[row] - offset,
+                'route_id': trip.route_id,
+                'trip_headsign': trip.trip_headsign,
+            }
+
+    def departures_batch(self, queries):
+        """``departures`` for many ``(stop_ids, start_sec, limit, destination,
+        service_date)`` queries."""
+        return [self.departures(*query) for query in queries]
@@ -1,9 +1,142 @@
-from math import radians, sin, cos, sqrt, atan2
+from math import radians, sin, cos, sqrt, atan2, asin
+from datetime import date, datetime, timedelta
+
+# NumPy is optional; the batch distance functions fall back to pure Python.
+# It takes ~0.1 s to import, so that is left to the first batch using it.
+np = None
+_numpy_imported = False
+
+EARTH_RADIUS_KM = 6371
+# Batches smaller than this are faster in pure Python than through NumPy
+NUMPY_MIN_BATCH = 32
+# Largest distance the equirectangular approximation is used for by callers
+# that ask for it; within it the error stays below ~1 mm at Wrocław's latitude
+EQUIRECTANGULAR_MAX_KM = 2.0
+SECONDS_PER_DAY = 86400
+WALKING_SPEED_KMH = 4.5
 
 def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Earth radius in km
+    R = EARTH_RADIUS_KM
     dlat = radians(lat2 - lat1)
     dlon = radians(lon2 - lon1)
     a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
     c = 2 * atan2(sqrt(a), sqrt(1-a))
     return R * c
+
+def walking_seconds(distance_km):
+    return round(distance_km * 3600 / WALKING_SPEED_KMH)
+
+def parse_gtfs_time(value):
+    # GTFS times may exceed 24:00:00 for trips running past midnight
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def format_gtfs_time(seconds):
+    return f'{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}'
+
+def parse_iso_datetime(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def time_of_day_seconds(timestamp):
+    moment = parse_iso_datetime(timestamp)
+    return moment.hour * 3600 + moment.minute * 60 + moment.second
+
+def service_date(timestamp):
+    # Calendar dates are stored as YYYYMMDD integers, as in the GTFS files
+    moment = parse_iso_datetime(timestamp)
+    return moment.year * 10000 + moment.month * 100 + moment.day
+
+def previous_service_date(value):
+    day = date(value // 10000, value // 100 % 100, value % 100) - timedelta(days=1)
+    return day.year * 10000 + day.month * 100 + day.day
+
+def format_service_time(day, seconds):
+    """ISO timestamp of ``seconds`` after the start of service day ``day`` (YYYY-MM-DD).
+
+    ``seconds`` may fall past midnight (or, for a previous day's trip, before
+    it); the date is rolled over accordingly.
+    """
+    if 0 <= seconds < SECONDS_PER_DAY:
+        return f'{day}T{format_gtfs_time(seconds)}Z'
+    moment = date.fromisoformat(day) + timedelta(days=seconds // SECONDS_PER_DAY)
+    return f'{moment.isoformat()}T{format_gtfs_time(seconds % SECONDS_PER_DAY)}Z'
+
+def _pairs(lat, lon, lats, lons):
+    # Radians of both ends of every pairwise distance
+    return (tuple(map(radians, p)) for p in zip(lat, lon, lats, lons))
+
+def numpy_available():
+    """Import NumPy on first use; return whether it is installed."""
+    global np, _numpy_imported
+    if not _numpy_imported:
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+        _numpy_imported = True
+    return np is not None
+
+def _use_numpy(use_numpy, lats):
+    if use_numpy is None:
+        return len(lats) >= NUMPY_MIN_BATCH and numpy_available()
+    if use_numpy and not numpy_available():
+        raise RuntimeError('NumPy is not installed')
+    return use_numpy
+
+def _numpy_radians(lat, lon, lats, lons):
+    return (np.radians(lat), np.radians(lon),
+            np.radians(np.asarray(lats, dtype=float)), np.radians(np.asarray(lons, dtype=float)))
+
+def haversine_many(lat, lon, lats, lons, use_numpy=None):
+    """Great-circle distances in km from ``(lat, lon)`` to every ``(lats[i], lons[i])``.
+
+    ``lat`` and ``lon`` may be a single point or sequences as long as ``lats``,
+    giving pairwise distances. Returns a NumPy array when NumPy is installed
+    and the batch is large enough (or ``use_numpy`` is true), else a list.
+    """
+    if _use_numpy(use_numpy, lats):
+        lat1, lon1, lat2, lon2 = _numpy_radians(lat, lon, lats, lons)
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    diameter = 2 * EARTH_RADIUS_KM
+    if isinstance(lat, (int, float)):
+        # One origin: its radians and cosine are computed once
+        lat1, lon1 = radians(lat), radians(lon)
+        cos_lat1 = cos(lat1)
+        return [
+            diameter * asin(sqrt(min(
+                sin((radians(a) - lat1) / 2) ** 2
+                + cos_lat1 * cos(radians(a)) * sin((radians(b) - lon1) / 2) ** 2, 1.0
+            )))
+            for a, b in zip(lats, lons)
+        ]
+    return [
+        diameter * asin(sqrt(min(
+            sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2, 1.0
+        )))
+        for lat1, lon1, lat2, lon2 in _pairs(lat, lon, lats, lons)
+    ]
+
+def equirectangular_many(lat, lon, lats, lons, use_numpy=None):
+    """Like ``haversine_many`` but with the equirectangular approximation.
+
+    Longitude differences are scaled by the cosine of the mean latitude and
+    the result is a plane distance, which skips the trigonometry of haversine
+    at the cost of an error that grows with distance (see
+    ``EQUIRECTANGULAR_MAX_KM``).
+    """
+    if _use_numpy(use_numpy, lats):
+        lat1, lon1, lat2, lon2 = _numpy_radians(lat, lon, lats, lons)
+        x = (lon2 - lon1) * np.cos((lat1 + lat2) / 2)
+        return EARTH_RADIUS_KM * np.hypot(x, lat2 - lat1)
+    if isinstance(lat, (int, float)):
+        lat1, lon1 = radians(lat), radians(lon)
+        return [
+            EARTH_RADIUS_KM * sqrt(((radians(b) - lon1) * cos((lat1 + radians(a)) / 2)) ** 2
+                                   + (radians(a) - lat1) ** 2)
+            for a, b in zip(lats, lons)
+        ]
+    return [
+        EARTH_RADIUS_KM * sqrt(((lon2 - lon1) * cos((lat1 + lat2) / 2)) ** 2 + (lat2 - lat1) ** 2)
+        for lat1, lon1, lat2, lon2 in _pairs(lat, lon, lats, lons)
+    ]
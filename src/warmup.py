@@ -0,0 +1,106 @@
+"""Startup warm-up: building the shared objects in a background thread.
+
+By default the stop index, the timetable, the footpaths and the journey
+planner are built by the first request that needs each of them, and that
+request waits for the build. With ``WARMUP=background`` the server starts
+listening right away and a background thread builds them, cheapest first
+(``models.warmup_steps()``). Until an object is built, the lookups that have
+an SQL path take it instead of waiting: nearest stops are found by scanning
+the ``stops`` table, and departures and trip details come from SQLite even
+with ``TIMETABLE_BACKEND=memory``. Journeys have no SQL path and wait for
+the planner.
+
+The warm-up covers the process-wide pool; other cities are still opened on
+their first request (see ``cities.py``). ``/healthz`` answers as soon as the
+process serves requests, ``/readyz`` only once the warm-up has finished.
+"""
+
+import os
+import threading
+import time
+
+import database
+import models
+
+MODES = ('lazy', 'background')
+
+
+class Warmup:
+    """Builds the shared objects of ``pool`` in a thread of its own.
+
+    ``steps`` are ``(name, build)`` pairs as taken by ``ConnectionPool.shared``.
+    """
+
+    def __init__(self, pool, steps):
+        self.pool = pool
+        self.steps = list(steps)
+        self.seconds = {}
+        self.error = None
+        self._started = None
+        self._done = threading.Event()
+
+    def start(self):
+        # Deferred before the thread exists, so no request can start a build first
+        self.pool.defer_builds = True
+        self._started = time.perf_counter()
+        threading.Thread(target=self._run, name='warmup', daemon=True).start()
+        return self
+
+    def _run(self):
+        # Builds that need other shared objects look them up in this pool
+        token = database.use_pool(self.pool)
+        try:
+            for name, build in self.steps:
+                started = time.perf_counter()
+                self.pool.shared(name, build)
+                self.seconds[name] = round(time.perf_counter() - started, 3)
+        except Exception as error:
+            # Requests build what is missing themselves, as without a warm-up
+            self.error = f'{type(error).__name__}: {error}'
+        finally:
+            self.pool.defer_builds = False
+            database.reset_pool(token)
+            self.seconds['total'] = round(time.perf_counter() - self._started, 3)
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Wait until the warm-up has finished; return whether it has."""
+        return self._done.wait(timeout)
+
+    @property
+    def ready(self):
+        return self._done.is_set() and self.error is None
+
+    def stats(self):
+        if not self._done.is_set():
+            state = 'running'
+        else:
+            state = 'failed' if self.error is not None else 'done'
+        return {'state': state, 'seconds': dict(self.seconds), 'error': self.error}
+
+
+_current = None
+
+
+def mode():
+    value = os.environ.get('WARMUP', 'lazy')
+    if value not in MODES:
+        raise ValueError(f'Unknown WARMUP mode {value!r}, expected one of {MODES}')
+    return value
+
+
+def start():
+    """Start the warm-up of the process-wide pool when ``WARMUP=background``;
+    return it, or None."""
+    global _current
+    if mode() != 'background':
+        return None
+    _current = Warmup(database.get_pool(), models.warmup_steps()).start()
+    return _current
+
+
+def status():
+    """Return ``(ready, details)`` of the current warm-up; ready without one."""
+    if _current is None or _current.pool is not database.get_pool():
+        return True, {'state': 'lazy'}
+    return _current.ready, _current.stats()
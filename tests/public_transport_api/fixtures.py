@@ -0,0 +1,74 @@
+"""A tiny GTFS feed shared by the service tests."""
+
+import csv
+import os
+
+from gtfs_import import import_feed
+
+FEED = {
+    "stops.txt": [
+        ["stop_id", "stop_code", "stop_name", "stop_lat", "stop_lon"],
+        [1, 101, "Plac Grunwaldzki", 51.1092, 17.0415],
+        [2, 102, "Renoma", 51.1040, 17.0280],
+        [3, 103, "Dominikański", 51.1099, 17.0335],
+        [4, 104, "Krzyki", 51.0740, 17.0070],
+    ],
+    "trips.txt": [
+        ["route_id", "service_id", "trip_id", "trip_headsign", "direction_id",
+         "shape_id", "brigade_id", "vehicle_id", "variant_id"],
+        ["A", 6, "6_100", "KRZYKI", 0, 900, 1, 1, 900],
+        ["A", 6, "6_101", "KRZYKI", 0, 900, 2, 1, 900],
+        ["A", 7, "7_190", "KRZYKI", 0, 900, 2, 1, 900],  # night trip, past midnight
+        ["D", 6, "6_200", "PLAC GRUNWALDZKI", 1, 901, 3, 1, 901],
+    ],
+    "stop_times.txt": [
+        ["trip_id", "arrival_time", "departure_time", "stop_id", "stop_sequence",
+         "pickup_type", "drop_off_type"],
+        ["6_100", "08:00:00", "08:00:00", 1, 0, 0, 0],
+        ["6_100", "08:04:00", "08:05:00", 3, 1, 0, 0],
+        ["6_100", "08:09:00", "08:10:00", 2, 2, 0, 0],
+        ["6_100", "08:30:00", "08:30:00", 4, 3, 0, 0],
+        ["6_101", "08:20:00", "08:20:00", 1, 0, 0, 0],
+        ["6_101", "08:24:00", "08:25:00", 3, 1, 0, 0],
+        ["6_101", "08:29:00", "08:30:00", 2, 2, 0, 0],
+        ["6_101", "08:50:00", "08:50:00", 4, 3, 0, 0],
+        ["7_190", "24:50:00", "24:50:00", 1, 0, 0, 0],
+        ["7_190", "24:54:00", "24:55:00", 3, 1, 0, 0],
+        ["7_190", "24:59:00", "25:00:00", 2, 2, 0, 0],
+        ["7_190", "25:20:00", "25:20:00", 4, 3, 0, 0],
+        ["6_200", "08:40:00", "08:40:00", 4, 0, 0, 0],
+        ["6_200", "09:00:00", "09:00:00", 2, 1, 0, 0],
+        ["6_200", "09:05:00", "09:05:00", 3, 2, 0, 0],
+        ["6_200", "09:10:00", "09:10:00", 1, 3, 0, 0],
+    ],
+    "calendar.txt": [
+        ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday",
+         "saturday", "sunday", "start_date", "end_date"],
+        [6, 1, 1, 1, 1, 0, 0, 0, 20250322, 20250406],
+        [7, 0, 1, 0, 0, 0, 0, 0, 20250322, 20250406],
+    ],
+    "calendar_dates.txt": [
+        ["service_id", "date", "exception_type"],
+        [6, 20250403, 2],  # not on Thursday 3 April
+        [6, 20250405, 1],  # but on Saturday 5 April
+    ],
+    "feed_info.txt": [
+        ["feed_publisher_name", "feed_publisher_url", "feed_lang",
+         "feed_start_date", "feed_end_date"],
+        ["UM Wrocław", "http://www.wroclaw.pl/urzad", "pl", 20250322, 20250406],
+    ],
+}
+
+
+def write_feed(directory, feed=FEED):
+    for name, rows in feed.items():
+        with open(os.path.join(directory, name), "w", encoding="utf-8-sig", newline="") as f:
+            csv.writer(f).writerows(rows)
+
+
+def create_database(path):
+    """Import the fixture feed into a new database at ``path``."""
+    gtfs_dir = os.path.join(os.path.dirname(path), "gtfs")
+    os.makedirs(gtfs_dir, exist_ok=True)
+    write_feed(gtfs_dir)
+    import_feed(gtfs_dir, path, verbose=False)
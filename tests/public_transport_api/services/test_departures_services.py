@@ -1,13 +1,135 @@
+import os
+import tempfile
 import unittest
-from unittest.mock import patch
+
+import database
+import models
+from tests.public_transport_api.fixtures import create_database
 
 
 class TestDeparturesService(unittest.TestCase):
 
-    # TODO replace with actual tests implementation
-    @patch('public_transport_api.services.departures_service.sqlite3.connect')
-    def test_get_closest_departures_success(self, mock_connect):
-        pass
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(self.db_path)
+        database.configure(self.db_path)
+
+    def tearDown(self):
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def closest(self, start_time, limit=3):
+        # Start next to Plac Grunwaldzki, heading towards Krzyki
+        return models.get_closest_departures(
+            51.1093, 17.0414, 51.0740, 17.0070, start_time, limit
+        )
+
+    def test_get_closest_departures_success(self):
+        departures = self.closest('2025-04-02T08:10:00Z')
+        self.assertEqual(
+            [(d['trip_id'], d['stop']['name'], d['stop']['departure_time']) for d in departures],
+            [
+                ('6_101', 'Plac Grunwaldzki', '2025-04-02T08:20:00Z'),
+                ('6_101', 'Dominikański', '2025-04-02T08:25:00Z'),
+                ('6_100', 'Renoma', '2025-04-02T08:10:00Z'),
+            ],
+        )
+        self.assertEqual(departures[0]['route_id'], 'A')
+        self.assertEqual(departures[0]['trip_headsign'], 'KRZYKI')
+        self.assertEqual(
+            departures[0]['stop']['coordinates'], {'latitude': 51.1092, 'longitude': 17.0415}
+        )
+
+    def test_get_closest_departures_respects_limit_and_time(self):
+        self.assertEqual(len(self.closest('2025-04-02T07:00:00Z', limit=5)), 5)
+        self.assertEqual(self.closest('2025-04-03T02:00:00Z'), [])
+        self.assertEqual(self.closest('2025-04-02T08:00:00Z', limit=0), [])
+
+    def test_only_trips_running_on_the_requested_date(self):
+        # Service 6 runs Monday to Thursday, except on 3 April and also on 5 April
+        self.assertEqual(self.closest('2025-04-03T08:00:00Z'), [])  # Thursday, removed
+        self.assertEqual(self.closest('2025-04-04T08:00:00Z'), [])  # Friday
+        self.assertEqual(self.closest('2025-05-05T08:00:00Z'), [])  # after the calendar
+        saturday = self.closest('2025-04-05T08:10:00Z')
+        self.assertEqual([d['trip_id'] for d in saturday], ['6_101', '6_101', '6_100'])
+        self.assertEqual(saturday[0]['stop']['departure_time'], '2025-04-05T08:20:00Z')
+
+    def test_night_trips_run_past_midnight(self):
+        # Service 7 runs on Tuesdays, its trip leaves at 24:50:00
+        evening = self.closest('2025-04-01T23:00:00Z')
+        self.assertEqual(
+            [(d['trip_id'], d['stop']['arrival_time'], d['stop']['departure_time'])
+             for d in evening],
+            [('7_190', '2025-04-02T00:50:00Z', '2025-04-02T00:50:00Z'),
+             ('7_190', '2025-04-02T00:54:00Z', '2025-04-02T00:55:00Z'),
+             ('7_190', '2025-04-02T00:59:00Z', '2025-04-02T01:00:00Z')],
+        )
+        # After midnight the previous service day's night trip comes first
+        after_midnight = self.closest('2025-04-02T00:45:00Z')
+        self.assertEqual(
+            [(d['trip_id'], d['stop']['departure_time']) for d in after_midnight],
+            [('7_190', '2025-04-02T00:50:00Z'), ('6_100', '2025-04-02T08:00:00Z'),
+             ('6_101', '2025-04-02T08:20:00Z')],
+        )
+        # Not after Friday 4 April, when service 7 does not run
+        saturday = self.closest('2025-04-05T00:45:00Z')
+        self.assertEqual(saturday[0]['stop']['departure_time'], '2025-04-05T08:00:00Z')
+
+    def test_only_departures_heading_towards_destination(self):
+        # Line D runs from Krzyki to Plac Grunwaldzki, line A the other way
+        towards_grunwaldzki = models.get_closest_departures(
+            51.0741, 17.0071, 51.1092, 17.0415, '2025-04-02T08:00:00Z', 10
+        )
+        self.assertEqual(
+            [(d['trip_id'], d['stop']['name']) for d in towards_grunwaldzki],
+            [('6_200', 'Krzyki'), ('6_200', 'Renoma'), ('6_200', 'Dominikański')],
+        )
+        # Departures from the last stop of a trip never head anywhere
+        towards_krzyki = self.closest('2025-04-02T08:00:00Z', limit=20)
+        self.assertNotIn('6_200', {d['trip_id'] for d in towards_krzyki})
+        self.assertNotIn('Krzyki', {d['stop']['name'] for d in towards_krzyki})
+
+    def test_batch_matches_single_requests_in_order(self):
+        requests = [
+            (51.1093, 17.0414, 51.0740, 17.0070, '2025-04-02T08:10:00Z', 3),
+            (51.0741, 17.0071, 51.1092, 17.0415, '2025-04-02T08:00:00Z', 10),
+            (51.1093, 17.0414, 51.0740, 17.0070, '2025-04-02T08:00:00Z', 1),
+            (51.1093, 17.0414, 51.0740, 17.0070, '2025-04-02T08:10:00Z', 0),
+            (51.1093, 17.0414, 51.0740, 17.0070, '2025-04-02T00:45:00Z', 4),
+        ]
+        self.assertEqual(
+            models.get_closest_departures_batch(requests),
+            [models.get_closest_departures(*request) for request in requests],
+        )
+        self.assertEqual(models.get_closest_departures_batch([]), [])
+
+    def test_departure_lookup_uses_index(self):
+        plan = database.get_db_connection().execute(
+            'EXPLAIN QUERY PLAN ' + models._departures_query(2), [1, 0, 2, 1, 0, 3, 3]
+        ).fetchall()
+        details = ' '.join(row[-1] for row in plan)
+        self.assertIn('idx_stop_times_stop_departure', details)
+
+    def test_heading_lookup_scans_departures_in_index_order(self):
+        plan = database.get_db_connection().execute(
+            'EXPLAIN QUERY PLAN ' + models._departures_query(1, heading=True),
+            [1, 0, 0.001, 51.07, 17.0, 0.63, 0, 3, 3],
+        ).fetchall()
+        # Only the final ordering of the (at most `limit`) rows may need a sort
+        details = [row[-1] for row in plan]
+        self.assertIn('idx_stop_times_stop_departure', ' '.join(details))
+        self.assertEqual(details.count('USE TEMP B-TREE FOR ORDER BY'), 1)
+
+    def test_service_day_check_is_a_primary_key_lookup(self):
+        # Today and the previous day's trips past midnight
+        plan = database.get_db_connection().execute(
+            'EXPLAIN QUERY PLAN ' + models._departures_query(1, heading=True, service_days=2),
+            [1, 0, 0.001, 51.07, 17.0, 0.63, 0, 20250402, 86400, 20250401, 0, 3, 3],
+        ).fetchall()
+        details = [row[-1] for row in plan]
+        self.assertIn('SEARCH sd USING PRIMARY KEY (date=? AND service_id=?)', details)
+        self.assertEqual(details.count('USE TEMP B-TREE FOR ORDER BY'), 1)
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,14 +1,56 @@
+import os
+import tempfile
+import threading
 import unittest
-from unittest.mock import patch
-
 
+import database
+import models
+from tests.public_transport_api.fixtures import create_database
 
 
 class TestGetTripDetails(unittest.TestCase):
-    # TODO replace with actual tests implementation
-    @patch('public_transport_api.services.trips_service.sqlite3.connect')
-    def test_get_trip_details_success(self, mock_connect):
-        pass
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(self.db_path)
+        database.configure(self.db_path)
+
+    def tearDown(self):
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def test_get_trip_details_success(self):
+        trip, stops = models.get_trip_details('6_100')
+        self.assertEqual((trip['route_id'], trip['trip_headsign']), ('A', 'KRZYKI'))
+        self.assertEqual(
+            [(stop['stop_name'], stop['arrival_sec'], stop['departure_sec']) for stop in stops],
+            [
+                ('Plac Grunwaldzki', 28800, 28800),
+                ('Dominikański', 29040, 29100),
+                ('Renoma', 29340, 29400),
+                ('Krzyki', 30600, 30600),
+            ],
+        )
+
+    def test_get_trip_details_unknown_trip(self):
+        trip, stops = models.get_trip_details('does-not-exist')
+        self.assertIsNone(trip)
+        self.assertEqual(stops, [])
+
+    def test_connections_are_pooled_per_thread(self):
+        models.get_trip_details('6_100')
+        models.get_trip_details('6_101')
+        worker = threading.Thread(target=models.get_trip_details, args=('6_200',))
+        worker.start()
+        worker.join()
+
+        stats = database.pool_stats()
+        self.assertEqual(stats['connections_opened'], 2)
+        self.assertEqual(stats['checkouts'], 3)
+        conn = database.get_db_connection()
+        self.assertIs(conn, database.get_db_connection())
+        self.assertEqual(conn.execute('PRAGMA query_only').fetchone()[0], 1)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,198 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import app as app_module
+import database
+import instrumentation
+from app import MAX_LIMIT, app, departures_cache, trip_details_cache
+from tests.public_transport_api.fixtures import create_database
+
+
+class TestEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(db_path)
+        database.configure(db_path)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        for cache in (departures_cache, trip_details_cache):
+            cache.clear()
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def test_trip_details_body(self):
+        response = self.client.get('/public_transport/city/wroclaw/trip/6_100')
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.data)
+        self.assertEqual(body['metadata'], {
+            'self': '/public_transport/city/wroclaw/trip/6_100',
+            'city': 'wroclaw',
+            'query_parameters': {'trip_id': '6_100'},
+        })
+        self.assertEqual(body['trip_details']['trip_headsign'], 'KRZYKI')
+        self.assertEqual(
+            [stop['departure_time'] for stop in body['trip_details']['stops']],
+            ['2025-04-02T08:00:00Z', '2025-04-02T08:05:00Z',
+             '2025-04-02T08:10:00Z', '2025-04-02T08:30:00Z'],
+        )
+
+    def test_trip_details_past_midnight_roll_over_the_date(self):
+        # Trip details are given on the 2 April service day
+        response = self.client.get('/public_transport/city/wroclaw/trip/7_190')
+        stops = json.loads(response.data)['trip_details']['stops']
+        self.assertEqual([stop['departure_time'] for stop in stops],
+                         ['2025-04-03T00:50:00Z', '2025-04-03T00:55:00Z',
+                          '2025-04-03T01:00:00Z', '2025-04-03T01:20:00Z'])
+
+    def test_repeat_lookup_is_cached_and_revalidated_with_etag(self):
+        url = '/public_transport/city/wroclaw/trip/6_100'
+        first = self.client.get(url)
+        self.assertTrue(first.cache_control.immutable)
+        etag, weak = first.get_etag()
+        self.assertFalse(weak)
+
+        hits = trip_details_cache.stats()['hits']
+        second = self.client.get(url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(trip_details_cache.stats()['hits'], hits + 1)
+
+        revalidated = self.client.get(url, headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.data, b'')
+        self.assertEqual(revalidated.get_etag(), (etag, False))
+
+        other = self.client.get('/public_transport/city/wroclaw/trip/6_101')
+        self.assertNotEqual(other.get_etag()[0], etag)
+
+    def test_unknown_trip(self):
+        response = self.client.get('/public_transport/city/wroclaw/trip/missing')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(trip_details_cache.stats()['entries'], 0)
+
+    def test_departures_stream_as_ndjson(self):
+        url = ('/public_transport/city/wroclaw/closest_departures?start_coordinates=51.1093,17.0414'
+               '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T08:10:00Z&limit=3')
+        expected = json.loads(self.client.get(url).data)
+        departures_cache.clear()
+
+        for headers, query in (({}, '&format=ndjson'), ({'Accept': 'application/x-ndjson'}, '')):
+            # The first request computes while streaming, the second replays the cache
+            response = self.client.get(url + query, headers=headers)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            lines = [json.loads(line) for line in response.data.decode().splitlines()]
+            self.assertEqual(lines[0]['metadata']['query_parameters'],
+                             expected['metadata']['query_parameters'])
+            self.assertEqual(lines[1:], expected['departures'])
+        self.assertEqual(departures_cache.stats()['entries'], 1)
+
+    def test_journeys(self):
+        url = ('/public_transport/city/wroclaw/journeys?start_coordinates=51.1093,17.0414'
+               '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T07:55:00Z')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.data)
+        self.assertEqual(body['metadata']['query_parameters']['start_time'],
+                         '2025-04-02T07:55:00Z')
+        self.assertEqual([leg['mode'] for leg in body['journeys'][0]['legs']],
+                         ['walk', 'transit'])
+        friday = self.client.get(url.replace('2025-04-02', '2025-04-04'))
+        self.assertEqual(json.loads(friday.data)['journeys'], [])
+        self.assertEqual(self.client.get(url.split('?')[0]).status_code, 400)
+
+    def test_batch_departures_in_request_order(self):
+        queries = [
+            {'start_coordinates': '51.0741,17.0071', 'end_coordinates': '51.1092,17.0415',
+             'start_time': '2025-04-02T08:00:00Z', 'limit': 2},
+            {'start_coordinates': '51.1093,17.0414', 'end_coordinates': '51.0740,17.0070',
+             'start_time': '2025-04-02T08:10:00Z'},
+        ]
+        response = self.client.post(
+            '/public_transport/city/wroclaw/closest_departures/batch', json={'queries': queries}
+        )
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['results']
+        self.assertEqual([r['query_parameters']['limit'] for r in results], [2, 3])
+        self.assertEqual([d['trip_id'] for d in results[0]['departures']], ['6_200', '6_200'])
+        self.assertEqual([d['trip_id'] for d in results[1]['departures']],
+                         ['6_101', '6_101', '6_100'])
+
+    def test_batch_rejects_malformed_queries(self):
+        url = '/public_transport/city/wroclaw/closest_departures/batch'
+        self.assertEqual(self.client.post(url, json={'queries': [{}]}).status_code, 400)
+        self.assertEqual(self.client.post(url, data='nope').status_code, 400)
+
+    def test_invalid_parameters_are_bad_requests(self):
+        url = '/public_transport/city/wroclaw/closest_departures?end_coordinates=51.0740,17.0070'
+        for query in ('&start_coordinates=51.1093,17.0414&start_time=yesterday',
+                      '&start_coordinates=51.1093&start_time=2025-04-02T08:10:00Z',
+                      '&start_coordinates=51.1093,17.0414&start_time=2025-04-02T08:10:00Z'
+                      '&limit=many'):
+            response = self.client.get(url + query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn('error', json.loads(response.data))
+
+    def test_limits_out_of_range_are_bad_requests(self):
+        url = ('/public_transport/city/wroclaw/closest_departures?start_coordinates=51.1093,17.0414'
+               '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T08:10:00Z&limit=')
+        for limit in ('0', '-1', str(MAX_LIMIT + 1), '99999999999999999999'):
+            response = self.client.get(url + limit)
+            self.assertEqual(response.status_code, 400, limit)
+            self.assertEqual(json.loads(response.data), {'error': 'Invalid limit'})
+        for limit in (1, MAX_LIMIT):
+            self.assertEqual(self.client.get(url + str(limit)).status_code, 200)
+        board = '/public_transport/city/wroclaw/stop/1/departures?limit='
+        self.assertEqual(self.client.get(board + '0').status_code, 400)
+        self.assertEqual(self.client.get(board + str(MAX_LIMIT)).status_code, 200)
+
+    def test_non_finite_and_out_of_range_coordinates_are_bad_requests(self):
+        url = ('/public_transport/city/wroclaw/closest_departures?end_coordinates=51.0740,17.0070'
+               '&start_time=2025-04-02T08:10:00Z&start_coordinates=')
+        batch_url = '/public_transport/city/wroclaw/closest_departures/batch'
+        for coordinates in ('nan,17', '51.1,inf', '-inf,17', '91,17', '51.1,180.5'):
+            response = self.client.get(url + coordinates)
+            self.assertEqual(response.status_code, 400, coordinates)
+            self.assertEqual(json.loads(response.data),
+                             {'error': 'Invalid start_coordinates'})
+            query = {'start_coordinates': coordinates, 'end_coordinates': '51.0740,17.0070',
+                     'start_time': '2025-04-02T08:10:00Z'}
+            response = self.client.post(batch_url, json={'queries': [query]})
+            self.assertEqual(response.status_code, 400, coordinates)
+
+    def test_unexpected_errors_are_server_errors(self):
+        instrumentation.reset_metrics()
+        url = ('/public_transport/city/wroclaw/closest_departures?start_coordinates=51.1093,17.0414'
+               '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T08:10:00Z')
+        with mock.patch.object(app_module, 'get_closest_departures',
+                               side_effect=KeyError('stop_lat')):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.data), {'error': 'Internal server error'})
+        self.assertIn('http_request_errors_total{endpoint="closest_departures"} 1',
+                      self.client.get('/metrics').data.decode())
+
+    def test_metrics_and_server_timing(self):
+        instrumentation.reset_metrics()
+        response = self.client.get(
+            '/public_transport/city/wroclaw/closest_departures?start_coordinates=51.1093,17.0414'
+            '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T08:10:00Z'
+        )
+        spans = [part.split(';')[0] for part in response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(spans, ['stop_lookup', 'query', 'materialize', 'serialize', 'total'])
+
+        metrics = self.client.get('/metrics')
+        self.assertEqual(metrics.mimetype, 'text/plain')
+        lines = metrics.data.decode().splitlines()
+        self.assertIn('http_request_duration_seconds_count'
+                      '{endpoint="closest_departures",status="200"} 1', lines)
+        self.assertIn('request_span_duration_seconds_count'
+                      '{endpoint="closest_departures",span="materialize"} 1', lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import database
+import models
+from app import app
+import boards
+from boards import DepartureBoards
+from tests.public_transport_api.fixtures import create_database
+from utils import service_date, time_of_day_seconds
+
+BOARD_URL = '/public_transport/city/wroclaw/stop/{}/departures'
+
+
+class Clock:
+
+    def __init__(self, moment):
+        self.moment = moment
+
+    def __call__(self):
+        return self.moment
+
+
+def expected_departures(stop_id, start_time, limit):
+    stop = models.get_stop_index().get(stop_id)
+    rows = models.get_backend().departures(
+        [stop_id], time_of_day_seconds(start_time), limit, service_date=service_date(start_time)
+    )
+    return [json.loads(json.dumps(models._departure(row, stop, start_time))) for row in rows]
+
+
+class TestDepartureBoards(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(db_path)
+        database.configure(db_path)
+        self.clock = Clock(datetime(2025, 4, 2, 8, 3, 27))
+        self.boards = DepartureBoards(clock=self.clock)
+
+    def tearDown(self):
+        models.set_backend('sqlite')
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def departures(self, *args, **kwargs):
+        start_time, payload = self.boards.departures(*args, **kwargs)
+        return start_time, json.loads(payload)
+
+    def test_boards_match_the_backend(self):
+        for backend in models.BACKENDS:
+            models.set_backend(backend)
+            self.boards = DepartureBoards(clock=self.clock)
+            for stop_id in (1, 2, 3, 4):
+                for start_time in ('2025-04-02T00:00:00Z', '2025-04-02T00:45:00Z',
+                                   '2025-04-02T08:05:00Z', '2025-04-02T08:21:00Z',
+                                   '2025-04-02T23:59:00Z', '2025-04-03T00:52:00Z',
+                                   '2025-04-05T08:00:00Z'):
+                    for limit in (0, 1, 3, 20):
+                        self.assertEqual(
+                            self.departures(stop_id, limit, start_time),
+                            (start_time, expected_departures(stop_id, start_time, limit)),
+                        )
+
+    def test_current_minute_is_served_from_the_cursor(self):
+        start_time, departures = self.departures(1, 2)
+        self.assertEqual(start_time, '2025-04-02T08:03:00Z')
+        self.assertEqual([d['trip_id'] for d in departures], ['6_101', '6_200'])
+        first = self.boards.departures(1, 2)[1]
+        self.assertIs(self.boards.departures(1, 2)[1], first)
+
+        # The ticker moves the cursor; the serialized slice is made again
+        self.clock.moment = datetime(2025, 4, 2, 8, 25, 5)
+        self.boards.tick()
+        self.assertEqual(self.boards.stats()['minute'], ['2025-04-02', 8 * 3600 + 25 * 60])
+        start_time, departures = self.departures(1, 2)
+        self.assertEqual(start_time, '2025-04-02T08:25:00Z')
+        self.assertEqual([d['trip_id'] for d in departures], ['6_200'])
+        # A request can come before the tick of its minute
+        self.clock.moment = datetime(2025, 4, 2, 9, 11)
+        self.assertEqual(self.departures(1, 2)[1], [])
+        stats = self.boards.stats()
+        self.assertEqual((stats['builds'], stats['boards'], stats['ticks']), (1, 1, 3))
+
+    def test_a_tick_during_a_request_does_not_serve_its_minute_later(self):
+        self.clock.moment = datetime(2025, 4, 2, 8, 19)
+        real_slice = boards._Board.slice
+
+        def slice_then_tick(board, sec, limit):
+            departures = real_slice(board, sec, limit)
+            # The ticker moves on while the 08:19 request serializes its slice
+            self.clock.moment = datetime(2025, 4, 2, 8, 21)
+            self.boards.tick()
+            return departures
+
+        with mock.patch('boards._Board.slice', slice_then_tick):
+            start_time, departures = self.departures(1, 2)
+        self.assertEqual(start_time, '2025-04-02T08:19:00Z')
+        self.assertEqual([d['trip_id'] for d in departures], ['6_101', '6_200'])
+        start_time, departures = self.departures(1, 2)
+        self.assertEqual(start_time, '2025-04-02T08:21:00Z')
+        self.assertEqual(departures, expected_departures(1, start_time, 2))
+        self.assertEqual([d['trip_id'] for d in departures], ['6_200'])
+
+    def test_past_and_idle_boards_are_dropped(self):
+        self.boards.departures(1, 2)
+        self.boards.departures(2, 2, '2025-04-05T08:00:00Z')
+        self.assertEqual(self.boards.stats()['boards'], 2)
+        self.clock.moment = datetime(2025, 4, 3, 0, 1)
+        self.boards.tick()
+        self.assertEqual(self.boards.stats()['boards'], 1)
+        with mock.patch('boards.time.monotonic', return_value=10**9):
+            self.boards.tick('2025-04-03T00:02:00Z')
+        self.assertEqual(self.boards.stats()['boards'], 0)
+
+    def test_new_feed_version_drops_the_boards(self):
+        self.boards.departures(1, 2)
+        self.clock.moment = datetime(2025, 4, 2, 8, 4)
+        with mock.patch.object(models, 'get_feed_version', return_value='2:new'):
+            self.boards.departures(2, 2)
+        self.assertEqual(self.boards.stats()['boards'], 1)
+
+    def test_unknown_stop(self):
+        self.assertIsNone(self.boards.departures(99, 2))
+
+
+class TestDepartureBoardEndpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(db_path)
+        database.configure(db_path)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def test_board_body(self):
+        response = self.client.get(BOARD_URL.format(3) + '?start_time=2025-04-02T08:04:30Z&limit=1')
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.data)
+        self.assertEqual(body['metadata']['query_parameters'],
+                         {'stop_id': 3, 'start_time': '2025-04-02T08:04:00Z', 'limit': 1})
+        self.assertEqual(body['departures'], [{
+            'trip_id': '6_100',
+            'route_id': 'A',
+            'trip_headsign': 'KRZYKI',
+            'stop': {
+                'name': 'Dominikański',
+                'coordinates': {'latitude': 51.1099, 'longitude': 17.0335},
+                'arrival_time': '2025-04-02T08:04:00Z',
+                'departure_time': '2025-04-02T08:05:00Z',
+            },
+        }])
+
+    def test_board_without_start_time_is_for_the_current_minute(self):
+        response = self.client.get(BOARD_URL.format(3))
+        self.assertEqual(response.status_code, 200)
+        query = json.loads(response.data)['metadata']['query_parameters']
+        self.assertEqual(query['limit'], 10)
+        self.assertRegex(query['start_time'], r'^\d{4}-\d\d-\d\dT\d\d:\d\d:00Z$')
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(BOARD_URL.format(99)).status_code, 404)
+        self.assertEqual(self.client.get(BOARD_URL.format('x')).status_code, 404)
+        self.assertEqual(self.client.get(BOARD_URL.format(3) + '?limit=many').status_code, 400)
+        self.assertEqual(self.client.get(BOARD_URL.format(3) + '?start_time=noon').status_code,
+                         400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import app as app_module
+import database
+from app import app
+from cities import CityRegistry, parse_cities
+from database import ConnectionPool
+from tests.public_transport_api.fixtures import create_database
+
+TRIP_URL = '/public_transport/city/{}/trip/6_100'
+DEPARTURES_URL = ('/public_transport/city/{}/closest_departures?start_coordinates=51.1093,17.0414'
+                  '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T08:10:00Z&format=ndjson')
+
+
+def create_city_databases(directory):
+    """Create the fixture database for two cities whose trips differ by headsign."""
+    paths = {}
+    for city in ('wroclaw', 'krakow'):
+        os.makedirs(os.path.join(directory, city))
+        paths[city] = os.path.join(directory, city, 'trips.sqlite')
+        create_database(paths[city])
+    conn = sqlite3.connect(paths['krakow'])
+    conn.execute("UPDATE trips SET trip_headsign = 'NOWA HUTA'")
+    conn.commit()
+    conn.close()
+    return paths
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCityRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.paths = create_city_databases(self.tmp.name)
+        self.clock = Clock()
+        self.evicted = []
+
+    def tearDown(self):
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def registry(self, **options):
+        options.setdefault('on_evict', self.evicted.append)
+        return CityRegistry(self.paths, clock=self.clock, **options)
+
+    def test_parse_cities(self):
+        self.assertEqual(parse_cities('Wroclaw=/a.sqlite, krakow = /b.sqlite,'),
+                         {'wroclaw': Path('/a.sqlite'),
+                          'krakow': Path('/b.sqlite')})
+        with self.assertRaises(ValueError):
+            parse_cities('wroclaw')
+
+    def test_cities_are_opened_on_first_use(self):
+        registry = self.registry()
+        self.assertIn('Krakow', registry)
+        self.assertNotIn('gdansk', registry)
+        self.assertEqual(registry.stats()['loaded'], {})
+
+        pool = registry.checkout('KRAKOW')
+        self.assertEqual(pool.path, Path(self.paths['krakow']).resolve())
+        self.assertIs(registry.checkout('krakow'), pool)
+        self.assertEqual(list(registry.stats()['loaded']), ['krakow'])
+        self.assertEqual(registry.stats()['loaded']['krakow']['in_use'], 2)
+        with self.assertRaises(KeyError):
+            registry.checkout('gdansk')
+
+    def test_idle_cities_are_closed(self):
+        registry = self.registry(idle_seconds=60)
+        pool = registry.checkout('krakow')
+        pool.connection()
+        self.clock.now = 120
+        registry.checkout('wroclaw')
+        # Still in use
+        self.assertEqual(list(registry.stats()['loaded']), ['krakow', 'wroclaw'])
+
+        registry.checkin('krakow')
+        self.clock.now = 200
+        registry.checkin('wroclaw')
+        self.assertEqual(list(registry.stats()['loaded']), ['wroclaw'])
+        self.assertEqual(self.evicted, ['krakow'])
+        self.assertEqual(pool.stats()['open_connections'], 0)
+        self.assertIsNot(registry.checkout('krakow'), pool)
+        self.assertEqual(registry.stats()['loads'], 3)
+
+    def test_least_recently_used_cities_are_closed_over_the_memory_budget(self):
+        registry = self.registry(idle_seconds=None, memory_budget_bytes=150)
+        with mock.patch.object(ConnectionPool, 'memory_bytes', return_value=100):
+            for city in ('wroclaw', 'krakow'):
+                registry.checkout(city)
+                registry.checkin(city)
+        self.assertEqual(list(registry.stats()['loaded']), ['krakow'])
+        self.assertEqual(self.evicted, ['wroclaw'])
+        self.assertEqual(registry.stats()['evictions'], 1)
+
+    def test_default_city_uses_the_process_wide_pool(self):
+        database.configure(self.paths['wroclaw'])
+        registry = CityRegistry({'wroclaw': None}, idle_seconds=0)
+        self.assertIs(registry.checkout('wroclaw'), database.get_pool())
+        registry.checkin('wroclaw')
+        self.assertEqual(list(registry.stats()['loaded']), ['wroclaw'])
+
+
+class TestCityEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.paths = create_city_databases(self.tmp.name)
+        self.registry = CityRegistry(self.paths, on_evict=app_module.drop_city_caches)
+        patcher = mock.patch.object(app_module, 'cities', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.registry.close_all()
+        for caches in app_module._city_caches.values():
+            caches.departures.clear()
+            caches.trip_details.clear()
+        self.tmp.cleanup()
+
+    def test_each_city_answers_from_its_own_database(self):
+        headsigns = {}
+        for city in ('wroclaw', 'Krakow'):
+            response = self.client.get(TRIP_URL.format(city))
+            self.assertEqual(response.status_code, 200)
+            headsigns[city] = json.loads(response.data)['trip_details']['trip_headsign']
+        self.assertEqual(headsigns, {'wroclaw': 'KRZYKI', 'Krakow': 'NOWA HUTA'})
+        self.assertEqual(self.client.get(TRIP_URL.format('krakow')).get_etag(),
+                         self.client.get(TRIP_URL.format('krakow')).get_etag())
+        self.assertEqual(app_module.city_caches('krakow').trip_details.stats()['entries'], 1)
+
+    def test_unknown_city_is_not_found(self):
+        response = self.client.get(TRIP_URL.format('gdansk'))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data), {'error': 'City not found'})
+        self.assertEqual(self.registry.stats()['loaded'], {})
+
+    def test_streamed_departures_keep_the_city_in_use(self):
+        response = self.client.get(DEPARTURES_URL.format('krakow'))
+        self.assertEqual(self.registry.stats()['loaded']['krakow']['in_use'], 1)
+        lines = response.data.decode().splitlines()
+        response.close()
+        self.assertEqual({json.loads(line)['trip_headsign'] for line in lines[1:]},
+                         {'NOWA HUTA'})
+        self.assertEqual(self.registry.stats()['loaded']['krakow']['in_use'], 0)
+        self.assertIsNone(database._current_pool.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import random
+import unittest
+from unittest import mock
+
+import utils
+from utils import equirectangular_many, haversine, haversine_many
+
+
+class TestBatchDistances(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(5)
+        self.lats = [rng.uniform(51.04, 51.18) for _ in range(200)]
+        self.lons = [rng.uniform(16.90, 17.15) for _ in range(200)]
+        self.exact = [haversine(51.11, 17.03, a, b) for a, b in zip(self.lats, self.lons)]
+
+    def backends(self):
+        return [False, True] if utils.numpy_available() else [False]
+
+    def test_haversine_many_matches_scalar(self):
+        for use_numpy in self.backends():
+            result = haversine_many(51.11, 17.03, self.lats, self.lons, use_numpy=use_numpy)
+            for expected, actual in zip(self.exact, result):
+                self.assertAlmostEqual(expected, float(actual), places=9)
+
+    def test_pairwise_distances(self):
+        origins_lat, origins_lon = self.lats[::-1], self.lons[::-1]
+        expected = [haversine(*p) for p in zip(origins_lat, origins_lon, self.lats, self.lons)]
+        for use_numpy in self.backends():
+            result = haversine_many(origins_lat, origins_lon, self.lats, self.lons, use_numpy=use_numpy)
+            for e, actual in zip(expected, result):
+                self.assertAlmostEqual(e, float(actual), places=9)
+            result = equirectangular_many(origins_lat, origins_lon, self.lats, self.lons, use_numpy=use_numpy)
+            for e, actual in zip(expected, result):
+                self.assertAlmostEqual(e, float(actual), delta=1e-3)
+
+    def test_equirectangular_error_within_short_radius(self):
+        for use_numpy in self.backends():
+            result = equirectangular_many(51.11, 17.03, self.lats, self.lons, use_numpy=use_numpy)
+            for expected, actual in zip(self.exact, result):
+                if expected <= utils.EQUIRECTANGULAR_MAX_KM:
+                    self.assertLess(abs(expected - float(actual)), 1e-6)  # 1 mm
+
+    def test_empty_batch(self):
+        self.assertEqual(len(haversine_many(51.1, 17.0, [], [])), 0)
+        self.assertEqual(len(equirectangular_many(51.1, 17.0, [], [])), 0)
+
+    def test_without_numpy(self):
+        with mock.patch.object(utils, 'np', None), \
+                mock.patch.object(utils, '_numpy_imported', True):
+            self.assertFalse(utils.numpy_available())
+            result = haversine_many(51.11, 17.03, self.lats, self.lons)
+            self.assertIsInstance(result, list)
+            self.assertEqual(len(result), len(self.lats))
+            with self.assertRaisesRegex(RuntimeError, 'NumPy is not installed'):
+                haversine_many(51.11, 17.03, self.lats, self.lons, use_numpy=True)
+            with self.assertRaisesRegex(RuntimeError, 'NumPy is not installed'):
+                equirectangular_many(51.11, 17.03, self.lats, self.lons, use_numpy=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
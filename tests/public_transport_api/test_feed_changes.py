@@ -0,0 +1,113 @@
+import copy
+import json
+import os
+import tempfile
+import unittest
+
+import database
+import models
+from app import app, departures_cache, trip_details_cache
+from gtfs_import import import_feed, update_feed
+from snapshot import MappedTimetable
+from tests.public_transport_api.fixtures import FEED, write_feed
+
+TRIP_URL = '/public_transport/city/wroclaw/trip/{}'
+
+
+def with_stop(feed, stop_id, name):
+    feed = copy.deepcopy(feed)
+    feed['stops.txt'].append([stop_id, 100 + stop_id, name, 51.1000, 17.0200])
+    return feed
+
+
+class TestFeedChanges(unittest.TestCase):
+    """A running pool follows re-imports and updates of its database."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.gtfs_dir = os.path.join(self.tmp.name, 'gtfs')
+        os.makedirs(self.gtfs_dir)
+        write_feed(self.gtfs_dir)
+        self.db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        import_feed(self.gtfs_dir, self.db_path, verbose=False)
+        self.pool = database.configure(self.db_path, check_seconds=0)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        for cache in (departures_cache, trip_details_cache):
+            cache.clear()
+        models.set_backend('sqlite')
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def stop_names(self):
+        return {stop['stop_name'] for _, stop in models.find_nearby_stops(51.1, 17.02, k=100)}
+
+    def test_full_reimport_is_picked_up(self):
+        for backend in models.BACKENDS:
+            with self.subTest(backend=backend):
+                models.set_backend(backend)
+                self.assertNotIn('Rynek', self.stop_names())
+                models.get_backend()
+                version = models.get_feed_version()
+
+                # The import moves a new file over the one the pool has open
+                write_feed(self.gtfs_dir, with_stop(FEED, 5, 'Rynek'))
+                import_feed(self.gtfs_dir, self.db_path, verbose=False)
+                self.assertNotEqual(models.get_feed_version(), version)
+                self.assertIn('Rynek', self.stop_names())
+                write_feed(self.gtfs_dir)
+                import_feed(self.gtfs_dir, self.db_path, verbose=False)
+
+    def test_update_is_picked_up(self):
+        models.set_backend('memory')
+        self.assertEqual(len(self.stop_names()), 4)
+        self.assertEqual(self.client.get(TRIP_URL.format('6_300')).status_code, 404)
+        planner = models.get_journey_planner()
+
+        feed = with_stop(FEED, 5, 'Rynek')
+        feed['trips.txt'].append(['D', 6, '6_300', 'RENOMA', 1, 902, 4, 1, 902])
+        feed['stop_times.txt'] += [
+            ['6_300', '10:00:00', '10:00:00', 5, 0, 0, 0],
+            ['6_300', '10:07:00', '10:07:00', 2, 1, 0, 0],
+        ]
+        write_feed(self.gtfs_dir, feed)
+        update_feed(self.gtfs_dir, self.db_path, verbose=False)
+
+        self.assertEqual(len(self.stop_names()), 5)
+        self.assertIsNot(models.get_journey_planner(), planner)
+        response = self.client.get(TRIP_URL.format('6_300'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['trip_details']['trip_headsign'], 'RENOMA')
+        self.assertEqual(self.pool.stats()['feed_changes'], 1)
+
+    def test_served_departures_follow_an_update(self):
+        models.set_backend('memory')
+        url = ('/public_transport/city/wroclaw/closest_departures?start_coordinates=51.1093,17.0414'
+               '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T08:15:00Z&limit=1')
+        departure = json.loads(self.client.get(url).data)['departures'][0]
+        self.assertEqual(departure['stop']['departure_time'], '2025-04-02T08:20:00Z')
+
+        feed = copy.deepcopy(FEED)
+        for row in feed['stop_times.txt']:
+            if row[0] == '6_101' and row[4] == 0:
+                row[1] = row[2] = '08:22:00'
+        write_feed(self.gtfs_dir, feed)
+        update_feed(self.gtfs_dir, self.db_path, verbose=False)
+
+        departure = json.loads(self.client.get(url).data)['departures'][0]
+        self.assertEqual(departure['stop']['departure_time'], '2025-04-02T08:22:00Z')
+        # Loaded from the snapshot the update wrote, not rebuilt from SQLite
+        timetable = models.get_timetable()
+        self.assertIsInstance(timetable, MappedTimetable)
+        self.assertEqual(timetable.feed_version, models.get_feed_version())
+
+    def test_unchanged_database_keeps_its_objects(self):
+        index = models.get_stop_index()
+        update_feed(self.gtfs_dir, self.db_path, verbose=False)  # nothing to apply
+        self.assertIs(models.get_stop_index(), index)
+        self.assertEqual(self.pool.stats()['feed_changes'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
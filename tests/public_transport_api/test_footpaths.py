@@ -0,0 +1,86 @@
+import copy
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from footpaths import Footpaths, footpath_rows
+from gtfs_import import import_feed, update_feed
+from tests.public_transport_api.fixtures import FEED, write_feed
+
+# Stops 2, 5 and 6 are platforms of Renoma; stop 7 shares the name far away
+EXTRA_STOPS = [
+    [5, 105, "Renoma", 51.1043, 17.0290],  # 77 m from stop 2
+    [6, 106, "Renoma", 51.1060, 17.0400],  # 790 m from stop 5, 370 m from stop 1
+    [7, 107, "Renoma", 51.0000, 17.0000],
+]
+
+
+def stop_records(rows):
+    return [
+        {"stop_id": stop_id, "stop_name": name, "stop_lat": lat, "stop_lon": lon}
+        for stop_id, _, name, lat, lon in rows
+    ]
+
+
+class TestFootpathRows(unittest.TestCase):
+
+    def setUp(self):
+        self.footpaths, self.stations = footpath_rows(
+            stop_records(FEED["stops.txt"][1:] + EXTRA_STOPS)
+        )
+
+    def test_links_nearby_stops_and_platforms_of_a_station(self):
+        self.assertEqual(
+            sorted((a, b) for a, b, _, _ in self.footpaths),
+            [(1, 6), (2, 5), (2, 6), (5, 2), (5, 6), (6, 1), (6, 2), (6, 5)],
+        )
+        self.assertIn((2, 5, 77, 62), self.footpaths)
+
+    def test_groups_stops_sharing_a_name_close_to_each_other(self):
+        self.assertEqual(self.stations, [(2, 2), (5, 2), (6, 2)])
+
+    def test_larger_radius(self):
+        footpaths, _ = footpath_rows(stop_records(FEED["stops.txt"][1:]), radius_km=0.8)
+        self.assertEqual(sorted((a, b) for a, b, _, _ in footpaths),
+                         [(1, 3), (2, 3), (3, 1), (3, 2)])
+
+
+class TestFootpaths(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        feed = copy.deepcopy(FEED)
+        feed["stops.txt"] += EXTRA_STOPS
+        write_feed(self.tmp.name, feed)
+        self.db_path = os.path.join(self.tmp.name, "trips.sqlite")
+        self.counts = import_feed(self.tmp.name, self.db_path, verbose=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_loads_adjacency_by_distance(self):
+        self.assertEqual(self.counts["footpaths"], 8)
+        conn = sqlite3.connect(self.db_path)
+        footpaths = Footpaths.from_connection(conn)
+        conn.close()
+        self.assertEqual(len(footpaths), 8)
+        self.assertEqual([stop for stop, _, _ in footpaths.neighbours(2)], [5, 6])
+        self.assertEqual(footpaths.neighbours(2)[0], (5, 77, 62))
+        self.assertEqual(footpaths.neighbours(1), [(6, 371, 297)])
+        self.assertEqual(footpaths.neighbours(4), [])
+        self.assertEqual(footpaths.station(6), 2)
+        self.assertEqual(footpaths.station_stops(5), [2, 5, 6])
+        self.assertEqual(footpaths.station_stops(7), [7])
+
+    def test_update_rebuilds_footpaths_when_stops_change(self):
+        write_feed(self.tmp.name)
+        update_feed(self.tmp.name, self.db_path, verbose=False)
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM footpaths").fetchone(), (0,))
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM stop_stations").fetchone(), (0,))
+        conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
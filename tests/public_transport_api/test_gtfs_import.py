@@ -0,0 +1,129 @@
+import copy
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from gtfs_import import current_feed_version, import_feed, update_feed
+from tests.public_transport_api.fixtures import FEED, write_feed
+
+
+class TestImportFeed(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_feed(self.tmp.name)
+        self.db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_import_converts_times_to_seconds(self):
+        counts = import_feed(self.tmp.name, self.db_path, verbose=False)
+        self.assertEqual(counts['stop_times'], 16)
+        self.assertNotIn('variants', counts)  # no variants.txt in the fixture
+
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute(
+            "SELECT arrival_sec, departure_sec FROM stop_times JOIN trips USING (trip_key) "
+            "WHERE trip_id = '6_100' AND stop_sequence = 1"
+        ).fetchone()
+        self.assertEqual(row, (8 * 3600 + 4 * 60, 8 * 3600 + 5 * 60))
+        self.assertEqual(
+            conn.execute("SELECT MAX(departure_sec) FROM stop_times").fetchone(),
+            (25 * 3600 + 20 * 60,),  # 25:20:00 stays on its service day
+        )
+        # The byte order mark must not end up in the first column name
+        self.assertEqual(conn.execute("SELECT stop_name FROM stops WHERE stop_id = 1").fetchone(),
+                         ('Plac Grunwaldzki',))
+        indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        self.assertIn('idx_stop_times_stop_departure', indexes)
+        conn.close()
+
+    def test_variant_stops_hold_remaining_path_boxes(self):
+        counts = import_feed(self.tmp.name, self.db_path, verbose=False)
+        self.assertEqual(counts['variant_stops'], 6)  # two variants, last stops excluded
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(
+            "SELECT stop_sequence, stop_id, min_lat, max_lat, min_lon, max_lon "
+            "FROM variant_stops WHERE variant_id = 900 ORDER BY stop_sequence"
+        ).fetchall()
+        conn.close()
+        self.assertEqual(rows, [
+            (0, 1, 51.0740, 51.1099, 17.0070, 17.0335),  # Dominikański, Renoma, Krzyki
+            (1, 3, 51.0740, 51.1040, 17.0070, 17.0280),  # Renoma, Krzyki
+            (2, 2, 51.0740, 51.0740, 17.0070, 17.0070),  # Krzyki
+        ])
+
+    def test_service_dates_apply_calendar_exceptions(self):
+        counts = import_feed(self.tmp.name, self.db_path, verbose=False)
+        self.assertEqual(counts['service_dates'], 10)  # 6: Mon-Thu, +1 -1; 7: two Tuesdays
+        conn = sqlite3.connect(self.db_path)
+        dates = [date for (date,) in conn.execute(
+            "SELECT date FROM service_dates "
+            "WHERE service_id = 6 AND date BETWEEN 20250331 AND 20250406"
+        )]
+        conn.close()
+        self.assertEqual(dates, [20250331, 20250401, 20250402, 20250405])
+
+    def test_update_rebuilds_service_dates_when_calendar_changes(self):
+        import_feed(self.tmp.name, self.db_path, verbose=False)
+        feed = copy.deepcopy(FEED)
+        feed['calendar_dates.txt'].append([6, 20250401, 2])
+        write_feed(self.tmp.name, feed)
+        update_feed(self.tmp.name, self.db_path, verbose=False)
+
+        conn = sqlite3.connect(self.db_path)
+        self.assertIsNone(conn.execute(
+            "SELECT 1 FROM service_dates WHERE date = 20250401 AND service_id = 6"
+        ).fetchone())
+        conn.close()
+
+    def test_reimport_replaces_previous_database(self):
+        import_feed(self.tmp.name, self.db_path, verbose=False)
+        import_feed(self.tmp.name, self.db_path, verbose=False)
+        conn = sqlite3.connect(self.db_path)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM trips").fetchone(), (4,))
+        conn.close()
+        self.assertFalse(os.path.exists(self.db_path + '.tmp'))
+
+
+    def test_update_applies_only_changed_trips(self):
+        import_feed(self.tmp.name, self.db_path, verbose=False)
+        self.assertIsNone(update_feed(self.tmp.name, self.db_path, verbose=False))
+
+        feed = copy.deepcopy(FEED)
+        feed['trips.txt'] = [row for row in feed['trips.txt'] if row[2] != '6_200']
+        feed['trips.txt'].append(['D', 6, '6_300', 'RENOMA', 1, 902, 4, 1, 902])
+        feed['stop_times.txt'] = [row for row in feed['stop_times.txt'] if row[0] != '6_200']
+        feed['stop_times.txt'] += [
+            ['6_300', '10:00:00', '10:00:00', 1, 0, 0, 0],
+            ['6_300', '10:07:00', '10:07:00', 2, 1, 0, 0],
+        ]
+        for row in feed['stop_times.txt']:
+            if row[0] == '6_101' and row[4] == 2:
+                row[1] = row[2] = '08:31:00'
+        write_feed(self.tmp.name, feed)
+
+        diff = update_feed(self.tmp.name, self.db_path, verbose=False)
+        self.assertEqual(diff, {'inserted': 1, 'changed': 1, 'deleted': 1})
+
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        trips = [row[0] for row in conn.execute('SELECT trip_id FROM trips ORDER BY trip_id')]
+        self.assertEqual(trips, ['6_100', '6_101', '6_300', '7_190'])
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM stop_times').fetchone()[0], 14)
+        self.assertEqual(
+            conn.execute("SELECT departure_sec FROM stop_times JOIN trips USING (trip_key) "
+                         "WHERE trip_id = '6_101' AND stop_sequence = 2").fetchone()[0],
+            8 * 3600 + 31 * 60,
+        )
+        version = current_feed_version(conn)
+        self.assertEqual((version['version'], version['mode']), (2, 'update'))
+        self.assertEqual(version['feed_end_date'], 20250406)
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+import instrumentation
+from instrumentation import Histogram, SlowRequestProfiler, span, statement_label, timed_iter
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_renders_cumulative_buckets(self):
+        histogram = Histogram('latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(('trip',), seconds)
+        self.assertEqual(histogram.render(), [
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{endpoint="trip",le="0.1"} 2',
+            'latency_seconds_bucket{endpoint="trip",le="1.0"} 3',
+            'latency_seconds_bucket{endpoint="trip",le="+Inf"} 4',
+            'latency_seconds_sum{endpoint="trip"} 2.65',
+            'latency_seconds_count{endpoint="trip"} 4',
+        ])
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.reset_metrics()
+
+    def test_spans_outside_a_request_are_ignored(self):
+        with span('query'):
+            pass
+        self.assertEqual(list(timed_iter('materialize', [1, 2])), [1, 2])
+        self.assertEqual(instrumentation.SPAN_SECONDS.snapshot(), {})
+
+    def test_timed_iter_leaves_out_the_consumer(self):
+        def slow_rows():
+            for row in range(3):
+                time.sleep(0.002)
+                yield row
+
+        trace = instrumentation.start_trace('departures')
+        with span('query'):
+            time.sleep(0.001)
+        for _ in timed_iter('materialize', slow_rows()):
+            time.sleep(0.01)
+        instrumentation.finish_trace(trace, 200)
+
+        self.assertGreaterEqual(trace.spans['query'], 0.001)
+        self.assertGreaterEqual(trace.spans['materialize'], 0.006)
+        self.assertLess(trace.spans['materialize'], 0.03)
+        self.assertIsNone(instrumentation.current_trace())
+        _, count, _ = instrumentation.REQUEST_SECONDS.snapshot()[('departures', '200')]
+        self.assertEqual(count, 1)
+
+    def test_sql_statements_are_timed_by_label(self):
+        conn = sqlite3.connect(':memory:')
+        instrumentation.trace_connection(conn)
+        conn.execute('CREATE TABLE numbers (n INTEGER)')
+        conn.executemany('INSERT INTO numbers VALUES (?)', [(n,) for n in range(3000)])
+        trace = instrumentation.start_trace('numbers')
+        for limit in (10, 20):
+            conn.execute('SELECT SUM(a.n * b.n) FROM numbers a, numbers b '
+                         'WHERE a.n < ? AND b.n IN (1, 2, 3)', (limit,)).fetchall()
+        instrumentation.finish_trace(trace, 200)
+        conn.close()
+
+        label = 'SELECT SUM(a.n * b.n) FROM numbers a, numbers b WHERE a.n < ? AND b.n IN (?)'
+        _, count, seconds = instrumentation.SQL_SECONDS.snapshot()[(label,)]
+        self.assertEqual(count, 2)
+        self.assertGreater(seconds, 0)
+        self.assertGreater(trace.spans['sql'], 0)
+        self.assertIn(f'sqlite_statement_vm_steps_total{{statement="{label}"}}',
+                      instrumentation.render_metrics())
+
+    def test_statement_label(self):
+        self.assertEqual(
+            statement_label("SELECT * FROM t\n  WHERE id IN (1, 2, 3) AND name = 'it''s'"),
+            'SELECT * FROM t WHERE id IN (?) AND name = ?',
+        )
+        self.assertEqual(statement_label('VALUES (1), (2), (3)'), 'VALUES (?)')
+
+
+class TestSlowRequestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        instrumentation.set_profiler(None)
+        self.tmp.cleanup()
+
+    def profile(self, mode, slow_seconds, interval=0.001):
+        profiler = SlowRequestProfiler(slow_seconds, self.tmp.name, mode, interval)
+        instrumentation.set_profiler(profiler)
+        trace = instrumentation.start_trace('trip_details')
+        deadline = time.perf_counter() + 0.02
+        while time.perf_counter() < deadline:
+            pass
+        instrumentation.finish_trace(trace, 200)
+        return sorted(os.listdir(self.tmp.name))
+
+    def test_writes_profiles_of_slow_requests_only(self):
+        self.assertEqual(self.profile('cprofile', slow_seconds=1), [])
+        files = self.profile('cprofile', slow_seconds=0.01)
+        self.assertEqual(len(files), 1)
+        self.assertRegex(files[0], r'-trip_details-\d+ms\.pstats$')
+
+    def test_cprofile_profiles_one_request_at_a_time(self):
+        profiler = SlowRequestProfiler(0, self.tmp.name, 'cprofile')
+        first, overlapping, later = (SimpleNamespace(endpoint=name, profile=None)
+                                     for name in ('first', 'overlapping', 'later'))
+        profiler.start(first)
+        profiler.start(overlapping)
+        self.assertIsNotNone(first.profile)
+        self.assertIsNone(overlapping.profile)
+        profiler.finish(overlapping, 1)
+        profiler.finish(first, 1)
+        profiler.start(later)
+        profiler.finish(later, 1)
+        self.assertEqual({name.split('-')[3] for name in os.listdir(self.tmp.name)},
+                         {'first', 'later'})
+
+    def test_sampling_writes_folded_stacks(self):
+        [name] = self.profile('sample', slow_seconds=0)
+        with open(os.path.join(self.tmp.name, name)) as f:
+            stack, count = f.readline().rsplit(' ', 1)
+        self.assertIn('profile (test_instrumentation.py:', stack)
+        self.assertGreater(int(count), 0)
+
+    def test_rejects_unknown_modes(self):
+        with self.assertRaises(ValueError):
+            SlowRequestProfiler(0.1, self.tmp.name, 'perf')
+
+
+if __name__ == '__main__':
+    unittest.main()
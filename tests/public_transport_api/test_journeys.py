@@ -0,0 +1,98 @@
+import os
+import tempfile
+import unittest
+
+import database
+import models
+from journeys import JourneyPlanner
+from tests.public_transport_api.fixtures import create_database
+from timetable import Timetable
+
+STOPS = [
+    (1, 'Start', 51.100, 17.000),
+    (2, 'Change A', 51.105, 17.010),
+    (3, 'Change B', 51.1052, 17.0105),
+    (4, 'End', 51.110, 17.020),
+]
+TRIPS = [
+    ('t1', 'L1', 'CHANGE', 1, 0, None),
+    ('t2', 'L2', 'END', 1, 0, None),
+    ('t3', 'L2', 'END', 1, 0, None),
+    ('t4', 'L3', 'END', 2, 0, None),  # does not run on the test date
+]
+STOP_TIMES = [
+    ('t1', 1, 0, 28800, 28800),
+    ('t1', 2, 1, 29400, 29400),
+    ('t2', 3, 0, 29460, 29460),  # leaves before the walk from Change A is over
+    ('t2', 4, 1, 30000, 30000),
+    ('t3', 3, 0, 29700, 29700),
+    ('t3', 4, 1, 30300, 30300),
+    ('t4', 1, 0, 28900, 28900),
+    ('t4', 4, 1, 29000, 29000),
+]
+
+
+class TestJourneyPlanner(unittest.TestCase):
+
+    def setUp(self):
+        timetable = Timetable(STOPS, TRIPS, STOP_TIMES, service_dates=[(20250402, 1)])
+        # Change A and Change B are two minutes apart on foot
+        self.planner = JourneyPlanner(timetable, [[], [(2, 120)], [(1, 120)], []])
+
+    def test_rides_with_a_walking_transfer(self):
+        legs = self.planner.earliest_arrival([(1, 60)], [(4, 30)], 28000, 20250402)
+        self.assertEqual(legs, [
+            ('walk', None, 0, 28740, 28800),
+            ('ride', 0, 0, 1, 28800, 29400),
+            ('walk', 1, 2, 29400, 29520),
+            ('ride', 2, 2, 3, 29700, 30300),
+            ('walk', 3, None, 30300, 30330),
+        ])
+
+    def test_only_trips_running_on_the_date(self):
+        without_date = self.planner.earliest_arrival([(1, 0)], [(4, 0)], 28000)
+        self.assertEqual(without_date, [('ride', 3, 0, 3, 28900, 29000)])
+        self.assertIsNone(self.planner.earliest_arrival([(1, 0)], [(4, 0)], 28000, 20250403))
+
+    def test_walks_when_that_is_faster(self):
+        legs = self.planner.earliest_arrival([(1, 60)], [(4, 30)], 28000, 20250402,
+                                             direct_walk=900)
+        self.assertEqual(legs, [('walk', None, None, 28000, 28900)])
+
+
+class TestPlanJourney(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(db_path)
+        database.configure(db_path)
+
+    def tearDown(self):
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def test_journey_from_plac_grunwaldzki_to_krzyki(self):
+        journey = models.plan_journey(51.1093, 17.0414, 51.0740, 17.0070, '2025-04-02T07:55:00Z')
+        self.assertEqual(
+            [(leg['mode'], leg['from']['name'], leg['to']['name']) for leg in journey['legs']],
+            [('walk', None, 'Plac Grunwaldzki'), ('transit', 'Plac Grunwaldzki', 'Krzyki')],
+        )
+        self.assertEqual(journey['legs'][1]['trip_id'], '6_100')
+        self.assertEqual(journey['arrival_time'], '2025-04-02T08:30:00Z')
+        self.assertEqual(journey['transfers'], 0)
+
+    def test_previous_days_night_trip_after_midnight(self):
+        journey = models.plan_journey(51.1093, 17.0414, 51.0740, 17.0070, '2025-04-02T00:30:00Z')
+        self.assertEqual(journey['legs'][1]['trip_id'], '7_190')
+        self.assertEqual(journey['arrival_time'], '2025-04-02T01:20:00Z')
+
+    def test_no_journey_when_nothing_runs(self):
+        # Friday 4 April: no service runs
+        self.assertIsNone(
+            models.plan_journey(51.1093, 17.0414, 51.0740, 17.0070, '2025-04-04T07:55:00Z')
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import database
+import models
+from gtfs_import import feed_version_key, update_feed
+from migrate import migrate
+from schema import SCHEMA_VERSION
+from snapshot import MappedTimetable, snapshot_path
+from tests.public_transport_api.fixtures import FEED, create_database
+
+
+def downgrade(new_path, old_path):
+    """Write the data of a current database with the version 1 layout."""
+    conn = sqlite3.connect(old_path)
+    conn.execute("ATTACH DATABASE ? AS new", (new_path,))
+    for name in ("stops", "routes", "calendar", "calendar_dates", "feed_info",
+                 "feed_files", "trip_digests", "feed_versions", "variant_stops"):
+        conn.execute(f"CREATE TABLE {name} AS SELECT * FROM new.{name}")
+    conn.execute("""CREATE TABLE trips AS
+                    SELECT route_id, service_id, trip_id, trip_headsign, direction_id,
+                           shape_id, brigade_id, vehicle_id, variant_id
+                    FROM new.trips ORDER BY trip_key""")
+    conn.execute("""CREATE TABLE stop_times AS
+                    SELECT t.trip_id, st.arrival_sec, st.departure_sec, st.stop_id,
+                           st.stop_sequence, st.pickup_type, st.drop_off_type
+                    FROM new.stop_times st JOIN new.trips t USING (trip_key)""")
+    conn.execute("CREATE INDEX idx_stop_times_stop_departure ON stop_times (stop_id, departure_sec)")
+    conn.commit()
+    conn.close()
+
+
+def create_original_database(path, loads=1):
+    """Write the fixture feed with the original layout of queries/populate_*.py:
+    three tables, times as text, and the byte order mark of the feed files
+    left in the first column name of trips. The rows are inserted ``loads``
+    times, as by running the scripts again."""
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE stops (stop_id INTEGER, stop_code INTEGER, stop_name TEXT,
+                                        stop_lat REAL, stop_lon REAL)""")
+    conn.execute("""CREATE TABLE trips ("\ufeffroute_id" TEXT, service_id INTEGER, trip_id TEXT,
+                                        trip_headsign TEXT, direction_id INTEGER,
+                                        shape_id INTEGER, brigade_id INTEGER,
+                                        vehicle_id INTEGER, variant_id INTEGER)""")
+    conn.execute("""CREATE TABLE stop_times (trip_id TEXT, arrival_time TEXT, departure_time TEXT,
+                                             stop_id INTEGER, stop_sequence INTEGER,
+                                             pickup_type INTEGER, drop_off_type INTEGER)""")
+    for _ in range(loads):
+        for name in ('stops', 'trips', 'stop_times'):
+            header, *rows = FEED[f'{name}.txt']
+            conn.executemany(f"INSERT INTO {name} VALUES ({', '.join('?' * len(header))})",
+                             [[str(value) for value in row] for row in rows])
+    conn.commit()
+    conn.close()
+
+
+class TestMigrate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.current = os.path.join(self.tmp.name, 'current.sqlite')
+        self.old = os.path.join(self.tmp.name, 'trips.sqlite')
+        self.gtfs_dir = os.path.join(self.tmp.name, 'gtfs')
+        create_database(self.current)
+
+    def tearDown(self):
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def answers(self, path):
+        database.configure(path)
+        try:
+            trip, stops = models.get_trip_details('7_190')
+            return (dict(trip), [dict(row) for row in stops], models.get_closest_departures(
+                51.1093, 17.0414, 51.0740, 17.0070, '2025-04-02T08:10:00Z'
+            ))
+        finally:
+            database.get_pool().close_all()
+
+    def test_converts_a_version_1_database(self):
+        downgrade(self.current, self.old)
+        with self.assertRaises(RuntimeError):
+            update_feed(self.gtfs_dir, self.old, verbose=False)
+
+        before, after = migrate(self.old, self.gtfs_dir, verbose=False)
+        self.assertGreater(before, 0)
+        conn = sqlite3.connect(self.old)
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone(), (SCHEMA_VERSION,))
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM stop_times').fetchone(), (16,))
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM service_dates').fetchone(), (10,))
+        conn.close()
+        self.assertEqual(self.answers(self.old), self.answers(self.current))
+        self.assertIsNone(migrate(self.old, self.gtfs_dir, verbose=False))
+
+    def test_converts_an_original_database(self):
+        create_original_database(self.old)
+        migrate(self.old, self.gtfs_dir, verbose=False)
+        conn = sqlite3.connect(self.old)
+        self.assertEqual(conn.execute("""SELECT COUNT(*), COUNT(arrival_sec), COUNT(departure_sec)
+                                         FROM stop_times""").fetchone(), (16, 16, 16))
+        self.assertEqual(conn.execute("""SELECT departure_sec FROM stop_times
+                                         JOIN trips USING (trip_key)
+                                         WHERE trip_id = '7_190' AND stop_sequence = 2""").fetchone(),
+                         (25 * 3600,))
+        # calendar was loaded from the feed, as the import does
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM service_dates').fetchone(), (10,))
+        feed_version = feed_version_key(conn)
+        conn.close()
+        self.assertIsNotNone(feed_version)
+        self.assertIsNotNone(MappedTimetable.open(snapshot_path(self.old), feed_version))
+        self.assertEqual(self.answers(self.old), self.answers(self.current))
+
+        # Nothing of the original database is known to match the feed: the
+        # first update rewrites every trip
+        diff = update_feed(self.gtfs_dir, self.old, verbose=False)
+        self.assertEqual(diff, {'inserted': 0, 'changed': 4, 'deleted': 0})
+        self.assertEqual(self.answers(self.old), self.answers(self.current))
+
+    def test_copies_rows_loaded_twice_once(self):
+        create_original_database(self.old, loads=2)
+        migrate(self.old, self.gtfs_dir, verbose=False)
+        conn = sqlite3.connect(self.old)
+        self.assertEqual([conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+                          for name in ('stops', 'trips', 'stop_times')], [4, 4, 16])
+        # Numbered in the order of their first load
+        self.assertEqual(conn.execute('SELECT trip_id FROM trips ORDER BY trip_key').fetchall(),
+                         [(row[2],) for row in FEED['trips.txt'][1:]])
+        conn.close()
+        self.assertEqual(self.answers(self.old), self.answers(self.current))
+
+    def test_keeps_the_database_when_the_copy_is_incomplete(self):
+        for change, error in [
+            ("UPDATE stop_times SET departure_time = 'soon' WHERE trip_id = '6_100'", sqlite3.Error),
+            ("UPDATE stop_times SET trip_id = '6_999' WHERE trip_id = '6_100'", RuntimeError),
+        ]:
+            with self.subTest(change=change):
+                create_original_database(self.old)
+                conn = sqlite3.connect(self.old)
+                conn.execute(change)
+                conn.commit()
+                conn.close()
+                with self.assertRaises(error):
+                    migrate(self.old, self.gtfs_dir, verbose=False)
+                conn = sqlite3.connect(self.old)
+                self.assertEqual(conn.execute('PRAGMA user_version').fetchone(), (0,))
+                conn.close()
+                self.assertFalse(os.path.exists(self.old + '.tmp'))
+                self.assertFalse(snapshot_path(self.old).exists())
+                os.remove(self.old)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from app import app, departures_cache
+from cache import ResponseCache, SqliteStore, departures_request, snap, time_bucket
+
+
+class FakeClock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestRequestKeys(unittest.TestCase):
+
+    def test_nearby_clicks_in_the_same_minute_share_a_key(self):
+        key, snapped = departures_request(
+            51.10921, 17.04151, 51.0740, 17.0070, '2025-04-02T08:10:05Z', 3
+        )
+        other, _ = departures_request(
+            51.10949, 17.04199, 51.0741, 17.0071, '2025-04-02T08:10:59Z', 3
+        )
+        self.assertEqual(key, other)
+        self.assertEqual(snapped[4], '2025-04-02T08:10:00Z')
+        self.assertNotEqual(key, departures_request(
+            51.10921, 17.04151, 51.0740, 17.0070, '2025-04-02T08:11:00Z', 3
+        )[0])
+        self.assertNotEqual(key, departures_request(
+            51.10921, 17.04151, 51.0740, 17.0070, '2025-04-02T08:10:05Z', 5
+        )[0])
+
+    def test_snap_and_bucket(self):
+        self.assertEqual(snap(51.1092, 0.001), 51.1095)
+        self.assertEqual(snap(-0.0004, 0.001), -0.0005)
+        self.assertEqual(time_bucket('2025-04-02T08:14:30+02:00', 5), '2025-04-02T08:10:00+02:00')
+
+
+class TestNonFiniteRequests(unittest.TestCase):
+
+    def test_snap_rejects_non_finite_values(self):
+        for value in (float('nan'), float('inf'), float('-inf')):
+            with self.assertRaises(ValueError):
+                snap(value, 0.001)
+
+    def test_non_finite_coordinates_never_reach_the_cache(self):
+        client = app.test_client()
+        url = ('/public_transport/city/wroclaw/closest_departures?start_coordinates={}'
+               '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T08:10:00Z')
+        with mock.patch.object(departures_cache, 'get_or_compute') as get_or_compute, \
+                mock.patch.object(departures_cache, 'set') as set_entry, \
+                mock.patch.object(departures_cache, 'get') as get_entry:
+            for coordinates in ('nan,17.0414', '51.1093,nan', 'inf,17.0414'):
+                self.assertEqual(client.get(url.format(coordinates)).status_code, 400)
+                self.assertEqual(client.get(url.format(coordinates) + '&format=ndjson')
+                                 .status_code, 400)
+        for method in (get_or_compute, set_entry, get_entry):
+            method.assert_not_called()
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResponseCache(max_entries=2, ttl_seconds=60, clock=self.clock)
+        self.cache.set_generation('1:abc')
+
+    def test_lru_eviction_and_ttl(self):
+        self.cache.set('a', [1])
+        self.cache.set('b', [2])
+        self.assertEqual(self.cache.get('a'), [1])  # 'b' is now the oldest
+        self.cache.set('c', [3])
+        self.assertIsNone(self.cache.get('b'))
+        self.clock.now += 61
+        self.assertIsNone(self.cache.get('a'))
+
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expired']), (1, 1, 1))
+        self.assertEqual(stats['evictions'], 1)
+        self.assertAlmostEqual(stats['hit_rate'], 1 / 3)
+
+    def test_empty_results_are_cached(self):
+        calls = []
+        for _ in range(2):
+            self.cache.get_or_compute('k', lambda: calls.append(1) or [])
+        self.assertEqual(len(calls), 1)
+
+    def test_new_feed_generation_invalidates_entries(self):
+        self.cache.set('a', [1])
+        self.cache.set_generation('1:abc')
+        self.assertEqual(self.cache.get('a'), [1])
+        self.cache.set_generation('2:def')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def test_shared_store_between_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite')
+            first = ResponseCache(store=SqliteStore(path), clock=self.clock)
+            second = ResponseCache(store=SqliteStore(path), clock=self.clock)
+            for cache in (first, second):
+                cache.set_generation('1:abc')
+            first.set('a', [{'trip_id': '6_100'}])
+            self.assertEqual(second.get('a'), [{'trip_id': '6_100'}])
+            self.assertEqual(second.stats()['shared_hits'], 1)
+
+            second.set_generation('2:def')
+            first.set_generation('2:def')
+            self.assertIsNone(first.get('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import database
+from app import app
+from server import AsyncApp
+from subscriptions import get_subscriptions
+from tests.public_transport_api.fixtures import create_database
+
+
+def get(asgi_app, path, query=b''):
+    """Run one GET request through an ASGI app; return (status, headers, body)."""
+    return asyncio.run(request_async(asgi_app, path, query))
+
+
+async def request_async(asgi_app, path, query=b''):
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query,
+             'headers': [(b'host', b'testserver')], 'http_version': '1.1'}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi_app(scope, receive, send)
+    start, body = messages[0], b''.join(m.get('body', b'') for m in messages[1:])
+    return start['status'], dict(start['headers']), body
+
+
+class TestAsyncApp(unittest.TestCase):
+
+    def test_serves_the_flask_app(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'trips.sqlite')
+            create_database(db_path)
+            database.configure(db_path)
+            try:
+                status, headers, body = get(
+                    AsyncApp(app), '/public_transport/city/wroclaw/trip/6_200'
+                )
+            finally:
+                database.get_pool().close_all()
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        self.assertEqual(json.loads(body)['trip_details']['route_id'], 'D')
+
+    def test_streams_body_chunks(self):
+        def streaming_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+            yield b'{"n": 1}\n'
+            yield b''
+            yield b'{"n": 2}\n'
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': []}
+        asyncio.run(AsyncApp(streaming_app)(scope, receive, send))
+        self.assertEqual(
+            [(m.get('body'), m.get('more_body', False)) for m in messages[1:]],
+            [(b'{"n": 1}\n', True), (b'{"n": 2}\n', True), (b'', False)],
+        )
+
+    def test_disconnect_closes_an_endless_body(self):
+        closed = threading.Event()
+
+        def endless_app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/event-stream')])
+            try:
+                while True:
+                    yield b': keepalive\n\n'
+                    time.sleep(0.01)
+            finally:
+                closed.set()
+
+        messages = []
+        received = []
+
+        async def send(message):
+            messages.append(message)
+
+        async def receive():
+            received.append(None)
+            if len(received) == 1:
+                return {'type': 'http.request', 'body': b''}
+            await asyncio.sleep(0.05)
+            return {'type': 'http.disconnect'}
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': []}
+        asyncio.run(AsyncApp(endless_app)(scope, receive, send))
+        self.assertTrue(closed.wait(1))
+        self.assertEqual(messages[-1], {'type': 'http.response.body', 'body': b''})
+
+    def test_open_subscriptions_hold_no_request_thread(self):
+        asgi_app = AsyncApp(app, max_threads=1, max_queue=0, timeout=5)
+        disconnect = None
+
+        async def subscribe():
+            messages, received = [], []
+
+            async def receive():
+                received.append(None)
+                if len(received) == 1:
+                    return {'type': 'http.request', 'body': b''}
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'headers': [],
+                     'path': '/public_transport/city/wroclaw/stop/1/departures/stream'}
+            await asgi_app(scope, receive, send)
+            return messages
+
+        async def health_with_open_streams():
+            nonlocal disconnect
+            disconnect = asyncio.Event()
+            streams = []
+            for count in range(1, 4):
+                # Each one is admitted only once the previous one left the only slot
+                streams.append(asyncio.ensure_future(subscribe()))
+                while get_subscriptions().stats()['streams'] < count or asgi_app.stats()['in_flight']:
+                    await asyncio.sleep(0.01)
+            status = (await request_async(asgi_app, '/healthz'))[0]
+            disconnect.set()
+            return status, await asyncio.gather(*streams)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'trips.sqlite')
+            create_database(db_path)
+            database.configure(db_path)
+            try:
+                status, streams = asyncio.run(asyncio.wait_for(health_with_open_streams(), 5))
+                self.assertEqual(status, 200)
+                for messages in streams:
+                    self.assertEqual(messages[0]['status'], 200)
+                    self.assertIn(b'event: snapshot', messages[1]['body'])
+                    self.assertEqual(messages[-1], {'type': 'http.response.body', 'body': b''})
+                self.assertEqual(get_subscriptions().stats()['streams'], 0)
+                asgi_app._executor.shutdown(wait=True)
+                self.assertEqual(asgi_app.stats()['in_flight'], 0)
+            finally:
+                database.get_pool().close_all()
+
+    def test_rejects_requests_beyond_the_queue(self):
+        release = threading.Event()
+
+        def blocking_app(environ, start_response):
+            release.wait(5)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [environ['QUERY_STRING'].encode()]
+
+        asgi_app = AsyncApp(blocking_app, max_threads=1, max_queue=1, timeout=5)
+
+        async def burst():
+            pending = [asyncio.ensure_future(request_async(asgi_app, '/', b'%d' % i))
+                       for i in range(3)]
+            await asyncio.sleep(0.05)
+            release.set()
+            return await asyncio.gather(*pending)
+
+        responses = asyncio.run(burst())
+        self.assertEqual([status for status, _, _ in responses], [200, 200, 503])
+        self.assertEqual(responses[2][1][b'retry-after'], b'1')
+        self.assertEqual(asgi_app.stats()['rejected'], 1)
+
+    def test_times_out_slow_requests(self):
+        release = threading.Event()
+
+        def slow_app(environ, start_response):
+            release.wait(5)
+            start_response('200 OK', [])
+            return [b'late']
+
+        asgi_app = AsyncApp(slow_app, max_threads=1, max_queue=0, timeout=0.05)
+        status, _, _ = get(asgi_app, '/')
+        self.assertEqual(status, 504)
+        # The timed-out handler still holds its thread until it returns
+        self.assertEqual(get(asgi_app, '/')[0], 503)
+        release.set()
+        asgi_app._executor.shutdown(wait=True)
+        self.assertEqual(asgi_app.stats()['in_flight'], 0)
+
+    def test_closes_the_response_of_a_timed_out_request(self):
+        release = threading.Event()
+        closed = []
+
+        class AsyncBody:
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                raise StopAsyncIteration
+
+            def close(self):
+                closed.append('async')
+
+        def sync_body():
+            try:
+                yield b'late'
+            finally:
+                closed.append('sync')
+
+        def slow_app(environ, start_response):
+            release.wait(5)
+            start_response('200 OK', [])
+            return AsyncBody() if environ['PATH_INFO'] == '/stream' else sync_body()
+
+        asgi_app = AsyncApp(slow_app, max_threads=2, max_queue=0, timeout=0.05)
+
+        async def time_out_both():
+            responses = await asyncio.gather(request_async(asgi_app, '/stream'),
+                                             request_async(asgi_app, '/'))
+            release.set()
+            return [status for status, _, _ in responses]
+
+        self.assertEqual(asyncio.run(time_out_both()), [504, 504])
+        asgi_app._executor.shutdown(wait=True)
+        self.assertEqual(sorted(closed), ['async', 'sync'])
+
+
+if __name__ == '__main__':
+    unittest.main()
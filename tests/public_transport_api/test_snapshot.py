@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import database
+import models
+from journeys import JourneyPlanner
+from snapshot import MappedTimetable, snapshot_path, write_snapshot
+from tests.public_transport_api.fixtures import create_database
+from timetable import Timetable
+
+
+class TestTimetableSnapshot(unittest.TestCase):
+    """The mapped snapshot must answer exactly like the timetable it was written from."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(self.db_path)
+        database.configure(self.db_path)
+        self.engine = Timetable.from_connection(database.get_db_connection())
+        self.mapped = MappedTimetable.open(snapshot_path(self.db_path), models.get_feed_version())
+
+    def tearDown(self):
+        models.set_backend('sqlite')
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def test_import_writes_the_snapshot(self):
+        self.assertIsInstance(self.mapped, MappedTimetable)
+        self.assertEqual(self.mapped.memory_footprint(),
+                         os.path.getsize(snapshot_path(self.db_path)))
+
+    def test_trip_details_match_timetable(self):
+        for trip_id in ['6_100', '6_101', '7_190', '6_200', 'missing', '']:
+            trip, stops = self.mapped.get_trip_details(trip_id)
+            expected_trip, expected_stops = self.engine.get_trip_details(trip_id)
+            if expected_trip is None:
+                self.assertIsNone(trip)
+                continue
+            for key in ('trip_id', 'route_id', 'trip_headsign', 'service_id', 'direction_id'):
+                self.assertEqual(trip[key], expected_trip[key])
+            self.assertEqual(stops, expected_stops)
+
+    def test_departures_match_timetable(self):
+        stop_ids = [3, 1, 2, 4, 99]
+        for destination in (None, (51.0740, 17.0070), (51.1092, 17.0415), (51.2, 17.2)):
+            for date in (None, 20250401, 20250402, 20250405, 20250501):
+                for start_sec in (0, 45 * 60, *range(7 * 3600, 10 * 3600, 600), 23 * 3600):
+                    self.assertEqual(
+                        self.mapped.departures(stop_ids, start_sec, 20, destination, date),
+                        self.engine.departures(stop_ids, start_sec, 20, destination, date),
+                    )
+
+    def test_journeys_match_timetable(self):
+        footpaths = [[] for _ in self.engine.stops]
+        planners = [JourneyPlanner(timetable, footpaths) for timetable in (self.mapped, self.engine)]
+        for start_sec in range(7 * 3600, 10 * 3600, 900):
+            for date in (None, 20250402, 20250405):
+                legs = [planner.earliest_arrival([(3, 60), (1, 120)], [(4, 30)], start_sec, date)
+                        for planner in planners]
+                self.assertEqual(legs[0], legs[1])
+
+    def test_snapshot_of_another_feed_version_is_not_used(self):
+        path = snapshot_path(self.db_path)
+        self.assertIsNone(MappedTimetable.open(path, 'older'))
+        self.assertIsNone(MappedTimetable.open(path.with_suffix('.missing'), 'older'))
+        with open(path, 'r+b') as f:
+            f.write(b'NOTATIMETABLE')
+        self.assertIsNone(MappedTimetable.open(path, models.get_feed_version()))
+
+    def test_memory_backend_maps_the_snapshot(self):
+        models.set_backend('memory')
+        self.assertIsInstance(models.get_backend(), MappedTimetable)
+
+        database.configure(self.db_path)
+        os.remove(snapshot_path(self.db_path))
+        self.assertNotIsInstance(models.get_backend(), MappedTimetable)
+
+        write_snapshot(self.db_path, 'older')
+        database.configure(self.db_path)
+        self.assertNotIsInstance(models.get_backend(), MappedTimetable)
+
+    def test_snapshot_can_be_turned_off(self):
+        models.set_backend('memory')
+        with mock.patch.object(models, 'USE_SNAPSHOT', False):
+            self.assertNotIsInstance(models.get_backend(), MappedTimetable)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import random
+import unittest
+
+from spatial import StopIndex
+from utils import haversine
+
+
+def make_stops(count, seed=7):
+    rng = random.Random(seed)
+    return [
+        {
+            "stop_id": stop_id,
+            "stop_code": stop_id,
+            "stop_name": f"Stop {stop_id}",
+            "stop_lat": rng.uniform(51.04, 51.18),
+            "stop_lon": rng.uniform(16.90, 17.15),
+        }
+        for stop_id in range(count)
+    ]
+
+
+def scan_nearest(stops, lat, lon, k, radius_km=None):
+    ranked = sorted(
+        (haversine(lat, lon, s["stop_lat"], s["stop_lon"]), s["stop_id"]) for s in stops
+    )
+    if radius_km is not None:
+        ranked = [item for item in ranked if item[0] <= radius_km]
+    return [stop_id for _, stop_id in ranked[:k]]
+
+
+class TestStopIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.stops = make_stops(500)
+        self.index = StopIndex(self.stops, cell_size_km=0.4)
+
+    def test_nearest_matches_full_scan(self):
+        rng = random.Random(3)
+        for _ in range(100):
+            lat, lon = rng.uniform(51.0, 51.2), rng.uniform(16.85, 17.2)
+            result = [stop["stop_id"] for _, stop in self.index.nearest(lat, lon, k=20)]
+            self.assertEqual(result, scan_nearest(self.stops, lat, lon, 20))
+
+    def test_nearest_respects_radius(self):
+        lat, lon = 51.11, 17.03
+        result = self.index.nearest(lat, lon, k=50, radius_km=1.0)
+        self.assertTrue(all(distance <= 1.0 for distance, _ in result))
+        self.assertEqual(
+            [stop["stop_id"] for _, stop in result],
+            scan_nearest(self.stops, lat, lon, 50, radius_km=1.0),
+        )
+
+    def test_query_far_outside_the_grid(self):
+        result = self.index.nearest(52.23, 21.01, k=3)
+        self.assertEqual(
+            [stop["stop_id"] for _, stop in result],
+            scan_nearest(self.stops, 52.23, 21.01, 3),
+        )
+
+    def test_get_and_empty_index(self):
+        self.assertEqual(self.index.get(42)["stop_name"], "Stop 42")
+        self.assertIsNone(self.index.get(-1))
+        self.assertEqual(StopIndex([]).nearest(51.1, 17.0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
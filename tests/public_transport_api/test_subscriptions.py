@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import database
+from app import app
+from boards import get_departure_boards
+from subscriptions import Subscriptions, diff, get_subscriptions
+from tests.public_transport_api.fixtures import create_database
+from tests.public_transport_api.test_boards import Clock
+
+STREAM_URL = '/public_transport/city/wroclaw/stop/{}/departures/stream'
+QUERY_STREAM_URL = ('/public_transport/city/wroclaw/closest_departures/stream'
+                    '?start_coordinates=51.1093,17.0414&end_coordinates=51.0740,17.0070')
+
+
+def departure(trip_id, time, headsign='KRZYKI'):
+    return {'trip_id': trip_id, 'trip_headsign': headsign, 'stop': {'departure_time': time}}
+
+
+def parse_events(chunk):
+    """Return the ``(event, data)`` pairs of a chunk of Server-Sent Events."""
+    events = []
+    for block in chunk.decode().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line)
+        if 'event' in lines:
+            events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+class FakeTopicSource:
+
+    def __init__(self, departures):
+        self.departures = departures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return '2025-04-02T08:00:00Z', list(self.departures)
+
+
+class TestSubscriptions(unittest.TestCase):
+
+    def test_diff(self):
+        a, b, c = departure('1', '08:00'), departure('2', '08:05'), departure('3', '08:09')
+        self.assertIsNone(diff([a, b], [a, b]))
+        self.assertEqual(diff([a, b], [b, c]), {
+            'removed': [{'trip_id': '1', 'departure_time': '08:00'}],
+            'added': [{'index': 1, 'departure': c}],
+        })
+        changed = departure('2', '08:05', headsign='RENOMA')
+        self.assertEqual(diff([a, b], [a, changed])['added'], [{'index': 1, 'departure': changed}])
+        self.assertIs(diff([a, b], [b, a]), False)
+
+    def test_subscribers_of_a_key_share_one_evaluation_per_tick(self):
+        subscriptions = Subscriptions(pool=None, keepalive_seconds=0)
+        source = FakeTopicSource([departure('1', '08:00'), departure('2', '08:05')])
+        first = subscriptions.subscribe('stop:1', source)
+        second = subscriptions.subscribe('stop:1', source)
+        self.assertIs(first, second)
+        streams = [subscriptions.stream(first), subscriptions.stream(second)]
+        snapshots = [next(stream) for stream in streams]
+        self.assertEqual(parse_events(snapshots[0])[0][0], 'snapshot')
+        self.assertIs(snapshots[0], snapshots[1])
+
+        source.departures = [departure('2', '08:05'), departure('3', '08:20')]
+        subscriptions.tick()
+        subscriptions.tick()  # unchanged: nothing to send
+        self.assertEqual(source.calls, 3)
+        diffs = [next(stream) for stream in streams]
+        self.assertIs(diffs[0], diffs[1])
+        [(name, data)] = parse_events(diffs[0])
+        self.assertEqual(name, 'diff')
+        self.assertEqual(data['removed'], [{'trip_id': '1', 'departure_time': '08:00'}])
+        self.assertEqual([next(stream) for stream in streams], [b': keepalive\n\n'] * 2)
+
+        stats = subscriptions.stats()
+        self.assertEqual((stats['topics'], stats['streams'], stats['changes']), (1, 2, 1))
+        for stream in streams:
+            stream.close()
+        self.assertEqual((subscriptions.stats()['topics'], subscriptions.stats()['streams']),
+                         (0, 0))
+
+    def test_lagging_subscribers_get_a_snapshot(self):
+        subscriptions = Subscriptions(pool=None, keepalive_seconds=0)
+        source = FakeTopicSource([])
+        stream = subscriptions.stream(subscriptions.subscribe('stop:1', source))
+        next(stream)
+        for minute in range(30):
+            source.departures = [departure('1', f'08:{minute:02}')]
+            subscriptions.tick()
+        [(name, data)] = parse_events(next(stream))
+        self.assertEqual((name, data['departures']), ('snapshot', source.departures))
+        stream.close()
+
+    def test_streams_await_events_on_the_event_loop(self):
+        subscriptions = Subscriptions(pool=None, keepalive_seconds=5)
+        source = FakeTopicSource([departure('1', '08:00')])
+        closed = []
+        stream = subscriptions.stream(subscriptions.subscribe('stop:1', source), 'head\n',
+                                      on_close=lambda: closed.append(True))
+
+        async def take_two():
+            first = await stream.__anext__()
+            source.departures = [departure('2', '08:05')]
+            # Published from another thread, like the minute tick
+            threading.Timer(0.05, subscriptions.tick).start()
+            return first, await asyncio.wait_for(stream.__anext__(), 1)
+
+        first, second = asyncio.run(take_two())
+        self.assertTrue(first.startswith(b'head\n'))
+        self.assertEqual(parse_events(first)[0][0], 'snapshot')
+        self.assertEqual(parse_events(second)[0][0], 'diff')
+        stream.close()
+        stream.close()
+        self.assertEqual((subscriptions.stats()['streams'], closed), (0, [True]))
+
+    def test_stream_limit(self):
+        subscriptions = Subscriptions(pool=None, max_streams=1)
+        topic = subscriptions.subscribe('stop:1', FakeTopicSource([]))
+        self.assertIsNone(subscriptions.subscribe('stop:2', FakeTopicSource([])))
+        subscriptions.unsubscribe(topic)
+        self.assertIsNotNone(subscriptions.subscribe('stop:2', FakeTopicSource([])))
+
+
+class TestSubscriptionEndpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(db_path)
+        database.configure(db_path)
+        self.client = app.test_client()
+        self.clock = Clock(datetime(2025, 4, 2, 8, 3, 27))
+        patcher = mock.patch.object(get_departure_boards(), '_clock', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def test_stop_stream(self):
+        response = self.client.get(STREAM_URL.format(1) + '?limit=2', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        (_, metadata), (_, snapshot) = parse_events(next(chunks))
+        self.assertEqual(metadata['query_parameters'], {'stop_id': 1, 'limit': 2})
+        self.assertEqual(snapshot['start_time'], '2025-04-02T08:03:00Z')
+        self.assertEqual([d['trip_id'] for d in snapshot['departures']], ['6_101', '6_200'])
+
+        # A second display on the same stop shares the topic
+        other = self.client.get(STREAM_URL.format(1) + '?limit=2', buffered=False)
+        next(iter(other.response))
+        self.assertEqual(get_subscriptions().stats()['topics'], 1)
+
+        self.clock.moment = datetime(2025, 4, 2, 8, 25)
+        get_subscriptions().tick()
+        [(name, data)] = parse_events(next(chunks))
+        self.assertEqual(name, 'diff')
+        self.assertEqual(data['start_time'], '2025-04-02T08:25:00Z')
+        self.assertEqual(data['removed'],
+                         [{'trip_id': '6_101', 'departure_time': '2025-04-02T08:20:00Z'}])
+        self.assertEqual(data['added'], [])
+
+        response.close()
+        other.close()
+        self.assertEqual(get_subscriptions().stats()['streams'], 0)
+
+    def test_query_stream(self):
+        response = self.client.get(QUERY_STREAM_URL, buffered=False)
+        self.assertEqual(response.status_code, 200)
+        (_, metadata), (_, snapshot) = parse_events(next(iter(response.response)))
+        self.assertEqual(metadata['query_parameters']['limit'], 3)
+        self.assertEqual(snapshot['start_time'], '2025-04-02T08:03:00Z')
+        response.close()
+        polled = self.client.get(QUERY_STREAM_URL.replace('/stream', '')
+                                 + '&start_time=2025-04-02T08:03:00Z')
+        self.assertEqual(snapshot['departures'], json.loads(polled.data)['departures'])
+        self.assertTrue(snapshot['departures'])
+
+    def test_invalid_subscriptions(self):
+        self.assertEqual(self.client.get(STREAM_URL.format(99)).status_code, 404)
+        self.assertEqual(self.client.get(STREAM_URL.format(1) + '?limit=x').status_code, 400)
+        url = '/public_transport/city/wroclaw/closest_departures/stream'
+        self.assertEqual(self.client.get(url).status_code, 400)
+        with mock.patch.object(get_subscriptions(), 'max_streams', 0):
+            response = self.client.get(STREAM_URL.format(1))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '5')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+
+import database
+import models
+from tests.public_transport_api.fixtures import FEED, create_database
+from timetable import Timetable
+
+
+class TestTimetableEngine(unittest.TestCase):
+    """The in-memory engine must answer exactly like the SQLite backend."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(db_path)
+        database.configure(db_path)
+        self.engine = Timetable.from_connection(database.get_db_connection())
+        self.sqlite = models.SqliteBackend()
+
+    def tearDown(self):
+        models.set_backend('sqlite')
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def test_trip_details_match_sqlite(self):
+        for trip_id in ['6_100', '6_101', '7_190', '6_200', 'missing']:
+            trip, stops = self.engine.get_trip_details(trip_id)
+            expected_trip, expected_stops = self.sqlite.get_trip_details(trip_id)
+            if expected_trip is None:
+                self.assertIsNone(trip)
+                continue
+            self.assertEqual(trip['route_id'], expected_trip['route_id'])
+            self.assertEqual(trip['trip_headsign'], expected_trip['trip_headsign'])
+            self.assertEqual(stops, [dict(row) for row in expected_stops])
+
+    def test_departures_match_sqlite(self):
+        stop_ids = [3, 1, 2, 4, 99]
+        for start_sec in range(7 * 3600, 10 * 3600, 300):
+            for limit in (1, 3, 20):
+                self.assertEqual(
+                    self.engine.departures(stop_ids, start_sec, limit),
+                    [dict(row) for row in self.sqlite.departures(stop_ids, start_sec, limit)],
+                )
+
+    def test_heading_filter_matches_sqlite(self):
+        stop_ids = [3, 1, 2, 4]
+        destinations = [(51.0740, 17.0070), (51.1092, 17.0415), (51.1040, 17.0280), (51.2, 17.2)]
+        for destination in destinations:
+            for start_sec in range(7 * 3600, 10 * 3600, 600):
+                self.assertEqual(
+                    self.engine.departures(stop_ids, start_sec, 20, destination),
+                    [dict(row) for row in
+                     self.sqlite.departures(stop_ids, start_sec, 20, destination)],
+                )
+
+    def test_service_date_filter_matches_sqlite(self):
+        stop_ids = [3, 1, 2, 4]
+        for date in (20250401, 20250402, 20250403, 20250404, 20250405, 20250501):
+            for destination in (None, (51.0740, 17.0070)):
+                for start_sec in (0, 45 * 60, 7 * 3600, 23 * 3600):
+                    self.assertEqual(
+                        self.engine.departures(stop_ids, start_sec, 20, destination, date),
+                        [dict(row) for row in
+                         self.sqlite.departures(stop_ids, start_sec, 20, destination, date)],
+                    )
+
+    def test_batch_matches_sqlite(self):
+        destination = (51.0740, 17.0070)
+        queries = [([3, 1, 2, 4], start_sec, limit, destination, date)
+                   for start_sec in (0, *range(7 * 3600, 10 * 3600, 900)) for limit in (1, 5)
+                   for date in (None, 20250401, 20250402, 20250403)]
+        self.assertEqual(
+            self.engine.departures_batch(queries), self.sqlite.departures_batch(queries)
+        )
+
+    def test_models_switch_backend(self):
+        models.set_backend('memory')
+        self.assertIsInstance(models.get_backend(), Timetable)
+        departures = models.get_closest_departures(
+            51.1093, 17.0414, 51.0740, 17.0070, '2025-04-02T08:10:00Z', 3
+        )
+        self.assertEqual([d['trip_id'] for d in departures], ['6_101', '6_101', '6_100'])
+        with self.assertRaises(ValueError):
+            models.set_backend('postgres')
+
+    def test_trip_slices_are_contiguous(self):
+        trips = {trip.trip_id: trip for trip in self.engine.trips}
+        for trip_id in {row[0] for row in FEED['stop_times.txt'][1:]}:
+            trip = trips[trip_id]
+            self.assertEqual(trip.end - trip.start, 4)
+        self.assertGreater(self.engine.memory_footprint(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
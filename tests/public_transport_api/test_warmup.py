@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import database
+import models
+import warmup
+from app import app, departures_cache, trip_details_cache
+from spatial import StopIndex, StopScan
+from tests.public_transport_api.fixtures import create_database
+from timetable import Timetable
+
+DEPARTURES_URL = ('/public_transport/city/wroclaw/closest_departures?start_coordinates=51.1093,17.0414'
+                  '&end_coordinates=51.0740,17.0070&start_time=2025-04-02T08:10:00Z')
+
+
+class TestWarmup(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp.name, 'trips.sqlite')
+        create_database(db_path)
+        self.pool = database.configure(db_path)
+        self.client = app.test_client()
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        for cache in (departures_cache, trip_details_cache):
+            cache.clear()
+        models.set_backend('sqlite')
+        database.get_pool().close_all()
+        self.tmp.cleanup()
+
+    def blocked(self, build):
+        def wait_then_build(conn):
+            self.release.wait(5)
+            return build(conn)
+        return wait_then_build
+
+    def start(self, steps):
+        patcher = mock.patch.object(warmup, '_current', warmup.Warmup(self.pool, steps))
+        self.addCleanup(patcher.stop)
+        return patcher.start().start()
+
+    def test_stop_scan_matches_stop_index(self):
+        index = StopIndex.from_connection(database.get_db_connection())
+        scan = StopScan(database.get_db_connection)
+        for lat, lon in [(51.1093, 17.0414), (51.0740, 17.0070), (52.0, 18.0)]:
+            for k, radius_km in [(20, None), (2, None), (20, 0.8), (20, 5.0), (0, None)]:
+                self.assertEqual(scan.nearest(lat, lon, k, radius_km),
+                                 index.nearest(lat, lon, k, radius_km))
+        self.assertEqual(scan.get(3), index.get(3))
+        self.assertIsNone(scan.get(99))
+
+    def test_requests_use_sql_until_the_warmup_is_done(self):
+        expected = json.loads(self.client.get(DEPARTURES_URL).data)['departures']
+        departures_cache.clear()
+        self.pool.close_all()
+        models.set_backend('memory')
+        steps = models.warmup_steps()
+        name, build = steps[1]
+        self.assertEqual(name, 'stop_index')
+        warm = self.start([steps[0], (name, self.blocked(build)), *steps[2:]])
+
+        self.assertIsInstance(models.get_stop_index(), StopScan)
+        self.assertIsInstance(models.get_backend(), models.SqliteBackend)
+        response = self.client.get(DEPARTURES_URL)
+        self.assertEqual(json.loads(response.data)['departures'], expected)
+        self.assertEqual(self.client.get('/healthz').status_code, 200)
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.data)['warmup']['state'], 'running')
+
+        self.release.set()
+        self.assertTrue(warm.wait(5))
+        self.assertIsInstance(models.get_stop_index(), StopIndex)
+        self.assertIsInstance(models.get_backend(), Timetable)
+        response = self.client.get('/readyz')
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.data)
+        self.assertEqual(body['status'], 'ready')
+        self.assertEqual(set(body['warmup']['seconds']),
+                         {name for name, _ in steps} | {'total'})
+
+    def test_a_failed_warmup_leaves_the_builds_to_requests(self):
+        def fail(conn):
+            raise RuntimeError('disk gone')
+
+        warm = self.start([('stop_index', fail)])
+        self.assertTrue(warm.wait(5))
+        self.assertFalse(self.pool.defer_builds)
+        self.assertEqual(warm.stats()['error'], 'RuntimeError: disk gone')
+        self.assertEqual(self.client.get('/readyz').status_code, 503)
+        self.assertIsInstance(models.get_stop_index(), StopIndex)
+
+    def test_ready_without_a_warmup_once_a_feed_is_imported(self):
+        with mock.patch.object(warmup, '_current', None):
+            response = self.client.get('/readyz')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)['warmup'], {'state': 'lazy'})
+
+            database.configure(os.path.join(self.tmp.name, 'missing.sqlite'))
+            response = self.client.get('/readyz')
+            self.assertEqual(response.status_code, 503)
+            self.assertIsNone(json.loads(response.data)['feed_version'])
+
+    def test_startup_mode_comes_from_the_environment(self):
+        with mock.patch.dict(os.environ, {'WARMUP': 'lazy'}):
+            self.assertIsNone(warmup.start())
+        with mock.patch.dict(os.environ, {'WARMUP': 'eager'}):
+            with self.assertRaises(ValueError):
+                warmup.start()
+
+
+if __name__ == '__main__':
+    unittest.main()